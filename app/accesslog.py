@@ -0,0 +1,133 @@
+# app/accesslog.py
+"""Structured access log written off the request path.
+
+One JSON line per request with ``method``, ``path``, ``status`` and
+``duration_ms``, plus the fields handlers attach with :func:`note` (e.g.
+``resolver``, ``cache``).  Records go through a ``QueueHandler``; formatting
+and I/O happen in the ``QueueListener`` thread started by
+:func:`start_access_log`, so the event loop only pays for a dict and a
+``put_nowait``.  When the queue is full records are dropped, never waited on.
+
+Successful requests are sampled (``ACCESS_LOG_SAMPLE``, 0..1); errors and
+slow requests (``ACCESS_LOG_SLOW_MS``) are always logged.  The query string
+(Xtream credentials travel there) and the request headers are only included
+when ``ACCESS_LOG_LEVEL`` is ``DEBUG``, with credentials redacted.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import urllib.parse
+from typing import Any, Dict, Optional
+
+from fastapi import Request
+
+ACCESS_LOG = os.environ.get("ACCESS_LOG", "1").lower() not in ("0", "false", "no", "off")
+ACCESS_LOG_LEVEL = os.environ.get("ACCESS_LOG_LEVEL", "INFO").upper()
+ACCESS_LOG_SAMPLE = float(os.environ.get("ACCESS_LOG_SAMPLE", "1"))
+ACCESS_LOG_SLOW_MS = float(os.environ.get("ACCESS_LOG_SLOW_MS", "1000"))
+ACCESS_LOG_QUEUE = int(os.environ.get("ACCESS_LOG_QUEUE", "10000"))
+
+REDACTED_HEADERS = frozenset({"authorization", "cookie", "proxy-authorization", "x-api-key"})
+REDACTED_PARAMS = frozenset({"password", "token", "api_key"})
+
+logger = logging.getLogger("app.access")
+logger.propagate = False
+logger.setLevel(getattr(logging, ACCESS_LOG_LEVEL, logging.INFO))
+
+# fields of the request being served; handlers add to the dict in place, so
+# values set in threadpool workers or child tasks are seen by the middleware
+_FIELDS: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "access_log_fields", default=None)
+
+_LISTENER: Optional[logging.handlers.QueueListener] = None
+
+
+def note(**fields: Any) -> None:
+    """Attach *fields* to the access log line of the current request."""
+    current = _FIELDS.get()
+    if current is not None:
+        current.update(fields)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the record is formatted by the listener, not here
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(getattr(record, "access", {}), ensure_ascii=False, separators=(",", ":"))
+
+
+def start_access_log(stream=None) -> None:
+    """Attach the queue handler and start the writer thread (idempotent)."""
+    global _LISTENER
+    if _LISTENER is not None or not ACCESS_LOG:
+        return
+    q: queue.Queue = queue.Queue(ACCESS_LOG_QUEUE)
+    target = logging.StreamHandler(stream or sys.stderr)
+    target.setFormatter(JsonFormatter())
+    logger.addHandler(_DroppingQueueHandler(q))
+    _LISTENER = logging.handlers.QueueListener(q, target)
+    _LISTENER.start()
+
+
+def stop_access_log() -> None:
+    """Flush the pending records and detach the handler."""
+    global _LISTENER
+    listener, _LISTENER = _LISTENER, None
+    if listener is None:
+        return
+    for h in list(logger.handlers):
+        if isinstance(h, _DroppingQueueHandler):
+            logger.removeHandler(h)
+    listener.stop()
+
+
+def begin_request() -> Dict[str, Any]:
+    fields: Dict[str, Any] = {}
+    _FIELDS.set(fields)
+    return fields
+
+
+def _sampled(status: int, duration_ms: float) -> bool:
+    if status >= 400 or duration_ms >= ACCESS_LOG_SLOW_MS:
+        return True
+    return ACCESS_LOG_SAMPLE >= 1 or random.random() < ACCESS_LOG_SAMPLE
+
+
+def log_request(request: Request, status: int, duration_ms: float, fields: Dict[str, Any]) -> None:
+    """Queue the access line for *request* if sampling keeps it."""
+    if not logger.handlers or not _sampled(status, duration_ms):
+        return
+    entry: Dict[str, Any] = {
+        "method": request.method,
+        "path": request.url.path,
+        "status": status,
+        "duration_ms": round(duration_ms, 2),
+        **fields,
+    }
+    if logger.isEnabledFor(logging.DEBUG):
+        if request.url.query:
+            entry["query"] = urllib.parse.urlencode(
+                [(k, "***" if k in REDACTED_PARAMS else v)
+                 for k, v in urllib.parse.parse_qsl(request.url.query, keep_blank_values=True)])
+        entry["headers"] = {k: ("***" if k in REDACTED_HEADERS else v)
+                            for k, v in request.headers.items()}
+        logger.debug("access", extra={"access": entry})
+    else:
+        logger.info("access", extra={"access": entry})
@@ -1,13 +1,19 @@
 import json
+import os
 import subprocess
+import time
 from typing import Optional
 
+from .metrics import RESOLVE_SECONDS, RESOLVER_ATTEMPT_SECONDS, RESOLVER_SUBPROCESS_TOTAL
+
 class ResolverError(Exception):
     pass
 
-def _run(cmd, *, cwd=None, timeout=30, input_text: Optional[str] = None):
+def _run(cmd, *, mode: str, script: str, cwd=None, timeout=30, input_text: Optional[str] = None):
+    t0 = time.perf_counter()
+    result = "launch_error"
     try:
-        return subprocess.run(
+        proc = subprocess.run(
             cmd,
             input=input_text,
             capture_output=True,
@@ -15,8 +21,16 @@ def _run(cmd, *, cwd=None, timeout=30, input_text: Optional[str] = None):
             cwd=cwd,
             timeout=timeout,
         )
+        result = str(proc.returncode)
+        return proc
+    except subprocess.TimeoutExpired as e:
+        result = "timeout"
+        raise ResolverError(f"launch_error: {e}")
     except Exception as e:
         raise ResolverError(f"launch_error: {e}")
+    finally:
+        RESOLVER_ATTEMPT_SECONDS.observe(time.perf_counter() - t0, script, mode)
+        RESOLVER_SUBPROCESS_TOTAL.inc(mode, result)
 
 def _as_json_or_url(stdout: str):
     out = (stdout or "").strip()
@@ -55,28 +69,39 @@ def run_resolver(
     Accetta stdout come JSON o URL semplice.
     """
     payload = {"url": url, "headers": headers or {}, "kind": kind}
+    script = os.path.basename(script_path)
+    t0 = time.perf_counter()
+    mode = "failed"
+    try:
+        # 1) argv semplice
+        proc = _run([python_command, script_path, url], mode="argv", script=script,
+                    cwd=cwd, timeout=timeout)
+        parsed = _as_json_or_url(proc.stdout)
+        if parsed:
+            mode = "argv"
+            parsed.setdefault("ok", True)
+            return parsed
 
-    # 1) argv semplice
-    proc = _run([python_command, script_path, url], cwd=cwd, timeout=timeout)
-    parsed = _as_json_or_url(proc.stdout)
-    if parsed:
-        parsed.setdefault("ok", True)
-        return parsed
-
-    # 2) prova flag --json (se lo script lo supporta)
-    proc2 = _run([python_command, script_path, "--json", url], cwd=cwd, timeout=timeout)
-    parsed2 = _as_json_or_url(proc2.stdout)
-    if parsed2:
-        parsed2.setdefault("ok", True)
-        return parsed2
+        # 2) prova flag --json (se lo script lo supporta)
+        proc2 = _run([python_command, script_path, "--json", url], mode="json", script=script,
+                     cwd=cwd, timeout=timeout)
+        parsed2 = _as_json_or_url(proc2.stdout)
+        if parsed2:
+            mode = "json"
+            parsed2.setdefault("ok", True)
+            return parsed2
 
-    # 3) stdin JSON
-    proc3 = _run([python_command, script_path], cwd=cwd, timeout=timeout, input_text=json.dumps(payload))
-    parsed3 = _as_json_or_url(proc3.stdout)
-    if parsed3:
-        parsed3.setdefault("ok", True)
-        return parsed3
+        # 3) stdin JSON
+        proc3 = _run([python_command, script_path], mode="stdin", script=script,
+                     cwd=cwd, timeout=timeout, input_text=json.dumps(payload))
+        parsed3 = _as_json_or_url(proc3.stdout)
+        if parsed3:
+            mode = "stdin"
+            parsed3.setdefault("ok", True)
+            return parsed3
 
-    # Nessuna modalità ha funzionato → errore parlante
-    detail = " | ".join([_err_detail(proc), _err_detail(proc2), _err_detail(proc3)])
-    raise ResolverError(f"no_usable_output ({detail})")
+        # Nessuna modalità ha funzionato → errore parlante
+        detail = " | ".join([_err_detail(proc), _err_detail(proc2), _err_detail(proc3)])
+        raise ResolverError(f"no_usable_output ({detail})")
+    finally:
+        RESOLVE_SECONDS.observe(time.perf_counter() - t0, script, mode)
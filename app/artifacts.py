@@ -0,0 +1,550 @@
+# app/artifacts.py
+"""Pre-rendered response bodies stored on disk.
+
+Large read-only responses (``get.php`` playlists, Xtream lists) are rendered
+once when the cache is built and then streamed from disk.  Every artifact is
+described by a small ``meta`` dict (``etag``/``size``/``encodings``) kept by
+the caller, so validators can be checked without touching the body.
+
+Compressed variants (``.gz`` and, when ``zstandard`` is installed, ``.zst``)
+are written next to the plain file in the same pass and picked per request
+from ``Accept-Encoding``; nothing is compressed at request time.
+
+The conditional GET helpers (``ETag``/``Last-Modified`` → ``304``) are shared
+with the other read endpoints.
+
+Artifacts flagged ``templated`` contain :data:`HOST_TOKEN` instead of the
+client-facing base URL and are streamed with the request base spliced in.
+Their compressed variants hold every run of bytes between two tokens as its
+own gzip member / zstd frame (both formats allow concatenation), with the
+member lengths in a ``.idx`` file; the base is compressed once per host and
+inserted between them.  The writer counts the tokens, so the length of every
+rendering is known up front.  Nothing is written per host.
+"""
+from __future__ import annotations
+
+import array
+import email.utils
+import functools
+import gzip
+import hashlib
+import json
+import os
+import urllib.parse
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+
+try:  # optional: zstd variants are skipped when the module is missing
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+# Bodies smaller than this are not worth a compressed variant
+MIN_COMPRESS_SIZE = int(os.environ.get("ARTIFACT_MIN_COMPRESS_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("ARTIFACT_GZIP_LEVEL", "9"))
+ZSTD_LEVEL = int(os.environ.get("ARTIFACT_ZSTD_LEVEL", "12"))
+# Longest run of a templated body compressed as a single member
+MAX_MEMBER_SIZE = 1024 * 1024
+
+# Placeholder for the client-facing base URL in host-templated bodies.  ``@``
+# is percent-encoded inside the wrapped ``u=`` URLs, so it cannot collide.
+HOST_TOKEN = "@@stream-resolver-base@@"
+_HOST_TOKEN_B = HOST_TOKEN.encode("ascii")
+
+# encoding -> (file suffix, etag suffix), in order of preference
+ENCODINGS: Dict[str, Tuple[str, str]] = {
+    "zstd": (".zst", "-zst"),
+    "gzip": (".gz", "-gz"),
+}
+
+
+def iter_chunks(lines: Iterable[str], size: int = CHUNK_SIZE) -> Iterable[bytes]:
+    """Group text *lines* into UTF-8 chunks of roughly *size* bytes."""
+    buf: list = []
+    buf_len = 0
+    for line in lines:
+        b = (line + "\n").encode("utf-8")
+        buf.append(b)
+        buf_len += len(b)
+        if buf_len >= size:
+            yield b"".join(buf)
+            buf, buf_len = [], 0
+    if buf:
+        yield b"".join(buf)
+
+
+def json_chunks(data: Any) -> Iterable[bytes]:
+    """Serialize *data* like FastAPI's ``JSONResponse`` does."""
+    yield json.dumps(data, ensure_ascii=False, allow_nan=False,
+                     separators=(",", ":")).encode("utf-8")
+
+
+def _variant_writers(path: str) -> List[Tuple[str, str, Any, Any]]:
+    """Open ``(encoding, tmp_path, raw_file, writer)`` for every variant."""
+    out = []
+    raw = open(path + ".gz.tmp", "wb")
+    out.append(("gzip", path + ".gz", raw,
+                gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)))
+    if zstandard is not None:
+        raw = open(path + ".zst.tmp", "wb")
+        out.append(("zstd", path + ".zst", raw,
+                    zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False)))
+    return out
+
+
+def _compress_member(encoding: str, data: bytes, zctx: Any = None) -> bytes:
+    """*data* as one standalone gzip member / zstd frame.
+
+    One-shot calls let zlib/zstd size their tables to the input, which keeps
+    thousands of small members cheap.  *zctx* is a reusable
+    ``ZstdCompressor`` (not shared across threads).
+    """
+    if encoding == "gzip":
+        # wbits=31: gzip header (mtime 0) and trailer around the deflate data
+        return zlib.compress(data, GZIP_LEVEL, wbits=31)
+    return (zctx or zstandard.ZstdCompressor(level=ZSTD_LEVEL)).compress(data)
+
+
+class _SegmentedVariant:
+    """Compressed variant of a templated body, one member per run between tokens."""
+
+    def __init__(self, encoding: str, final: str):
+        self.encoding = encoding
+        self.final = final
+        self.lengths = array.array("I")
+        self._raw = open(final + ".tmp", "wb")
+        self._n = 0
+        self._zctx: Any = None
+
+    def add(self, data: bytes) -> None:
+        # empty runs (adjacent tokens) get no member at all
+        if data:
+            if self.encoding == "zstd" and self._zctx is None:
+                self._zctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+            out = _compress_member(self.encoding, data, self._zctx)
+            self._raw.write(out)
+            self._n += len(out)
+
+    def end(self) -> None:
+        """Close the current run: the host goes after it."""
+        self.lengths.append(self._n)
+        self._n = 0
+
+    def close(self) -> None:
+        if self._raw.closed:
+            return
+        self._raw.close()
+        with open(self.final + ".idx.tmp", "wb") as f:
+            self.lengths.tofile(f)
+
+    def commit(self) -> None:
+        os.replace(self.final + ".tmp", self.final)
+        os.replace(self.final + ".idx.tmp", self.final + ".idx")
+
+    def discard(self) -> None:
+        for tmp in (self.final + ".tmp", self.final + ".idx.tmp"):
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+
+
+class ArtifactWriter:
+    """Incremental :func:`write_artifact`: ``write()`` chunks, then ``commit()``.
+
+    The body goes to ``path + ".tmp"`` and replaces *path* only on commit;
+    ``abort()`` (or an exception inside a ``with`` block) discards it.
+    """
+
+    def __init__(self, path: str, compress: bool = True, templated: bool = False):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.compress = compress
+        self.templated = templated
+        self.size = 0
+        self.tokens = 0
+        self._h = hashlib.sha1()
+        self._tmp = path + ".tmp"
+        self._f = open(self._tmp, "wb")
+        self._head: List[bytes] = []
+        self._variants: List[Tuple[str, str, Any, Any]] = []
+        self._segmented: List[_SegmentedVariant] = []
+        self._pending = b""
+        self._run: List[bytes] = []
+        self._run_len = 0
+        if templated and compress:
+            self._segmented = [_SegmentedVariant(name, path + ENCODINGS[name][0])
+                               for name in ENCODINGS if name != "zstd" or zstandard is not None]
+
+    def _flush_run(self) -> None:
+        data = b"".join(self._run)
+        self._run, self._run_len = [], 0
+        for v in self._segmented:
+            v.add(data)
+
+    def _write_templated(self, chunk: bytes) -> None:
+        parts = (self._pending + chunk).split(_HOST_TOKEN_B)
+        for part in parts[:-1]:
+            self.tokens += 1
+            if self._segmented:
+                self._run.append(part)
+                self._flush_run()
+                for v in self._segmented:
+                    v.end()
+        # the end of the chunk may hold the start of a token: carry it over
+        last, keep = parts[-1], len(_HOST_TOKEN_B) - 1
+        self._pending = last[-keep:] if len(last) > keep else last
+        if self._segmented and len(last) > keep:
+            self._run.append(last[:-keep])
+            self._run_len += len(last) - keep
+            # a long run may span several members
+            if self._run_len >= MAX_MEMBER_SIZE:
+                self._flush_run()
+
+    def write(self, chunk: bytes) -> None:
+        self._h.update(chunk)
+        self.size += len(chunk)
+        self._f.write(chunk)
+        if self.templated:
+            self._write_templated(chunk)
+        elif self._variants:
+            for _, _, _, w in self._variants:
+                w.write(chunk)
+        elif self.compress:
+            self._head.append(chunk)
+            if self.size >= MIN_COMPRESS_SIZE:
+                self._variants = _variant_writers(self.path)
+                for _, _, _, w in self._variants:
+                    for c in self._head:
+                        w.write(c)
+                self._head = []
+
+    def _close(self) -> None:
+        if self._f.closed:
+            return
+        self._f.close()
+        for _, _, raw, w in self._variants:
+            w.close()
+            raw.close()
+        for v in self._segmented:
+            v.close()
+
+    def abort(self) -> None:
+        self._close()
+        for tmp in [self._tmp] + [final + ".tmp" for _, final, _, _ in self._variants]:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+        for v in self._segmented:
+            v.discard()
+
+    def commit(self) -> Dict[str, Any]:
+        if self._segmented:
+            self._run.append(self._pending)
+            self._flush_run()
+            for v in self._segmented:
+                v.end()
+        self._close()
+        os.replace(self._tmp, self.path)
+        encodings: Dict[str, int] = {}
+        for v in self._segmented:
+            vsize = os.path.getsize(v.final + ".tmp")
+            if self.size >= MIN_COMPRESS_SIZE and vsize < self.size:
+                v.commit()
+                encodings[v.encoding] = vsize
+            else:
+                v.discard()
+        for name, final, _, _ in self._variants:
+            vsize = os.path.getsize(final + ".tmp")
+            if vsize < self.size:
+                os.replace(final + ".tmp", final)
+                encodings[name] = vsize
+            else:
+                os.remove(final + ".tmp")
+        remove_variants(self.path, keep=encodings)
+        meta = {"etag": f'"{self._h.hexdigest()}"', "size": self.size, "encodings": encodings}
+        if self.templated:
+            meta.update(templated=True, tokens=self.tokens)
+        return meta
+
+    def __enter__(self) -> "ArtifactWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.abort()
+
+
+def write_artifact(path: str,
+                   chunks: Iterable[bytes],
+                   compress: bool = True,
+                   templated: bool = False) -> Dict[str, Any]:
+    """Write *chunks* atomically to *path* and return its ``meta``.
+
+    With *compress* the gzip/zstd variants are produced in the same pass once
+    the body reaches ``MIN_COMPRESS_SIZE``; the ones that end up smaller than
+    the plain body are kept and listed in ``meta["encodings"]``.  *templated*
+    bodies get segmented variants (see the module docstring) and
+    ``meta["templated"]``.
+    """
+    with ArtifactWriter(path, compress, templated) as w:
+        for chunk in chunks:
+            w.write(chunk)
+        return w.commit()
+
+
+def remove_variants(path: str, keep: Iterable[str] = ()) -> None:
+    """Delete the compressed variants of *path* not listed in *keep*."""
+    for name, (suffix, _) in ENCODINGS.items():
+        if name in keep:
+            continue
+        for extra in (suffix, suffix + ".idx"):
+            try:
+                os.remove(path + extra)
+            except FileNotFoundError:
+                pass
+
+
+def pick_encoding(request: Request, available: Iterable[str]) -> Optional[str]:
+    """Best encoding among *available* accepted by the client, if any."""
+    header = request.headers.get("accept-encoding")
+    if not header:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    available = set(available)
+    for name in ENCODINGS:
+        if name not in available:
+            continue
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > 0:
+            return name
+    return None
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True when the request ``If-None-Match`` header matches *etag*."""
+    header = request.headers.get("if-none-match")
+    if not header or not etag:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def http_date(ts: float) -> str:
+    return email.utils.formatdate(ts, usegmt=True)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    """Evaluate ``If-None-Match`` (preferred) or ``If-Modified-Since``."""
+    if request.headers.get("if-none-match") is not None:
+        return etag_matches(request, etag)
+    ims = request.headers.get("if-modified-since")
+    if not ims or not last_modified:
+        return False
+    try:
+        since = email.utils.parsedate_to_datetime(ims).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return False
+    return int(last_modified) <= since
+
+
+def validator_headers(etag: str, last_modified: Optional[float] = None) -> Dict[str, str]:
+    headers: Dict[str, str] = {}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def content_etag(*parts: Any) -> str:
+    """Strong ETag from the SHA-1 of *parts* (bytes or str)."""
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else str(p).encode("utf-8"))
+        h.update(b"\0")
+    return f'"{h.hexdigest()}"'
+
+
+def file_validators(path: str) -> Tuple[str, Optional[float]]:
+    """ETag and mtime of a file from its ``stat`` alone (missing → empty body).
+
+    The files are rewritten with ``os.replace``, so the inode changes on
+    every write even when mtime and size do not.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return content_etag(b""), None
+    return content_etag(st.st_ino, st.st_mtime_ns, st.st_size), st.st_mtime
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def request_base(request: Request) -> str:
+    """Client-facing base URL, made safe to splice into JSON and M3U bodies."""
+    return urllib.parse.quote(str(request.base_url).rstrip("/"), safe=":/[]@.-_~%")
+
+
+def render_host(data: bytes, base: str) -> bytes:
+    return data.replace(_HOST_TOKEN_B, base.encode("ascii"))
+
+
+def conditional_json(request: Request,
+                     etag: str,
+                     last_modified: Optional[float],
+                     build: Callable[[], Any],
+                     templated: bool = False) -> Response:
+    """``304`` when the validators match, otherwise ``JSONResponse(build())``.
+
+    *build* is only called when the body is actually needed.  With
+    *templated* the serialized body gets :data:`HOST_TOKEN` replaced by the
+    request base URL.
+    """
+    headers = validator_headers(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(headers)
+    if templated:
+        body = render_host(b"".join(json_chunks(build())), request_base(request))
+        return Response(body, media_type="application/json", headers=headers)
+    return JSONResponse(build(), headers=headers)
+
+
+def _iter_rendered(path: str, base: str) -> Iterable[bytes]:
+    """Stream *path* with every :data:`HOST_TOKEN` replaced by *base*."""
+    token, rendered = _HOST_TOKEN_B, base.encode("ascii")
+    keep = len(token) - 1
+    pending = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data = pending + chunk
+            # the last keep bytes may hold the start of a token: carry them
+            # over, unless a complete token crosses the cut
+            cut = max(0, len(data) - keep)
+            j = data.find(token, max(0, cut - keep))
+            if j != -1 and j < cut:
+                cut = max(cut, j + len(token))
+            pending = data[cut:]
+            yield data[:cut].replace(token, rendered)
+    if pending:
+        yield pending.replace(token, rendered)
+
+
+@functools.lru_cache(maxsize=1024)
+def _encoded_host(encoding: str, base: str) -> bytes:
+    """*base* as a standalone gzip member / zstd frame."""
+    return _compress_member(encoding, base.encode("ascii"))
+
+
+def _iter_spliced(path: str, host: bytes) -> Iterable[bytes]:
+    """Stream a segmented variant with *host* between its members."""
+    lengths = array.array("I")
+    with open(path + ".idx", "rb") as f:
+        lengths.frombytes(f.read())
+    with open(path, "rb") as f:
+        out: List[bytes] = []
+        n = 0
+        for i, length in enumerate(lengths):
+            if i:
+                out.append(host)
+                n += len(host)
+            if length:
+                out.append(f.read(length))
+                n += length
+            if n >= CHUNK_SIZE:
+                yield b"".join(out)
+                out, n = [], 0
+        if out:
+            yield b"".join(out)
+
+
+def _templated_response(request: Request,
+                        path: str,
+                        meta: Dict[str, Any],
+                        media_type: str,
+                        filename: Optional[str],
+                        last_modified: Optional[float]) -> Response:
+    base = request_base(request)
+    etag = meta.get("etag", "")
+    if etag:
+        etag = content_etag(etag, base)
+    encodings = meta.get("encodings") or {}
+    encoding = pick_encoding(request, encodings)
+    if encoding and etag:
+        etag = etag[:-1] + ENCODINGS[encoding][1] + '"'
+    headers = validator_headers(etag, last_modified)
+    if encodings:
+        headers["Vary"] = "Accept-Encoding"
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(headers)
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    tokens = meta.get("tokens", 0)
+    if encoding:
+        host = _encoded_host(encoding, base)
+        headers["Content-Encoding"] = encoding
+        headers["Content-Length"] = str(encodings[encoding] + tokens * len(host))
+        body = _iter_spliced(path + ENCODINGS[encoding][0], host)
+    else:
+        headers["Content-Length"] = str(meta.get("size", 0) + tokens * (len(base) - len(HOST_TOKEN)))
+        body = _iter_rendered(path, base)
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
+def artifact_response(request: Request,
+                      path: str,
+                      meta: Dict[str, Any],
+                      media_type: str,
+                      filename: Optional[str] = None,
+                      last_modified: Optional[float] = None) -> Response:
+    """Serve an artifact from disk (chunked) or ``304`` when unchanged.
+
+    The compressed variant matching ``Accept-Encoding`` is preferred; each
+    representation gets its own strong ETag.  Templated artifacts are
+    rendered for the request host while streaming.
+    """
+    if meta.get("templated"):
+        return _templated_response(request, path, meta, media_type, filename, last_modified)
+    etag = meta.get("etag", "")
+    encodings = meta.get("encodings") or {}
+    encoding = pick_encoding(request, encodings)
+    if encoding:
+        suffix, etag_suffix = ENCODINGS[encoding]
+        path += suffix
+        if etag:
+            etag = etag[:-1] + etag_suffix + '"'
+    headers = validator_headers(etag, last_modified)
+    if encodings:
+        headers["Vary"] = "Accept-Encoding"
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(path, media_type=media_type, filename=filename, headers=headers)
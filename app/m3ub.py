@@ -0,0 +1,128 @@
+# app/m3ub.py
+"""Binary sidecar of a converted playlist (``{pid}.m3ub``).
+
+Written next to ``{pid}.m3u`` when a playlist is refreshed, so consumers do
+not have to re-parse the text.  Layout (little endian)::
+
+    header   magic "M3UB", version, record count, source mtime_ns and size
+    records  count x 6 (offset, length) pairs into the string table:
+             title, url, group, tvg_id, tvg_logo, extra attributes
+    strings  UTF-8 string table; repeated strings (groups, logos) are stored
+             once and shared by every record pointing to them
+
+The file is read through ``mmap``: opening it costs the same whatever the
+playlist size, records are decoded on access and the pages are shared by
+every worker through the OS cache.  A sidecar whose source stamp does not
+match the current ``.m3u`` is ignored.
+"""
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence, Tuple
+
+MAGIC = b"M3UB"
+VERSION = 1
+_HEADER = struct.Struct("<4sHHIqQ")
+_RECORD = struct.Struct("<12I")
+# separator of the flattened (key, value, ...) extra attributes
+_EXTRA_SEP = "\x00"
+
+Fields = Tuple[str, str, str, str, str, Tuple[str, ...]]
+
+
+def sidecar_path(m3u_path: str) -> str:
+    return os.path.splitext(m3u_path)[0] + ".m3ub"
+
+
+def write_sidecar(path: str, records: Iterable[Fields], stamp: Tuple[int, int]) -> int:
+    """Write *records* to *path* atomically; return the number of records.
+
+    *stamp* is the ``(mtime_ns, size)`` of the ``.m3u`` they come from.
+    """
+    strings: dict = {}
+    table = bytearray()
+    recs = bytearray()
+    count = 0
+
+    def ref(s: str) -> Tuple[int, int]:
+        hit = strings.get(s)
+        if hit is None:
+            b = s.encode("utf-8")
+            hit = strings[s] = (len(table), len(b))
+            table.extend(b)
+        return hit
+
+    for title, url, group, tvg_id, tvg_logo, extra in records:
+        pairs = [ref(title), ref(url), ref(group), ref(tvg_id), ref(tvg_logo),
+                 ref(_EXTRA_SEP.join(extra))]
+        recs.extend(_RECORD.pack(*(n for p in pairs for n in p)))
+        count += 1
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, 0, count, stamp[0], stamp[1]))
+        f.write(recs)
+        f.write(table)
+    os.replace(tmp, path)
+    return count
+
+
+class SidecarPlaylist(Sequence):
+    """Read-only sequence view of a sidecar; items are built on access."""
+
+    def __init__(self, mm: mmap.mmap, count: int, factory: Callable[..., Any]):
+        self._mm = mm
+        self._count = count
+        self._factory = factory
+        self._records = _HEADER.size
+        self._strings = _HEADER.size + count * _RECORD.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _item(self, i: int) -> Any:
+        mm = self._mm
+        base = self._strings
+        v = _RECORD.unpack_from(mm, self._records + i * _RECORD.size)
+        f = [str(mm[base + v[k]:base + v[k] + v[k + 1]], "utf-8") for k in range(0, 12, 2)]
+        extra = tuple(f[5].split(_EXTRA_SEP)) if f[5] else ()
+        return self._factory(f[0], f[1], f[2], f[3], f[4], extra)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._item(j) for j in range(*i.indices(self._count))]
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self._item(i)
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(self._count):
+            yield self._item(i)
+
+    def close(self) -> None:
+        """Unmap the file; the view is unusable afterwards."""
+        self._mm.close()
+
+
+def open_sidecar(path: str,
+                 stamp: Tuple[int, int],
+                 factory: Callable[..., Any]) -> Optional[SidecarPlaylist]:
+    """Map *path*; ``None`` when missing, corrupt or built from another source."""
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size:
+                return None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    magic, version, _, count, mtime_ns, src_size = _HEADER.unpack_from(mm, 0)
+    if (magic != MAGIC or version != VERSION or (mtime_ns, src_size) != tuple(stamp)
+            or size < _HEADER.size + count * _RECORD.size):
+        mm.close()
+        return None
+    return SidecarPlaylist(mm, count, factory)
@@ -1,26 +1,42 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import hashlib
+import importlib.util
+import io
 import json
 import logging
 import os
+import random
 import re
+import tempfile
+import threading
 import time
 import urllib.parse
 import uuid
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional
 
 import httpx
 from fastapi import Body, FastAPI, HTTPException, Path, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import (FileResponse, HTMLResponse, JSONResponse,
-                               PlainTextResponse, RedirectResponse)
+                               RedirectResponse, Response)
 from fastapi.staticfiles import StaticFiles
 from pydantic import AnyHttpUrl, BaseModel
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
-from app.xtream_manager import setup_xtream
+from app.xtream_manager import (OPTION_PREFIXES, aiter_lines, forget_playlist, invalidate_playlists,
+                                rebuild_xtream_cache, setup_xtream, shutdown_parse_pool,
+                                write_playlist_sidecar, xtreams_using)
 
+from . import accesslog, metrics
 from .adapter import ResolverError, run_resolver
+from .artifacts import (CHUNK_SIZE, ArtifactWriter, artifact_response, conditional_json,
+                        file_validators, iter_chunks, remove_variants, write_artifact)
+from .m3ub import sidecar_path
 # ========= resolver esterni =========
 # (restano invariati; usiamo ancora adapter/registry per Vavoo & co.)
 from .registry import pick_script_for
@@ -145,6 +161,7 @@ def _handle_generic(url: str, kind: str, headers: Optional[Dict[str, str]], use_
     try:
         host = _parse_host(url).lower()
         script_path = pick_script_for(host)
+        accesslog.note(resolver=os.path.basename(script_path) if script_path else None)
         if not script_path:
             # no resolver → ritorna as-is (eventuale proxy wrapper)
             return {
@@ -185,56 +202,256 @@ def _resolver_link_for(url: str, settings: Dict[str, str], mode: str) -> str:
     endpoint = "tv" if (mode or "").lower() == "tv" else "video"
     return f"{base.rstrip('/')}/{endpoint}?u={_enc(url)}"
 
-def convert_playlist_text(src_text: str, mode: str, settings: Dict[str, str]) -> str:
+class PlaylistConverter:
     """
-    Converte una playlist M3U generica in una M3U che punta al nostro resolver
-    (/video?u=... oppure /tv?u=... in base a 'mode').
+    Conversione riga per riga (vedi :func:`convert_playlist_text`): ``feed()``
+    riceve una riga sorgente e restituisce le righe convertite pronte, alla
+    fine ``finish()`` restituisce le eventuali righe rimaste.
+    Le righe ``#EXTVLCOPT``/``#KODIPROP`` restano attaccate alla loro entry.
     """
-    lines = src_text.splitlines()
-    out: List[str] = []
-    saw_header = False
-    seen_urls: set[str] = set()
-    pending_extinf: str | None = None
-    for line in lines:
+
+    def __init__(self, mode: str, settings: Dict[str, str]):
+        self.mode = mode
+        self.settings = settings
+        self.emitted = False
+        self.seen_urls: set[str] = set()
+        self.pending_extinf: str | None = None
+        self.pending_opts: List[str] = []
+
+    def _emit(self, out: List[str], line: str) -> None:
+        if not self.emitted:
+            self.emitted = True
+            if not M3U_HEADER_RE.match(line.strip()):
+                out.append("#EXTM3U")
+        out.append(line)
+
+    def feed(self, line: str) -> List[str]:
+        out: List[str] = []
+        line = line.rstrip("\r\n")
         stripped = line.strip()
-        if not saw_header and M3U_HEADER_RE.match(stripped):
-            saw_header = True
         if stripped.startswith("#EXTINF"):
-            if mode == "video":
+            if self.mode == "video":
                 line = re.sub(r'\s*group-title="[^"]*"', "", line)
-            pending_extinf = line
-            continue
+            self.pending_extinf = line
+            return out
+        if stripped.startswith(OPTION_PREFIXES):
+            self.pending_opts.append(line)
+            return out
         if stripped.startswith("#"):
-            if mode == "video" and not stripped.startswith("#EXT"):
-                continue
-            out.append(line)
-            continue
+            if self.mode == "video" and not stripped.startswith("#EXT"):
+                return out
+            self._emit(out, line)
+            return out
         if stripped.lower().startswith(("http://", "https://")):
-            if stripped in seen_urls:
-                pending_extinf = None
-                continue
-            seen_urls.add(stripped)
+            pending_extinf, pending_opts = self.pending_extinf, self.pending_opts
+            self.pending_extinf, self.pending_opts = None, []
+            if stripped in self.seen_urls:
+                return out
+            self.seen_urls.add(stripped)
             if pending_extinf is not None:
-                out.append(pending_extinf)
-            out.append(_resolver_link_for(stripped, settings, mode))
-            pending_extinf = None
+                self._emit(out, pending_extinf)
+            for opt in pending_opts:
+                self._emit(out, opt)
+            self._emit(out, _resolver_link_for(stripped, self.settings, self.mode))
         elif stripped == "":
-            out.append("")
+            self._emit(out, "")
         else:
-            out.append(line)
-    if not out or not M3U_HEADER_RE.match(out[0].strip()):
-        out.insert(0, "#EXTM3U")
-    return "\n".join(out) + "\n"
+            self._emit(out, line)
+        return out
+
+    def finish(self) -> List[str]:
+        return [] if self.emitted else ["#EXTM3U"]
+
+def iter_convert_playlist(lines: Iterable[str], mode: str, settings: Dict[str, str]) -> Iterator[str]:
+    """Versione in streaming di :func:`convert_playlist_text` su un iterabile di righe."""
+    conv = PlaylistConverter(mode, settings)
+    for line in lines:
+        yield from conv.feed(line)
+    yield from conv.finish()
 
-async def fetch_text(url: str, timeout: float = 40.0) -> str:
-    async with httpx.AsyncClient(
+def convert_playlist_text(src_text: str, mode: str, settings: Dict[str, str]) -> str:
+    """
+    Converte una playlist M3U generica in una M3U che punta al nostro resolver
+    (/video?u=... oppure /tv?u=... in base a 'mode').
+    """
+    # newline=None: anche \r da solo chiude una riga, come con splitlines()
+    return "\n".join(iter_convert_playlist(io.StringIO(src_text, newline=None), mode, settings)) + "\n"
+
+# Limite sul corpo scaricato (dopo la decompressione HTTP) di una playlist
+MAX_PLAYLIST_BYTES = int(float(os.getenv("PLAYLIST_MAX_MB", "512")) * 1024 * 1024)
+# Scritture su disco (e hash/compressione) dei download fatte in un thread,
+# a lotti di questa dimensione, per non bloccare l'event loop
+SPOOL_BATCH_SIZE = 16 * CHUNK_SIZE
+
+class PlaylistTooLarge(Exception):
+    pass
+
+# Client HTTP condiviso (creato/chiuso dal lifespan dell'app) per i download
+# delle playlist: connessioni e sessioni TLS riusate tra un refresh e l'altro.
+UPSTREAM_TIMEOUT = httpx.Timeout(
+    connect=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "10")),
+    read=float(os.getenv("UPSTREAM_READ_TIMEOUT", "40")),
+    write=float(os.getenv("UPSTREAM_WRITE_TIMEOUT", "10")),
+    pool=float(os.getenv("UPSTREAM_POOL_TIMEOUT", "30")),
+)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "32"))
+UPSTREAM_MAX_PER_HOST = int(os.getenv("UPSTREAM_MAX_PER_HOST", "4"))
+# HTTP/2 negoziato via ALPN quando il pacchetto h2 è installato
+UPSTREAM_HTTP2 = (os.getenv("UPSTREAM_HTTP2", "1").lower() not in ("0", "false", "no", "off")
+                  and importlib.util.find_spec("h2") is not None)
+
+_UPSTREAM: Optional[httpx.AsyncClient] = None
+_UPSTREAM_HOSTS: Dict[str, asyncio.Semaphore] = {}
+
+def _new_upstream_client(timeout: httpx.Timeout = UPSTREAM_TIMEOUT) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
         follow_redirects=True,
         timeout=timeout,
+        http2=UPSTREAM_HTTP2,
+        limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS,
+                            max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS),
         headers={"User-Agent": "StreamResolver/1.2 (+httpx)"}
-    ) as s:
-        r = await s.get(url)
-        r.raise_for_status()
-        return r.text
+    )
+
+async def start_upstream_client() -> None:
+    global _UPSTREAM
+    if _UPSTREAM is None:
+        _UPSTREAM = _new_upstream_client()
+        _UPSTREAM_HOSTS.clear()
+
+async def close_upstream_client() -> None:
+    global _UPSTREAM
+    client, _UPSTREAM = _UPSTREAM, None
+    _UPSTREAM_HOSTS.clear()
+    if client is not None:
+        await client.aclose()
+
+@contextlib.asynccontextmanager
+async def _upstream_slot(url: str):
+    """Client da usare per *url* e posto nel limite di connessioni del suo host."""
+    if _UPSTREAM is None:
+        # fuori dal lifespan (script, test): client usa e getta
+        async with _new_upstream_client() as client:
+            yield client
+        return
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    sem = _UPSTREAM_HOSTS.get(host)
+    if sem is None:
+        sem = _UPSTREAM_HOSTS[host] = asyncio.Semaphore(UPSTREAM_MAX_PER_HOST)
+    async with sem:
+        yield _UPSTREAM
+
+@contextlib.asynccontextmanager
+async def open_upstream(url: str,
+                        headers: Optional[Dict[str, str]] = None,
+                        max_bytes: Optional[int] = None):
+    """
+    Apre *url* in streaming e restituisce ``(response, body)``, dove ``body``
+    itera i byte applicando il limite di dimensione.  Un ``304`` (richiesta
+    condizionale) non è un errore.
+    """
+    if max_bytes is None:
+        max_bytes = MAX_PLAYLIST_BYTES
+    async with _upstream_slot(url) as s:
+        async with s.stream("GET", url, headers=headers) as r:
+            if r.status_code != 304:
+                r.raise_for_status()
+            declared = r.headers.get("content-length", "")
+            if declared.isdigit() and int(declared) > max_bytes:
+                raise PlaylistTooLarge(f"playlist di {declared} byte, limite {max_bytes}")
+
+            async def body() -> AsyncIterator[bytes]:
+                received = 0
+                async for chunk in r.aiter_bytes():
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise PlaylistTooLarge(f"playlist oltre il limite di {max_bytes} byte")
+                    yield chunk
+
+            yield r, body()
+
+async def stream_lines(url: str, max_bytes: Optional[int] = None) -> AsyncIterator[str]:
+    """Scarica *url* in streaming e produce le righe man mano che arrivano."""
+    async with open_upstream(url, max_bytes=max_bytes) as (r, body):
+        async for line in aiter_lines(body, r.charset_encoding or "utf-8"):
+            yield line
+
+async def download_playlist(url: str, dest: str, validators: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Scarica la playlist sorgente in *dest* (a blocchi), inviando
+    ``If-None-Match``/``If-Modified-Since`` da *validators*.  Restituisce
+    ``None`` se l'upstream risponde ``304``, altrimenti i validatori della
+    risposta, lo SHA-1 del corpo e il charset.
+    """
+    headers: Dict[str, str] = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    async with open_upstream(url, headers=headers) as (r, body):
+        if r.status_code == 304:
+            return None
+        h = hashlib.sha1()
+
+        def spool(data: bytes) -> None:
+            h.update(data)
+            f.write(data)
+
+        with open(dest, "wb") as f:
+            buf: List[bytes] = []
+            buf_len = 0
+            async for chunk in body:
+                buf.append(chunk)
+                buf_len += len(chunk)
+                if buf_len >= SPOOL_BATCH_SIZE:
+                    await run_in_threadpool(spool, b"".join(buf))
+                    buf, buf_len = [], 0
+            if buf:
+                await run_in_threadpool(spool, b"".join(buf))
+        return {
+            "etag": r.headers.get("etag", ""),
+            "last_modified": r.headers.get("last-modified", ""),
+            "sha1": h.hexdigest(),
+            "encoding": r.charset_encoding or "utf-8",
+        }
+
+def convert_file_to_artifact(src_path: str,
+                             encoding: str,
+                             mode: str,
+                             settings: Dict[str, str],
+                             out_path: str) -> Dict:
+    """Converte la sorgente scaricata in *out_path* (con varianti compresse)."""
+    with open(src_path, "r", encoding=encoding, errors="replace") as f:
+        return write_artifact(out_path, iter_chunks(iter_convert_playlist(f, mode, settings)))
+
+async def convert_url_to_file(url: str,
+                              mode: str,
+                              settings: Dict[str, str],
+                              out_path: str,
+                              compress: bool = True) -> Dict:
+    """
+    Scarica, converte e scrive la playlist a blocchi in un file temporaneo,
+    rinominato su *out_path* solo a download completato.  Restituisce i
+    metadati dell'artifact (etag, size, varianti compresse).
+    """
+    conv = PlaylistConverter(mode, settings)
+    with ArtifactWriter(out_path, compress) as w:
+        buf: List[bytes] = []
+        buf_len = 0
+        async for line in stream_lines(url):
+            for out in conv.feed(line):
+                b = (out + "\n").encode("utf-8")
+                buf.append(b)
+                buf_len += len(b)
+            if buf_len >= SPOOL_BATCH_SIZE:
+                await run_in_threadpool(w.write, b"".join(buf))
+                buf, buf_len = [], 0
+        for out in conv.finish():
+            buf.append((out + "\n").encode("utf-8"))
+        if buf:
+            await run_in_threadpool(w.write, b"".join(buf))
+        return await run_in_threadpool(w.commit)
 
 def _read_playlists_index() -> List[Dict]:
     return _read_json(PLAYLISTS_INDEX, [])
@@ -248,18 +465,54 @@ def _find_playlist(items: List[Dict], pid: str) -> Optional[Dict]:
             return it
     return None
 
+# serializza le modifiche read-modify-write dell'indice (endpoint + scheduler)
+_INDEX_LOCK = threading.Lock()
+
+def _update_playlist_entry(pid: str, fields: Dict) -> Optional[Dict]:
+    """Aggiorna alcuni campi di una playlist rileggendo l'indice sotto lock."""
+    with _INDEX_LOCK:
+        items = _read_playlists_index()
+        it = _find_playlist(items, pid)
+        if it is None:
+            return None
+        it.update(fields)
+        _write_playlists_index(items)
+        return it
+
 # -----------------------------------------------------------------------------
 # FastAPI app
 # -----------------------------------------------------------------------------
-APP = FastAPI(title="Stream Resolver", version="1.2.0")
+@contextlib.asynccontextmanager
+async def _lifespan(app: FastAPI):
+    accesslog.start_access_log()
+    await start_upstream_client()
+    # scheduler dei refresh automatici (vedi refresh_due_playlists)
+    scheduler = asyncio.create_task(_refresh_scheduler()) if AUTO_REFRESH else None
+    try:
+        yield
+    finally:
+        if scheduler is not None:
+            scheduler.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await scheduler
+        await close_upstream_client()
+        await run_in_threadpool(shutdown_parse_pool)
+        accesslog.stop_access_log()
+
+APP = FastAPI(title="Stream Resolver", version="1.2.0", lifespan=_lifespan)
 
 @APP.middleware("http")
 async def log_requests(request: Request, call_next):
-    logger.info("HTTP %s %s headers=%s",
-                request.method,
-                str(request.url),
-                dict(request.headers))
-    return await call_next(request)
+    # access log strutturato e campionato (vedi app.accesslog)
+    fields = accesslog.begin_request()
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        accesslog.log_request(request, status, (time.perf_counter() - t0) * 1000, fields)
 
 APP.add_middleware(
     CORSMiddleware,
@@ -281,6 +534,10 @@ def home():
             return HTMLResponse(f.read())
     return HTMLResponse("<h1>Stream Resolver</h1><p>GUI non trovata.</p>")
 
+@APP.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @APP.get("/health")
 def health():
     st = _load_settings()
@@ -371,8 +628,9 @@ def video_post(payload: ResolveIn = Body(...)):
 # ADMIN API – settings
 # -----------------------------------------------------------------------------
 @APP.get("/admin/settings.json")
-def admin_get_settings():
-    return {"settings": _load_settings()}
+def admin_get_settings(request: Request):
+    etag, mtime = file_validators(SETTINGS_FILE)
+    return conditional_json(request, etag, mtime, lambda: {"settings": _load_settings()})
 
 class SettingsIn(BaseModel):
     mediaflow_url: str = ""
@@ -399,13 +657,22 @@ class ConvertIn(BaseModel):
 async def admin_convert_once(body: ConvertIn):
     if not body.url:
         raise HTTPException(status_code=400, detail="URL mancante")
-    src = await fetch_text(body.url)
-    out = convert_playlist_text(src, body.mode, _load_settings())
+    fd, tmp_path = tempfile.mkstemp(suffix=".m3u")
+    os.close(fd)
+    try:
+        await convert_url_to_file(body.url, body.mode, _load_settings(), tmp_path, compress=False)
+    except PlaylistTooLarge as e:
+        os.remove(tmp_path)
+        raise HTTPException(status_code=413, detail=str(e))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
     filename = "converted.m3u" if body.mode != "tv" else "converted_tv.m3u"
-    return PlainTextResponse(
-        out,
+    return FileResponse(
+        tmp_path,
         media_type="audio/x-mpegurl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        filename=filename,
+        background=BackgroundTask(os.remove, tmp_path),
     )
 # -----------------------------------------------------------------------------
 # ADMIN API – playlists CRUD
@@ -418,14 +685,14 @@ class PlaylistCreate(BaseModel):
     resolver_url: str = ""
 
 @APP.get("/admin/playlists.json")
-def admin_list_playlists():
-    return {"items": _read_playlists_index()}
+def admin_list_playlists(request: Request):
+    etag, mtime = file_validators(PLAYLISTS_INDEX)
+    return conditional_json(request, etag, mtime, lambda: {"items": _read_playlists_index()})
 
 @APP.post("/admin/playlists")
 def admin_add_playlist(data: PlaylistCreate):
     if not data.name or not data.url:
         raise HTTPException(status_code=400, detail="Nome e URL richiesti")
-    items = _read_playlists_index()
     pid = uuid.uuid4().hex[:10]
     it = {
         "id": pid,
@@ -436,8 +703,10 @@ def admin_add_playlist(data: PlaylistCreate):
         "resolver_url": _ensure_http(data.resolver_url) if data.resolver_url else "",
         "last_refresh": 0
     }
-    items.append(it)
-    _write_playlists_index(items)
+    with _INDEX_LOCK:
+        items = _read_playlists_index()
+        items.append(it)
+        _write_playlists_index(items)
     return {"ok": True, "id": pid}
 
 class PlaylistUpdate(BaseModel):
@@ -448,57 +717,280 @@ class PlaylistUpdate(BaseModel):
 
 @APP.post("/admin/playlists/{pid}/update")
 async def admin_update_playlist(pid: str = Path(...), data: PlaylistUpdate = Body(...)):
-    items = _read_playlists_index()
-    it = _find_playlist(items, pid)
-    if not it:
-        raise HTTPException(status_code=404, detail="Playlist non trovata")
-
+    fields: Dict = {}
     if data.url is not None:
         new_url = (data.url or "").strip()
         if not new_url or not (new_url.lower().startswith("http://") or new_url.lower().startswith("https://")):
             raise HTTPException(status_code=400, detail="URL must start with http:// or https://")
-        it["url"] = new_url
+        fields["url"] = new_url
 
     if data.every_hours is not None:
-        it["every_hours"] = max(1, int(data.every_hours))
+        fields["every_hours"] = max(1, int(data.every_hours))
 
     if data.resolver_url is not None:
-        it["resolver_url"] = _ensure_http(data.resolver_url) if data.resolver_url else ""
+        fields["resolver_url"] = _ensure_http(data.resolver_url) if data.resolver_url else ""
+
+    if _update_playlist_entry(pid, fields) is None:
+        raise HTTPException(status_code=404, detail="Playlist non trovata")
 
     if data.refresh:
         try:
-            src = await fetch_text(it["url"])
-            settings = _load_settings()
-            if it.get("resolver_url"):
-                settings = {**settings, "stream_resolver_url": it["resolver_url"]}
-            out = convert_playlist_text(src, it["mode"], settings)
-            out_path = os.path.join(PLAYLISTS_DIR, f"{pid}.m3u")
-            with open(out_path, "w", encoding="utf-8") as f:
-                f.write(out)
-            it["last_refresh"] = _now_ts()
+            await refresh_playlist(pid)
+        except PlaylistTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=502, detail=f"Errore refresh: {e}")
 
-    _write_playlists_index(items)
     return {"ok": True}
 
 @APP.delete("/admin/playlists/{pid}")
 def admin_delete_playlist(pid: str):
-    items = _read_playlists_index()
-    new_items = [x for x in items if x.get("id") != pid]
-    _write_playlists_index(new_items)
+    with _INDEX_LOCK:
+        items = _read_playlists_index()
+        new_items = [x for x in items if x.get("id") != pid]
+        _write_playlists_index(new_items)
+    path = os.path.join(PLAYLISTS_DIR, f"{pid}.m3u")
     try:
-        os.remove(os.path.join(PLAYLISTS_DIR, f"{pid}.m3u"))
+        os.remove(path)
     except FileNotFoundError:
         pass
+    remove_variants(path)
+    try:
+        os.remove(sidecar_path(path))
+    except FileNotFoundError:
+        pass
+    _REFRESH_LOCKS.pop(pid, None)
+    forget_playlist(pid)
+    invalidate_playlists([pid])
     return {"ok": True}
 
+# -----------------------------------------------------------------------------
+# Refresh delle playlist (manuale + scheduler automatico)
+# -----------------------------------------------------------------------------
+AUTO_REFRESH = os.getenv("PLAYLIST_AUTO_REFRESH", "1").lower() not in ("0", "false", "no", "off")
+REFRESH_TICK = float(os.getenv("PLAYLIST_REFRESH_TICK", "60"))           # secondi tra due controlli
+REFRESH_CONCURRENCY = int(os.getenv("PLAYLIST_REFRESH_CONCURRENCY", "2"))
+REFRESH_JITTER = float(os.getenv("PLAYLIST_REFRESH_JITTER", "30"))       # ritardo casuale max (s)
+REFRESH_BACKOFF_BASE = float(os.getenv("PLAYLIST_REFRESH_BACKOFF", "300"))
+REFRESH_BACKOFF_MAX = float(os.getenv("PLAYLIST_REFRESH_BACKOFF_MAX", "21600"))
+
+# un solo refresh alla volta per playlist, manuale o schedulato
+_REFRESH_LOCKS: Dict[str, asyncio.Lock] = {}
+
+def _refresh_lock(pid: str) -> asyncio.Lock:
+    lock = _REFRESH_LOCKS.get(pid)
+    if lock is None:
+        lock = _REFRESH_LOCKS[pid] = asyncio.Lock()
+    return lock
+
+def _refresh_backoff(failures: int) -> float:
+    return min(REFRESH_BACKOFF_MAX, REFRESH_BACKOFF_BASE * 2 ** max(0, failures - 1))
+
+def _convert_key(url: str, mode: str, settings: Dict[str, str]) -> str:
+    """Identifica sorgente e parametri di conversione: se cambiano va riconvertita."""
+    key = f"{url}\0{mode}\0{settings.get('stream_resolver_url') or ''}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+async def refresh_playlist(pid: str, rebuild_xtreams: bool = True) -> Dict:
+    """
+    Scarica e converte una playlist, poi aggiorna l'indice.
+
+    Il download è condizionale (``ETag``/``Last-Modified`` salvati in
+    ``upstream``): con un ``304``, o se il corpo ha lo stesso SHA-1 del
+    precedente, conversione e lavoro a valle vengono saltati e
+    ``refresh_result`` vale ``not_modified``/``unchanged`` invece di
+    ``updated``.  In caso di errore registra il fallimento e il prossimo
+    tentativo (backoff esponenziale) e rilancia l'eccezione.
+
+    Se la playlist è cambiata le cache Xtream che la usano vengono marcate
+    come scadute e, con *rebuild_xtreams*, ricostruite in background.
+    """
+    t0 = time.perf_counter()
+    result = "error"
+    try:
+        entry = await _refresh_playlist(pid, rebuild_xtreams)
+        result = entry.get("refresh_result") or "updated"
+        return entry
+    finally:
+        metrics.PLAYLIST_REFRESH_SECONDS.observe(time.perf_counter() - t0, result)
+
+async def _refresh_playlist(pid: str, rebuild_xtreams: bool) -> Dict:
+    async with _refresh_lock(pid):
+        it = _find_playlist(_read_playlists_index(), pid)
+        if not it:
+            raise HTTPException(status_code=404, detail="Playlist non trovata")
+        settings = _load_settings()
+        if it.get("resolver_url"):
+            settings = {**settings, "stream_resolver_url": it["resolver_url"]}
+        out_path = os.path.join(PLAYLISTS_DIR, f"{pid}.m3u")
+        upstream = it.get("upstream") or {}
+        convert_key = _convert_key(it["url"], it["mode"], settings)
+        # senza output valido per questi parametri serve comunque il corpo
+        reusable = upstream.get("convert_key") == convert_key and os.path.exists(out_path)
+        fd, src_path = tempfile.mkstemp(dir=PLAYLISTS_DIR, suffix=".src")
+        os.close(fd)
+        try:
+            fetched = await download_playlist(it["url"], src_path, upstream if reusable else None)
+            if fetched is None or (reusable and fetched["sha1"] == upstream.get("sha1")):
+                result = "not_modified" if fetched is None else "unchanged"
+                if fetched is not None:
+                    upstream = {**upstream, "etag": fetched["etag"], "last_modified": fetched["last_modified"]}
+                return _update_playlist_entry(pid, {
+                    "upstream": upstream,
+                    "last_refresh": _now_ts(),
+                    "refresh_result": result,
+                    "refresh_failures": 0,
+                    "refresh_error": "",
+                    "next_retry": 0,
+                }) or it
+            # scrive anche le varianti .gz/.zst servite da /lists/{pid}.m3u
+            artifact = await run_in_threadpool(convert_file_to_artifact, src_path, fetched["encoding"],
+                                               it["mode"], settings, out_path)
+            # sidecar binario letto (mmap) dalle build Xtream
+            await run_in_threadpool(write_playlist_sidecar, pid)
+        except Exception as e:
+            failures = int(it.get("refresh_failures") or 0) + 1
+            _update_playlist_entry(pid, {
+                "refresh_failures": failures,
+                "refresh_error": str(e),
+                "next_retry": _now_ts() + int(_refresh_backoff(failures)),
+            })
+            raise
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(src_path)
+        entry = _update_playlist_entry(pid, {
+            "artifact": artifact,
+            "upstream": {
+                "etag": fetched["etag"],
+                "last_modified": fetched["last_modified"],
+                "sha1": fetched["sha1"],
+                "convert_key": convert_key,
+            },
+            "last_refresh": _now_ts(),
+            "last_change": _now_ts(),
+            "refresh_result": "updated",
+            "refresh_failures": 0,
+            "refresh_error": "",
+            "next_retry": 0,
+        }) or it
+    try:
+        await run_in_threadpool(invalidate_playlists, [pid], rebuild_xtreams)
+    except Exception:
+        logger.exception("Invalidazione delle cache Xtream fallita per la playlist %s", pid)
+    return entry
+
+def _is_due(it: Dict, now: int) -> bool:
+    every = max(1, int(it.get("every_hours") or 12)) * 3600
+    if now < int(it.get("last_refresh") or 0) + every:
+        return False
+    return now >= int(it.get("next_retry") or 0)
+
+async def _scheduled_refresh(pid: str, sem: asyncio.Semaphore) -> None:
+    # distribuisce nel tempo le playlist scadute insieme
+    await asyncio.sleep(random.uniform(0, REFRESH_JITTER))
+    async with sem:
+        if _refresh_lock(pid).locked():
+            return  # refresh manuale in corso
+        try:
+            await refresh_playlist(pid)
+            logger.info("Playlist %s aggiornata", pid)
+        except Exception:
+            logger.exception("Refresh automatico fallito per la playlist %s", pid)
+
+async def refresh_due_playlists(sem: Optional[asyncio.Semaphore] = None) -> List[str]:
+    """Un giro dello scheduler: aggiorna le playlist scadute, restituisce i loro id."""
+    sem = sem or asyncio.Semaphore(REFRESH_CONCURRENCY)
+    now = _now_ts()
+    due = [it["id"] for it in _read_playlists_index() if it.get("id") and _is_due(it, now)]
+    await asyncio.gather(*(_scheduled_refresh(pid, sem) for pid in due))
+    return due
+
+async def _refresh_scheduler() -> None:
+    sem = asyncio.Semaphore(REFRESH_CONCURRENCY)
+    while True:
+        try:
+            await refresh_due_playlists(sem)
+        except Exception:
+            logger.exception("Errore nello scheduler dei refresh")
+        await asyncio.sleep(REFRESH_TICK)
+
+XTREAM_BUILD_CONCURRENCY = int(os.getenv("XTREAM_BUILD_CONCURRENCY", "2"))
+
+async def _timed(key: str, coro) -> Dict:
+    """Esegue *coro* e riporta esito e durata; un errore non ferma gli altri."""
+    t0 = time.perf_counter()
+    out: Dict = {"id": key, "ok": True}
+    try:
+        out.update(await coro)
+    except Exception as e:
+        out.update(ok=False, error=e.detail if isinstance(e, HTTPException) else str(e))
+    out["seconds"] = round(time.perf_counter() - t0, 3)
+    return out
+
+async def refresh_playlists(ids: Optional[List[str]] = None,
+                            concurrency: Optional[int] = None,
+                            rebuild_xtreams: bool = True) -> Dict:
+    """
+    Refresh di più playlist (tutte se *ids* è vuoto) con al più *concurrency*
+    download/conversioni in parallelo, poi ricostruzione in parallelo delle
+    sole cache Xtream che usano una playlist effettivamente cambiata.
+    """
+    t0 = time.perf_counter()
+    if not ids:
+        ids = [it["id"] for it in _read_playlists_index() if it.get("id")]
+    sem = asyncio.Semaphore(max(1, concurrency or REFRESH_CONCURRENCY))
+
+    async def one_playlist(pid: str) -> Dict:
+        async with sem:
+            # le cache interessate le ricostruisce questa chiamata, non la coda
+            it = await refresh_playlist(pid, rebuild_xtreams=False)
+        return {"result": it.get("refresh_result")}
+
+    playlists = await asyncio.gather(*(_timed(pid, one_playlist(pid)) for pid in dict.fromkeys(ids)))
+    changed = [r["id"] for r in playlists if r.get("result") == "updated"]
+
+    xtreams: List[Dict] = []
+    if rebuild_xtreams and changed:
+        build_sem = asyncio.Semaphore(max(1, XTREAM_BUILD_CONCURRENCY))
+
+        async def one_xtream(xt: Dict) -> Dict:
+            async with build_sem:
+                counts = await run_in_threadpool(rebuild_xtream_cache, xt)
+            return {"counts": counts}
+
+        xtreams = await asyncio.gather(*(_timed(xt["id"], one_xtream(xt))
+                                         for xt in xtreams_using(changed) if xt.get("id")))
+
+    return {
+        "ok": all(r["ok"] for r in [*playlists, *xtreams]),
+        "seconds": round(time.perf_counter() - t0, 3),
+        "playlists": playlists,
+        "xtreams": xtreams,
+    }
+
+class PlaylistsRefresh(BaseModel):
+    ids: Optional[List[str]] = None
+    concurrency: Optional[int] = None
+    rebuild_xtreams: bool = True
+
+@APP.post("/admin/playlists/refresh")
+async def admin_refresh_playlists(data: PlaylistsRefresh = Body(default_factory=PlaylistsRefresh)):
+    return await refresh_playlists(data.ids, data.concurrency, data.rebuild_xtreams)
+
 # -----------------------------------------------------------------------------
 # Serving delle playlist convertite
 # -----------------------------------------------------------------------------
 @APP.get("/lists/{pid}.m3u")
-def serve_playlist(pid: str):
+def serve_playlist(request: Request, pid: str):
     path = os.path.join(PLAYLISTS_DIR, f"{pid}.m3u")
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail="Playlist non trovata")
+    it = _find_playlist(_read_playlists_index(), pid) or {}
+    meta = it.get("artifact")
+    if meta:
+        # last_change: i refresh senza modifiche non invalidano le copie dei client
+        return artifact_response(request, path, meta, media_type="audio/x-mpegurl",
+                                 filename=f"{pid}.m3u", last_modified=it.get("last_change"))
+    # playlist aggiornata prima delle varianti compresse: serve il file così com'è
     return FileResponse(path, media_type="audio/x-mpegurl", filename=f"{pid}.m3u")
@@ -0,0 +1,153 @@
+# app/metrics.py
+"""In-process metrics exposed at ``/metrics`` in the Prometheus text format.
+
+Counters and histograms are plain dicts keyed by the label values; recording
+is a lock, a dict lookup and (for histograms) a ``bisect`` on the bucket
+bounds, so instrumenting a hot path costs about a microsecond per sample.
+Everything is rendered only when ``/metrics`` is scraped.
+
+All metrics are declared here, once, so reloading an instrumented module
+does not register them twice.  Label values must come from small sets
+(resolver script names, actions, results), never from URLs or user input.
+"""
+from __future__ import annotations
+
+import abc
+import bisect
+import contextlib
+import threading
+import time
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+REFRESH_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    @abc.abstractmethod
+    def _samples(self) -> Iterator[str]:
+        """Sample lines of the metric, without the trailing newline."""
+
+    def render(self) -> str:
+        head = f"# HELP {self.name} {self.doc}\n# TYPE {self.name} {self.kind}\n"
+        return head + "".join(line + "\n" for line in self._samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, doc, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, v in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_num(v)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            s[0][i] += 1
+            s[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labels)
+
+    def count(self, *labels: str) -> int:
+        s = self._series.get(labels)
+        return sum(s[0]) if s else 0
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        for labels, (counts, total) in items:
+            running = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                running += n
+                le = 'le="%s"' % ("+Inf" if bound == "+Inf" else _num(bound))
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {running}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {running}"
+
+
+def render() -> str:
+    return "".join(m.render() for m in _REGISTRY)
+
+
+# ====== METRICHE ======
+RESOLVE_SECONDS = Histogram(
+    "resolver_resolve_seconds", "run_resolver duration by script and the mode that answered",
+    ("script", "mode"))
+RESOLVER_ATTEMPT_SECONDS = Histogram(
+    "resolver_attempt_seconds", "Duration of one resolver subprocess by script and invocation mode",
+    ("script", "mode"))
+RESOLVER_SUBPROCESS_TOTAL = Counter(
+    "resolver_subprocess_total", "Resolver subprocesses by invocation mode and exit code "
+    "('timeout' and 'launch_error' when there is none)", ("mode", "result"))
+CACHE_TOTAL = Counter(
+    "cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+PLAYER_API_SECONDS = Histogram(
+    "xtream_player_api_seconds", "player_api.php latency by action", ("action",))
+PLAYER_API_BYTES = Histogram(
+    "xtream_player_api_response_bytes", "player_api.php response body size by action",
+    ("action",), buckets=SIZE_BUCKETS)
+PLAYLIST_REFRESH_SECONDS = Histogram(
+    "playlist_refresh_seconds", "Playlist refresh duration by result", ("result",),
+    buckets=REFRESH_BUCKETS)
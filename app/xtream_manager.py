@@ -1,18 +1,39 @@
 # app/xtream_manager.py
 from __future__ import annotations
+import codecs
+import io
 import os
 import re
 import json
+import logging
 import zlib
+import hashlib
+import bisect
+import functools
 import time
+import shutil
+import sys
 import urllib.parse
-from dataclasses import dataclass, asdict
-from typing import Any, Dict, List, Optional, Tuple, Iterable
-from collections import defaultdict
+from typing import (Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List,
+                    NamedTuple, Optional, Sequence, Tuple)
+from collections import OrderedDict, defaultdict
+import multiprocessing
 import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import PlainTextResponse, JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, Response
+
+from .accesslog import note
+from .artifacts import (ENCODINGS, HOST_TOKEN, artifact_response, conditional_json,
+                        content_etag, file_validators, is_not_modified, iter_chunks, json_chunks,
+                        not_modified_response, render_host, request_base, validator_headers,
+                        write_artifact)
+from .m3ub import open_sidecar, sidecar_path, write_sidecar
+from .metrics import CACHE_TOTAL, PLAYER_API_BYTES, PLAYER_API_SECONDS
+
+logger = logging.getLogger(__name__)
 
 # ====== PATHS & ENV ======
 APP_DIR = os.environ.get("APP_DIR", os.getcwd())
@@ -26,6 +47,8 @@ PLAYLISTS_DIR  = os.path.join(CONFIG_DIR, "playlists")
 CATEGORY_IDS_JSON = os.path.join(CONFIG_DIR, "category_ids.json")
 # Directory for per-Xtream cache files
 XTREAM_CACHE_DIR = os.path.join(CONFIG_DIR, "xtream_cache")
+# Per-playlist derived fragments, reused across builds while the file is unchanged
+XTREAM_FRAGMENTS_DIR = os.path.join(XTREAM_CACHE_DIR, "fragments")
 
 os.makedirs(PLAYLISTS_DIR, exist_ok=True)
 
@@ -44,8 +67,11 @@ def load_json(path: str, default: Any):
 
 def save_json(path: str, data: Any):
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
+    # builds may run in parallel threads: readers never see a partial file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
 
 # Lock to guard access to CATEGORY_IDS and its JSON file
 CATEGORY_IDS_LOCK = threading.Lock()
@@ -61,62 +87,348 @@ def enc(url: str) -> str:
 def read_settings() -> Dict[str, Any]:
     return load_json(SETTINGS_JSON, {})
 
-def stream_resolver_base(request: Request) -> str:
+def configured_resolver_base() -> str:
+    """``stream_resolver_url`` from settings, normalized; ``""`` when unset."""
     st = read_settings()
     base = (st.get("stream_resolver_url") or "").strip()
     if base:
         if not re.match(r"^https?://", base, re.I):
             base = "http://" + base
         return base.rstrip("/")
-    return str(request.base_url).rstrip("/")
+    return ""
+
+def stream_resolver_base(request: Request) -> str:
+    return configured_resolver_base() or str(request.base_url).rstrip("/")
 
 # ====== M3U PARSER ======
+# Reference grammar of a well-formed ``#EXTINF`` line.  Parsing goes through
+# :func:`parse_extinf`: this pattern backtracks quadratically on long blank
+# runs and rejects whole lines on a single stray token.
 M3U_LINE = re.compile(
     r'#EXTINF:(?P<duration>-?\d+)\s*(?P<attrs>(?:\s+[a-z0-9\-]+="[^"]*")*)\s*,\s*(?P<title>.*)$',
     re.IGNORECASE
 )
 ATTR_RE = re.compile(r'([a-z0-9\-]+)="([^"]*)"', re.IGNORECASE)
 
-@dataclass
+# Token patterns of :func:`parse_extinf`: single character-class runs, tried
+# once per position, so scanning a line is linear whatever its content.
+_EXTINF_DURATION = re.compile(r"\s*([-+]?[0-9.]*)")
+_EXTINF_KEY = re.compile(r"\s*([A-Za-z0-9_.\-]+)=")
+_EXTINF_BARE = re.compile(r'[^\s,"]*')
+# a stray token that is not ``key=``: a word, or a lone quote or equal sign
+_EXTINF_SKIP = re.compile(r'\s*(?:[^\s,"=]+|["=])')
+
+def parse_extinf(line: str) -> Optional[Tuple[str, Dict[str, str], str]]:
+    """Split an ``#EXTINF`` line into ``(duration, attrs, title)``.
+
+    Single forward pass (linear time).  Malformed lines are recovered
+    instead of dropped: unquoted values stop at whitespace or a comma, an
+    unterminated quote stops at the next comma, stray tokens between the
+    attributes are skipped (the attributes after them are kept) and a
+    missing comma gives an empty title.  Attribute keys are lower-cased.
+    """
+    if line[:8].upper() != "#EXTINF:":
+        return None
+    m = _EXTINF_DURATION.match(line, 8)
+    duration = m.group(1)
+    i = m.end()
+    attrs: Dict[str, str] = {}
+    while True:
+        m = _EXTINF_KEY.match(line, i)
+        if not m:
+            m = _EXTINF_SKIP.match(line, i)
+            if not m:
+                break  # the title comma, or the end of the line
+            i = m.end()
+            continue
+        key = m.group(1).lower()
+        i = m.end()
+        if line.startswith('"', i):
+            end = line.find('"', i + 1)
+            if end < 0:
+                end = line.find(",", i + 1)
+                if end < 0:
+                    end = len(line)
+                attrs[key] = line[i + 1:end]
+                i = end
+                break
+            attrs[key] = line[i + 1:end]
+            i = end + 1
+        else:
+            m = _EXTINF_BARE.match(line, i)
+            attrs[key] = m.group()
+            i = m.end()
+    comma = line.find(",", i)
+    title = line[comma + 1:].strip() if comma >= 0 else ""
+    return duration, attrs, title
+
+# attributes already exposed as fields: kept out of the per-item extras
+_STD_ATTRS = (("group-title", "group"), ("tvg-id", "tvg_id"), ("tvg-logo", "tvg_logo"))
+
 class M3UItem:
-    title: str
-    url: str
-    attrs: Dict[str, str]
-    group: str
-    tvg_id: str
-    tvg_logo: str
-    raw: str
+    """One playlist entry.
+
+    Large provider lists hold hundreds of thousands of these, so the record
+    is slotted, ``group`` is interned and only the non-standard ``#EXTINF``
+    attributes are stored, as a flat ``(key, value, ...)`` tuple (``attrs``
+    rebuilds the full mapping).  ``raw`` is accepted for compatibility and
+    not kept.  The :class:`UrlClass` of ``url`` is kept with the entry once
+    computed (by the parse workers or on first use, see :attr:`url_class`).
+    """
+    __slots__ = ("title", "url", "group", "tvg_id", "tvg_logo", "_extra", "_cls")
+
+    def __init__(self, title: str, url: str, attrs: Optional[Dict[str, str]] = None,
+                 group: str = "", tvg_id: str = "", tvg_logo: str = "", raw: str = ""):
+        self.title = title
+        self.url = url
+        self.group = sys.intern(group)
+        self.tvg_id = tvg_id
+        self.tvg_logo = tvg_logo
+        extra: List[str] = []
+        if attrs:
+            std = {key: getattr(self, field) for key, field in _STD_ATTRS}
+            for key, value in attrs.items():
+                if key in std and value.strip() == std[key]:
+                    continue
+                extra += (key, value)
+        self._extra = tuple(extra) if extra else None
+        self._cls = None
+
+    def _extra_attrs(self) -> Dict[str, str]:
+        e = self._extra
+        return dict(zip(e[::2], e[1::2])) if e else {}
+
+    @property
+    def options(self) -> List[str]:
+        """``#EXTVLCOPT``/``#KODIPROP`` lines attached to the entry."""
+        return [f"{k}={v}" for k, v in self._extra_attrs().items() if k.startswith("#")]
+
+    @property
+    def url_class(self) -> "UrlClass":
+        cls = self._cls
+        if cls is None:
+            cls = self._cls = classify_url(self.url)
+        return cls
+
+    @property
+    def attrs(self) -> Dict[str, str]:
+        out = {key: getattr(self, field) for key, field in _STD_ATTRS if getattr(self, field)}
+        out.update(self._extra_attrs())
+        return out
 
-def parse_m3u(text: str) -> List[M3UItem]:
-    items: List[M3UItem] = []
-    lines = [l.rstrip("\n") for l in text.splitlines()]
-    last_inf: Optional[Tuple[Dict[str, str], str]] = None
-    for i, line in enumerate(lines):
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "title": self.title,
+            "url": self.url,
+            "attrs": self._extra_attrs(),
+            "group": self.group,
+            "tvg_id": self.tvg_id,
+            "tvg_logo": self.tvg_logo,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "M3UItem":
+        return cls(**data)
+
+    @classmethod
+    def from_fields(cls, title: str, url: str, group: str, tvg_id: str, tvg_logo: str,
+                    extra: Tuple[str, ...], url_class: Optional["UrlClass"] = None) -> "M3UItem":
+        """Build from already-split fields (see :meth:`fields`)."""
+        self = cls.__new__(cls)
+        self.title = title
+        self.url = url
+        self.group = sys.intern(group)
+        self.tvg_id = tvg_id
+        self.tvg_logo = tvg_logo
+        self._extra = extra or None
+        self._cls = url_class
+        return self
+
+    def fields(self) -> Tuple[str, str, str, str, str, Tuple[str, ...]]:
+        return (self.title, self.url, self.group, self.tvg_id, self.tvg_logo, self._extra or ())
+
+    def _key(self) -> Tuple[Any, ...]:
+        return (self.title, self.url, self.group, self.tvg_id, self.tvg_logo, self._extra_attrs())
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, M3UItem):
+            return NotImplemented
+        return self._key() == other._key()
+
+    __hash__ = None  # mutable, like the dataclass it replaces
+
+    def __repr__(self) -> str:
+        return f"M3UItem(title={self.title!r}, url={self.url!r}, group={self.group!r})"
+
+# player option lines that belong to the following entry
+OPTION_PREFIXES = ("#EXTVLCOPT:", "#KODIPROP:")
+
+class _M3UReader:
+    """Line-at-a-time ``#EXTINF`` state machine shared by the parsers.
+
+    Option lines (``#EXTVLCOPT``/``#KODIPROP``) are attached to the entry
+    they precede as extra attributes keyed by ``"<prefix><name>"``.
+    """
+    __slots__ = ("values", "last_inf", "options")
+
+    def __init__(self) -> None:
+        # attribute values (logos, ids, names) repeat across the episodes of
+        # a series: keep a single copy of each
+        self.values: Dict[str, str] = {}
+        self.last_inf: Optional[Tuple[Dict[str, str], str]] = None
+        self.options: List[Tuple[str, str]] = []
+
+    def feed(self, line: str) -> Optional[M3UItem]:
+        line = line.rstrip("\r\n")
         if line.startswith("#EXTINF:"):
-            m = M3U_LINE.match(line)
-            if not m:
-                continue
-            attrs_str = m.group("attrs") or ""
-            attrs = {k.lower(): v for k, v in ATTR_RE.findall(attrs_str)}
-            title = m.group("title").strip()
-            last_inf = (attrs, title)
+            _, raw_attrs, title = parse_extinf(line)
+            values = self.values
+            attrs = {sys.intern(k): values.setdefault(v, v) for k, v in raw_attrs.items()}
+            self.last_inf = (attrs, title or attrs.get("tvg-name", "").strip())
+        elif line.startswith(OPTION_PREFIXES):
+            key, _, value = line.partition("=")
+            self.options.append((sys.intern(key.strip()), self.values.setdefault(value, value)))
         elif line and not line.startswith("#"):
+            last_inf, options = self.last_inf, self.options
+            self.last_inf, self.options = None, []
             if last_inf:
                 attrs, title = last_inf
-                group = attrs.get("group-title", "").strip()
-                tvg_id = attrs.get("tvg-id", "").strip()
-                tvg_logo = attrs.get("tvg-logo", "").strip()
-                items.append(M3UItem(
-                    title=title, url=line.strip(),
-                    attrs=attrs, group=group, tvg_id=tvg_id, tvg_logo=tvg_logo, raw=""
-                ))
-                last_inf = None
+                if options:
+                    attrs = {**attrs, **dict(options)}
+                return M3UItem(
+                    title=title, url=line.strip(), attrs=attrs,
+                    group=attrs.get("group-title", "").strip(),
+                    tvg_id=attrs.get("tvg-id", "").strip(),
+                    tvg_logo=attrs.get("tvg-logo", "").strip(),
+                )
+        return None
+
+def iter_m3u(lines: Iterable[str]) -> Iterator[M3UItem]:
+    """Yield the entries of an M3U read line by line (e.g. an open file)."""
+    reader = _M3UReader()
+    for line in lines:
+        item = reader.feed(line)
+        if item is not None:
+            yield item
+
+async def aiter_lines(chunks: AsyncIterable[bytes], encoding: str = "utf-8") -> AsyncIterator[str]:
+    """Decode a byte stream incrementally and yield its lines (without EOL).
+
+    Like files opened in text mode, ``\n``, ``\r\n`` and a bare ``\r`` all
+    end a line.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        # a trailing \r may be the first half of a \r\n split across chunks
+        held = "\r" if pending.endswith("\r") else ""
+        if held:
+            pending = pending[:-1]
+        if "\r" in pending:
+            pending = pending.replace("\r\n", "\n").replace("\r", "\n")
+        *lines, pending = pending.split("\n")
+        pending += held
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+async def aiter_m3u(chunks: AsyncIterable[bytes], encoding: str = "utf-8") -> AsyncIterator[M3UItem]:
+    """Yield the entries of an M3U received as a byte stream."""
+    reader = _M3UReader()
+    async for line in aiter_lines(chunks, encoding):
+        item = reader.feed(line)
+        if item is not None:
+            yield item
+
+def parse_m3u(text: str) -> List[M3UItem]:
+    # newline=None: universal newlines, CR-only playlists included
+    return list(iter_m3u(io.StringIO(text, newline=None)))
+
+# Playlists larger than this are parsed (and their URLs classified) by a pool
+# of worker processes, each taking a slice of the file
+PARALLEL_PARSE_BYTES = int(float(os.environ.get("XTREAM_PARALLEL_PARSE_MB", "16")) * 1024 * 1024)
+PARSE_WORKERS = int(os.environ.get("XTREAM_PARSE_WORKERS", str(min(8, os.cpu_count() or 1))))
+_PARSE_POOL: Optional[Tuple[int, ProcessPoolExecutor]] = None
+_PARSE_POOL_LOCK = threading.Lock()
+
+def parse_m3u_file(path: str, workers: Optional[int] = None) -> List[M3UItem]:
+    """Parse a saved playlist; large files are split across worker processes."""
+    workers = PARSE_WORKERS if workers is None else workers
+    if workers > 1 and os.path.getsize(path) >= PARALLEL_PARSE_BYTES:
+        try:
+            return _parse_m3u_parallel(path, workers)
+        except (BrokenProcessPool, OSError):
+            logger.exception("Parallel parse failed, falling back to a single process: %s", path)
+    with open(path, "r", encoding="utf-8") as f:
+        return list(iter_m3u(f))
+
+def _split_points(path: str, parts: int) -> List[int]:
+    """Byte offsets cutting *path* into *parts* slices right after a URL line.
+
+    The parser state is empty after a URL line, so the slices parse exactly
+    like the whole file.
+    """
+    size = os.path.getsize(path)
+    points = [0]
+    with open(path, "rb") as f:
+        for k in range(1, parts):
+            f.seek(max(points[-1], size * k // parts))
+            f.readline()  # skip the partial line
+            for line in iter(f.readline, b""):
+                if line.strip() and not line.startswith(b"#"):
+                    break
+            if f.tell() > points[-1]:
+                points.append(f.tell())
+    points.append(size)
+    return sorted(set(points))
+
+def _parse_slice(path: str, start: int, end: int) -> List[Tuple[Tuple[str, ...], UrlClass]]:
+    """Worker side: parse ``path[start:end]`` and classify the URLs."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return [(it.fields(), classify_url(it.url))
+            for it in iter_m3u(io.StringIO(data.decode("utf-8", errors="replace"), newline=None))]
+
+def _parse_pool(workers: int) -> ProcessPoolExecutor:
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is None or _PARSE_POOL[0] != workers:
+            if _PARSE_POOL is not None:
+                _PARSE_POOL[1].shutdown(wait=False)
+            # spawn: the server process has threads, forking it is not safe
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            _PARSE_POOL = (workers, pool)
+        return _PARSE_POOL[1]
+
+def _parse_m3u_parallel(path: str, workers: int) -> List[M3UItem]:
+    points = _split_points(path, workers * 2)
+    pool = _parse_pool(workers)
+    futures = [pool.submit(_parse_slice, path, a, b) for a, b in zip(points, points[1:])]
+    items: List[M3UItem] = []
+    for fut in futures:
+        part = fut.result()
+        items.extend(M3UItem.from_fields(*fields, url_class=cls) for fields, cls in part)
     return items
 
+def shutdown_parse_pool() -> None:
+    """Stop the parse workers (app shutdown); the pool is recreated on demand."""
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is not None:
+            _PARSE_POOL[1].shutdown(wait=True, cancel_futures=True)
+            _PARSE_POOL = None
+
 # ====== MODELLO CONFIG XTREAM ======
 def _xtreams() -> List[Dict[str, Any]]:
     return load_json(XTREAMS_JSON, [])
 
+# Guards the read-merge-write of xtreams.json (parallel cache rebuilds)
+_XTREAMS_LOCK = threading.Lock()
+
 def _save_xtreams(items: List[Dict[str, Any]], overwrite: bool = False):
     """Persist xtream configs.
 
@@ -124,26 +436,28 @@ def _save_xtreams(items: List[Dict[str, Any]], overwrite: bool = False):
     ``id`` as key. When ``overwrite`` is ``True`` the provided ``items`` list is
     written directly without performing any merge.
     """
-    if overwrite:
-        save_json(XTREAMS_JSON, items)
-        return
-
-    existing = {x.get("id"): x for x in load_json(XTREAMS_JSON, [])}
-    for it in items:
-        iid = it.get("id")
-        if not iid:
-            continue
-        if iid in existing:
-            # override existing values
-            existing[iid].update(it)
-        else:
-            existing[iid] = it
-    save_json(XTREAMS_JSON, list(existing.values()))
+    with _XTREAMS_LOCK:
+        if overwrite:
+            save_json(XTREAMS_JSON, items)
+            return
+
+        existing = {x.get("id"): x for x in load_json(XTREAMS_JSON, [])}
+        for it in items:
+            iid = it.get("id")
+            if not iid:
+                continue
+            if iid in existing:
+                # override existing values
+                existing[iid].update(it)
+            else:
+                existing[iid] = it
+        save_json(XTREAMS_JSON, list(existing.values()))
 
 # ====== ADMIN ENDPOINTS ======
 @router.get("/admin/xtreams.json")
-def admin_xtreams_list():
-    return {"items": _xtreams()}
+def admin_xtreams_list(request: Request):
+    etag, mtime = file_validators(XTREAMS_JSON)
+    return conditional_json(request, etag, mtime, lambda: {"items": _xtreams()})
 
 @router.post("/admin/xtreams")
 def admin_xtreams_add(payload: Dict[str, Any]):
@@ -173,6 +487,7 @@ def admin_xtreams_delete(xt_id: str):
         os.remove(cache_file)
     except FileNotFoundError:
         pass
+    shutil.rmtree(_artifacts_dir(xt_id), ignore_errors=True)
     return {"ok": True}
 
 @router.post("/admin/xtreams/{xt_id}/update")
@@ -205,6 +520,18 @@ def admin_xtreams_update(xt_id: str, payload: Dict[str, Any]):
             if not isinstance(val, list):
                 raise HTTPException(400, f"{key} must be a list")
             found[key] = [str(x) for x in val]
+    if "dedup" in payload:
+        keys = payload["dedup"]
+        if not isinstance(keys, list) or any(k not in DEDUP_KEYS for k in keys):
+            raise HTTPException(400, f"dedup must be a list of {', '.join(DEDUP_KEYS)}")
+        found["dedup"] = keys
+    if "dedup_prefer" in payload:
+        prefer = payload["dedup_prefer"]
+        if isinstance(prefer, list):
+            prefer = [str(x) for x in prefer]
+        elif prefer not in ("first", "last"):
+            raise HTTPException(400, "dedup_prefer must be 'first', 'last' or a list of playlist ids")
+        found["dedup_prefer"] = prefer
     if payload.get("refresh"):
         found["last_refresh"] = now_ts()
     _save_xtreams(items)
@@ -221,9 +548,7 @@ def admin_xtreams_refresh(xt_id: str, request: Request):
             break
     if not target:
         raise HTTPException(404, "Not Found")
-    build_xtream_cache(request, target)
-    target["last_refresh"] = now_ts()
-    _save_xtreams(items, overwrite=True)
+    _rebuild_cache(request, target)
     return {"ok": True, "item": target}
 
 # ====== CARICAMENTO PLAYLISTS SALVATE ======
@@ -233,13 +558,101 @@ def _playlists_index() -> List[Dict[str, Any]]:
 def _playlist_file(pl_id: str) -> str:
     return os.path.join(PLAYLISTS_DIR, f"{pl_id}.m3u")
 
-def _read_playlist(pl_id: str) -> List[M3UItem]:
-    path = _playlist_file(pl_id)
+# Parsed playlists are shared process-wide and keyed by the file stamp
+# (mtime, size), so a playlist is parsed once per change whatever the number
+# of builds and Xtream configs using it.  The budget is counted in bytes of
+# the source files; the least recently used entries are evicted first.
+PLAYLIST_CACHE_BYTES = int(os.environ.get("XTREAM_PLAYLIST_CACHE_MB", "256")) * 1024 * 1024
+_PARSED_PLAYLISTS: "OrderedDict[str, Tuple[Tuple[int, int], List[M3UItem]]]" = OrderedDict()
+_PARSED_BYTES = 0
+_PARSED_LOCK = threading.Lock()
+_PARSE_LOCKS: Dict[str, threading.Lock] = {}
+
+def _playlist_stamp(pl_id: str) -> Optional[Tuple[int, int]]:
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return parse_m3u(f.read())
+        st = os.stat(_playlist_file(pl_id))
     except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _cached_playlist(pl_id: str, stamp: Tuple[int, int]) -> Optional[List[M3UItem]]:
+    with _PARSED_LOCK:
+        hit = _PARSED_PLAYLISTS.get(pl_id)
+        if hit is None or hit[0] != stamp:
+            return None
+        _PARSED_PLAYLISTS.move_to_end(pl_id)
+        return hit[1]
+
+def _store_playlist(pl_id: str, stamp: Tuple[int, int], items: List[M3UItem]) -> None:
+    global _PARSED_BYTES
+    with _PARSED_LOCK:
+        old = _PARSED_PLAYLISTS.pop(pl_id, None)
+        if old is not None:
+            _PARSED_BYTES -= old[0][1]
+        if stamp[1] > PLAYLIST_CACHE_BYTES:
+            return
+        _PARSED_PLAYLISTS[pl_id] = (stamp, items)
+        _PARSED_BYTES += stamp[1]
+        while _PARSED_BYTES > PLAYLIST_CACHE_BYTES:
+            _, (old_stamp, _) = _PARSED_PLAYLISTS.popitem(last=False)
+            _PARSED_BYTES -= old_stamp[1]
+
+def _sidecar_file(pl_id: str) -> str:
+    return sidecar_path(_playlist_file(pl_id))
+
+def write_playlist_sidecar(pl_id: str) -> int:
+    """Parse the saved ``.m3u`` once and write its binary sidecar."""
+    stamp = _playlist_stamp(pl_id)
+    if stamp is None:
+        return 0
+    items = parse_m3u_file(_playlist_file(pl_id))
+    _store_playlist(pl_id, stamp, items)
+    return write_sidecar(_sidecar_file(pl_id), (it.fields() for it in items), stamp)
+
+def _read_playlist(pl_id: str) -> Sequence[M3UItem]:
+    """Items of a saved playlist (shared sequence: do not modify it).
+
+    Served from the parsed cache, else decoded from the sidecar, else by
+    parsing the text (and writing the sidecar for the next reader); either
+    way the result fills the parsed cache, so the fragments of one playlist
+    decode it once.
+    """
+    stamp = _playlist_stamp(pl_id)
+    if stamp is None:
         return []
+    items = _cached_playlist(pl_id, stamp)
+    if items is not None:
+        CACHE_TOTAL.inc("playlist", "hit")
+        return items
+    with _PARSED_LOCK:
+        lock = _PARSE_LOCKS.setdefault(pl_id, threading.Lock())
+    with lock:
+        items = _cached_playlist(pl_id, stamp)
+        if items is not None:
+            CACHE_TOTAL.inc("playlist", "hit")
+            return items
+        mapped = open_sidecar(_sidecar_file(pl_id), stamp, M3UItem.from_fields)
+        if mapped is not None:
+            CACHE_TOTAL.inc("playlist", "sidecar")
+            try:
+                items = list(mapped)
+            finally:
+                mapped.close()
+            _store_playlist(pl_id, stamp, items)
+            return items
+        CACHE_TOTAL.inc("playlist", "miss")
+        try:
+            items = parse_m3u_file(_playlist_file(pl_id))
+        except FileNotFoundError:
+            return []
+        # the file may have been replaced while it was being read
+        if _playlist_stamp(pl_id) == stamp:
+            _store_playlist(pl_id, stamp, items)
+            try:
+                write_sidecar(_sidecar_file(pl_id), (it.fields() for it in items), stamp)
+            except OSError:
+                pass
+        return items
 
 # ====== CLASSIFICAZIONE ======
 # Paths from Xtream Codes often include username and password segments
@@ -257,38 +670,87 @@ TV_RE_SHORT = re.compile(
     re.I,
 )
 
-def try_extract_movie_id(url: str) -> Optional[str]:
-    parsed = urllib.parse.urlparse(url)
-    q = urllib.parse.parse_qs(parsed.query)
-    if "u" in q and q["u"]:
-        target_url = q["u"][0]
-        while True:
-            dec = urllib.parse.unquote(target_url)
-            if dec == target_url:
-                break
-            target_url = dec
-        m = MOVIE_RE.search(target_url)
-        if m:
-            return m.group(1)
-    m = MOVIE_RE.search(url)
-    return m.group(1) if m else None
+# Bound on the ``%xx`` decoding passes applied to wrapped ``u=`` URLs
+MAX_UNQUOTE_PASSES = 8
+URL_CLASS_CACHE_SIZE = int(os.environ.get("XTREAM_URL_CLASS_CACHE_SIZE", "262144"))
 
-def try_extract_tv_triplet(url: str) -> Optional[Tuple[str, int, int]]:
-    parsed = urllib.parse.urlparse(url)
-    q = urllib.parse.parse_qs(parsed.query)
-    if "u" in q and q["u"]:
-        url = urllib.parse.unquote(q["u"][0])
-    else:
-        url = urllib.parse.unquote(url)
+class UrlClass(NamedTuple):
+    """What the build pipeline needs to know about a stream URL."""
+    movie_id: Optional[str]
+    tv_triplet: Optional[Tuple[str, int, int]]
+    live_id: str
+
+def _unquote_all(value: str) -> str:
+    for _ in range(MAX_UNQUOTE_PASSES):
+        dec = urllib.parse.unquote(value)
+        if dec == value:
+            break
+        value = dec
+    return value
+
+def _wrapped_target(url: str) -> Optional[str]:
+    """``u=`` parameter of a resolver-wrapped URL, if any."""
+    if "u=" not in url:
+        return None
+    q = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    return q["u"][0] if q.get("u") else None
+
+_URL_CLASSES: "OrderedDict[str, UrlClass]" = OrderedDict()
+_URL_CLASSES_LOCK = threading.Lock()
+
+def classify_url(url: str) -> UrlClass:
+    """Parse *url* once: movie id, series triplet and live stream id.
+
+    Memoized per URL in a bounded LRU.  Playlist entries keep their own
+    class (:attr:`M3UItem.url_class`), so builds over lists larger than the
+    memo do not depend on it.
+    """
+    with _URL_CLASSES_LOCK:
+        hit = _URL_CLASSES.get(url)
+        if hit is not None:
+            _URL_CLASSES.move_to_end(url)
+            return hit
+    hit = _classify_url(url)
+    with _URL_CLASSES_LOCK:
+        _URL_CLASSES[url] = hit
+        while len(_URL_CLASSES) > URL_CLASS_CACHE_SIZE:
+            _URL_CLASSES.popitem(last=False)
+    return hit
+
+def _classify_url(url: str) -> UrlClass:
+    target = _wrapped_target(url)
+
+    movie_id = None
+    m = MOVIE_RE.search(_unquote_all(target)) if target is not None else None
+    if not m:
+        m = MOVIE_RE.search(url)
+    if m:
+        movie_id = m.group(1)
+
+    triplet = None
+    tv_url = urllib.parse.unquote(target if target is not None else url)
     for rgx in (TV_RE, TV_RE_SHORT):
-        m = rgx.search(url)
+        m = rgx.search(tv_url)
         if m:
-            sid, season, episode = m.group(1), int(m.group(2)), int(m.group(3))
-            return sid, season, episode
-    return None
+            triplet = (m.group(1), int(m.group(2)), int(m.group(3)))
+            break
+
+    try:
+        token = urllib.parse.urlparse(url).path.strip("/").split("/")[-1]
+    except ValueError:
+        token = ""
+    if len(token) < 6:
+        token = hex(crc32_num(url))[2:]
+    return UrlClass(movie_id, triplet, f"lv_{token[:16]}")
+
+def try_extract_movie_id(url: str) -> Optional[str]:
+    return classify_url(url).movie_id
+
+def try_extract_tv_triplet(url: str) -> Optional[Tuple[str, int, int]]:
+    return classify_url(url).tv_triplet
 
 def guess_is_series(item: M3UItem) -> bool:
-    if try_extract_tv_triplet(item.url): return True
+    if item.url_class.tv_triplet: return True
     g = item.group.lower()
     t = item.title.lower()
     if "serie" in g or "series" in g or "stagione" in t or re.search(r"\bs\d{1,2}e\d{1,2}\b", t, re.I):
@@ -296,7 +758,7 @@ def guess_is_series(item: M3UItem) -> bool:
     return False
 
 def guess_is_movie(item: M3UItem) -> bool:
-    if try_extract_movie_id(item.url): return True
+    if item.url_class.movie_id: return True
     g = item.group.lower()
     if "film" in g or "movie" in g:
         return True
@@ -316,31 +778,63 @@ def get_category_id(name: str, base: int) -> str:
         save_json(CATEGORY_IDS_JSON, CATEGORY_IDS)
         return cid
 
+class CategoryAssigner:
+    """Category ids for one build, with new names persisted in a single write.
+
+    Ids already in ``CATEGORY_IDS`` are returned as-is; new names get their
+    stable id in memory and are written to ``category_ids.json`` by
+    :meth:`flush`, once per build instead of once per new group.
+    """
+
+    def __init__(self) -> None:
+        self.new: Dict[str, str] = {}
+
+    def get(self, name: str, base: int) -> str:
+        cid = CATEGORY_IDS.get(name) or self.new.get(name)
+        if cid:
+            return cid
+        cid = stable_category_id(name, base)
+        self.new[name] = cid
+        return cid
+
+    def flush(self) -> None:
+        if not self.new:
+            return
+        with CATEGORY_IDS_LOCK:
+            missing = {k: v for k, v in self.new.items() if k not in CATEGORY_IDS}
+            if missing:
+                CATEGORY_IDS.update(missing)
+                save_json(CATEGORY_IDS_JSON, CATEGORY_IDS)
+        self.new = {}
+
+_GROUP_PREFIX_RE = {
+    "vod": re.compile(r"^(film|movies?)\s*-\s*", re.I),
+    "series": re.compile(r"^(serietv|serie)\s*-\s*", re.I),
+    "live": re.compile(r"^(live|tv)\s*-\s*", re.I),
+}
+
+@functools.lru_cache(maxsize=8192)
 def normalize_group_for_type(group: str, typ: str) -> str:
     g = group.strip()
-    if typ == "vod":
-        g = re.sub(r"^(film|movies?)\s*-\s*", "", g, flags=re.I)
-    elif typ == "series":
-        g = re.sub(r"^(serietv|serie)\s*-\s*", "", g, flags=re.I)
-    elif typ == "live":
-        g = re.sub(r"^(live|tv)\s*-\s*", "", g, flags=re.I)
+    rgx = _GROUP_PREFIX_RE.get(typ)
+    if rgx is not None:
+        g = rgx.sub("", g)
     return g or "Generale"
 
 # ====== DIRECT SOURCE ======
-def _already_direct(url: str, base: str, endpoint: str) -> bool:
+def _already_direct(url: str, base: Optional[str], endpoint: str) -> bool:
     """Return True if *url* already targets our resolver.
 
-    We check that the host matches *base*, the path corresponds to the
-    expected *endpoint* (``/video`` or ``/tv``) and that a ``u`` query
-    parameter is present.  In that case the URL is returned unchanged to
-    avoid double-encoding.
+    We check that the host matches *base* (any host when *base* is ``None``),
+    the path corresponds to the expected *endpoint* (``/video`` or ``/tv``)
+    and that a ``u`` query parameter is present.  In that case the URL is
+    returned unchanged to avoid double-encoding.
     """
     try:
         u = urllib.parse.urlparse(url)
-        b = urllib.parse.urlparse(base)
         qs = urllib.parse.parse_qs(u.query)
         return (
-            u.netloc == b.netloc
+            (base is None or u.netloc == urllib.parse.urlparse(base).netloc)
             and u.path.rstrip("/") == f"/{endpoint}"
             and "u" in qs
         )
@@ -349,17 +843,94 @@ def _already_direct(url: str, base: str, endpoint: str) -> bool:
 
 
 def make_direct_video(request: Request, original_url: str) -> str:
-    base = stream_resolver_base(request)
-    if _already_direct(original_url, base, "video"):
-        return original_url
-    return f"{base}/video?u={enc(original_url)}"
+    return BuildContext(stream_resolver_base(request)).direct_video(original_url)
 
 
 def make_direct_live(request: Request, original_url: str) -> str:
-    base = stream_resolver_base(request)
-    if _already_direct(original_url, base, "tv"):
-        return original_url
-    return f"{base}/tv?u={enc(original_url)}"
+    return BuildContext(stream_resolver_base(request)).direct_live(original_url)
+
+
+_quote = urllib.parse.quote
+
+class BuildContext:
+    """Per-build state shared by the ``build_*`` functions.
+
+    The resolver base is read (settings file) and parsed once; ``direct_source``
+    URLs are then produced with a prefix check and a single quote call.  The
+    full :func:`_already_direct` test only runs for URLs that already start
+    with ``<scheme>://<our netloc>/<endpoint>``.  In templated builds our
+    host is not known yet: wrappers count as ours when their host is one of
+    *own_netlocs* (per-playlist ``resolver_url`` values) or *request_netloc*.
+    New category ids are collected in :attr:`categories` and persisted with
+    :meth:`flush`.
+    """
+
+    def __init__(self,
+                 base: str,
+                 categories: Optional[CategoryAssigner] = None,
+                 own_netlocs: Iterable[str] = (),
+                 request_netloc: str = "") -> None:
+        self.base = base
+        self.netloc = urllib.parse.urlparse(base).netloc
+        self.categories = categories or CategoryAssigner()
+        self.own_netlocs = frozenset(n for n in own_netlocs if n)
+        self._match_netlocs = self.own_netlocs | ({request_netloc} if request_netloc else set())
+        self._video_prefix = f"{base}/video?u="
+        self._live_prefix = f"{base}/tv?u="
+        self._own_video = (f"http://{self.netloc}/video", f"https://{self.netloc}/video")
+        self._own_live = (f"http://{self.netloc}/tv", f"https://{self.netloc}/tv")
+
+    @classmethod
+    def for_request(cls, request: Request) -> "BuildContext":
+        return cls(stream_resolver_base(request))
+
+    @classmethod
+    def for_cache(cls, request: Optional[Request] = None) -> "BuildContext":
+        """Context for persisted caches: without a configured resolver URL the
+        base is :data:`HOST_TOKEN`, rendered per client host when served."""
+        base = configured_resolver_base()
+        if base:
+            return cls(base)
+        own = {urllib.parse.urlparse(it["resolver_url"]).netloc
+               for it in _playlists_index() if it.get("resolver_url")}
+        netloc = urllib.parse.urlparse(str(request.base_url)).netloc if request is not None else ""
+        return cls(HOST_TOKEN, own_netlocs=own, request_netloc=netloc)
+
+    @property
+    def templated(self) -> bool:
+        return self.base == HOST_TOKEN
+
+    @property
+    def fragment_key(self) -> str:
+        """What stored fragments depend on besides the playlist content.
+
+        The request host is left out: it only spares a double wrap, and
+        including it would rebuild every fragment whenever builds alternate
+        between requests and the background.
+        """
+        if not self.own_netlocs:
+            return self.base
+        return f"{self.base} {','.join(sorted(self.own_netlocs))}"
+
+    def _is_own(self, url: str, prefixes: Tuple[str, str], endpoint: str) -> bool:
+        if self.templated:
+            return (bool(self._match_netlocs) and f"/{endpoint}" in url
+                    and urllib.parse.urlparse(url).netloc in self._match_netlocs
+                    and _already_direct(url, None, endpoint))
+        return url.startswith(prefixes) and _already_direct(url, self.base, endpoint)
+
+    def direct_video(self, url: str) -> str:
+        if self._is_own(url, self._own_video, "video"):
+            return url
+        return self._video_prefix + _quote(url, safe="")
+
+    def direct_live(self, url: str) -> str:
+        if self._is_own(url, self._own_live, "tv"):
+            return url
+        return self._live_prefix + _quote(url, safe="")
+
+    def flush(self) -> None:
+        self.categories.flush()
 
 # ====== DURATE ======
 def _extract_duration(attrs: Dict[str, str]) -> int:
@@ -405,16 +976,19 @@ def _extract_duration(attrs: Dict[str, str]) -> int:
     return 1
 
 # ====== COSTRUZIONE STRUTTURE ======
-def build_vod_streams(request: Request, m3us: Iterable[M3UItem]) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+def build_vod_streams(request: Request, m3us: Iterable[M3UItem], ctx: Optional[BuildContext] = None) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    bctx = ctx or BuildContext.for_request(request)
+    cats = bctx.categories
     out: List[Dict[str, Any]] = []
     cat_map: Dict[str, str] = {}
     num = 1
     for it in m3us:
-        if not (guess_is_movie(it) or try_extract_movie_id(it.url)):
+        mid = it.url_class.movie_id
+        if not (mid or guess_is_movie(it)):
             continue
-        mid = try_extract_movie_id(it.url) or str(crc32_num(it.url))
+        mid = mid or str(crc32_num(it.url))
         cat_name = normalize_group_for_type(it.group or "Film", "vod")
-        cat_id = get_category_id(cat_name, 2000)
+        cat_id = cats.get(cat_name, 2000)
         cat_map[cat_name] = cat_id
         name = it.title.strip()
         stream_icon = it.tvg_logo or ""
@@ -430,15 +1004,17 @@ def build_vod_streams(request: Request, m3us: Iterable[M3UItem]) -> Tuple[List[D
             "category_id": cat_id,
             "category_name": cat_name,
             "container_extension": "m3u8",
-            "direct_source": make_direct_video(request, it.url)
+            "direct_source": bctx.direct_video(it.url)
         })
         num += 1
+    if ctx is None:
+        bctx.flush()
     return out, cat_map
 
 def build_vod_info(request: Request, vod_id: str, all_items: Iterable[M3UItem]) -> Dict[str, Any]:
     chosen: Optional[M3UItem] = None
     for it in all_items:
-        mid = try_extract_movie_id(it.url)
+        mid = it.url_class.movie_id
         if str(mid) == str(vod_id):
             chosen = it
             break
@@ -479,37 +1055,43 @@ def build_vod_info(request: Request, vod_id: str, all_items: Iterable[M3UItem])
         }
     }
 
-def build_series_collections(request: Request, items: Iterable[M3UItem]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+def build_series_collections(request: Request, items: Iterable[M3UItem], ctx: Optional[BuildContext] = None) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+    bctx = ctx or BuildContext.for_request(request)
+    cats = bctx.categories
     series_map: Dict[str, Dict[str, Any]] = {}
     cat_map: Dict[str, str] = {}
+    # sid -> season -> [(episode, seq, ep)] kept sorted on insert; ``seq``
+    # keeps duplicates in playlist order without comparing the dicts
+    seasons: Dict[str, Dict[int, List[Tuple[int, int, Dict[str, Any]]]]] = {}
+    seq = 0
 
     for it in items:
-        trip = try_extract_tv_triplet(it.url)
-        if not (guess_is_series(it) or trip):
-            continue
+        trip = it.url_class.tv_triplet
         if not trip:
             continue
         sid, season, episode = trip
         name = re.sub(r"\bS(\d{1,2})E(\d{1,2})\b", "", it.title, flags=re.I).strip() or f"Serie {sid}"
         cover = it.tvg_logo or ""
         cat_name = normalize_group_for_type(it.group or "Serie", "series")
-        cat_id = get_category_id(cat_name, 3000)
+        cat_id = cats.get(cat_name, 3000)
         cat_map[cat_name] = cat_id
 
-        s = series_map.setdefault(sid, {
+        series_map.setdefault(sid, {
             "series_id": sid,
             "name": name,
             "cover": cover,
             "plot": "",
             "rating": "",
             "category_id": cat_id,
-            "episodes_by_season": defaultdict(list)
+            "episodes_by_season": {}
         })
 
         ep_code = f"S{season:02d}E{episode:02d}"
         ep_id = f"{sid}-{ep_code}"
-        s["episodes_by_season"][str(season)].append({
+        bisect.insort(seasons.setdefault(sid, {}).setdefault(season, []), (episode, seq, {
             "id": ep_id,
+            "episode_num": episode,
+            "season": season,
             "title": ep_code,
             "container_extension": "m3u8",
             "info": {
@@ -517,41 +1099,38 @@ def build_series_collections(request: Request, items: Iterable[M3UItem]) -> Tupl
                 "plot": "",
                 "duration": str(_extract_duration(it.attrs))
             },
-            "direct_source": make_direct_video(request, it.url)
-        })
+            "direct_source": bctx.direct_video(it.url)
+        }))
+        seq += 1
 
-    # ordina gli episodi per numero all'interno di ogni stagione
-    ep_re = re.compile(r"E(\d+)$", re.I)
-    for sm in series_map.values():
-        ordered: Dict[str, List[Dict[str, Any]]] = {}
-        for season in sorted(sm["episodes_by_season"], key=lambda s: int(s)):
-            eps = sm["episodes_by_season"][season]
-            eps_sorted = sorted(
-                eps,
-                key=lambda e: int(ep_re.search(e["title"]).group(1)) if ep_re.search(e["title"]) else e["title"],
-            )
-            ordered[season] = eps_sorted
-        sm["episodes_by_season"] = ordered
+    for sid, sm in series_map.items():
+        sm["episodes_by_season"] = {
+            str(season): [ep for _, _, ep in eps]
+            for season, eps in sorted(seasons[sid].items())
+        }
 
+    if ctx is None:
+        bctx.flush()
     return series_map, cat_map
 
-def build_live_streams(request: Request, items: Iterable[M3UItem]) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+def _sort_series_episodes(sm: Dict[str, Any]) -> None:
+    """Ordina stagioni ed episodi (per numero) di una serie, in place."""
+    sm["episodes_by_season"] = {
+        season: sorted(eps, key=lambda e: e["episode_num"])
+        for season, eps in sorted(sm["episodes_by_season"].items(), key=lambda kv: int(kv[0]))
+    }
+
+def build_live_streams(request: Request, items: Iterable[M3UItem], ctx: Optional[BuildContext] = None) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    bctx = ctx or BuildContext.for_request(request)
+    cats = bctx.categories
     out: List[Dict[str, Any]] = []
     cat_map: Dict[str, str] = {}
     num = 1
     for it in items:
         cat_name = normalize_group_for_type(it.group or "Live", "live")
-        cat_id = get_category_id(cat_name, 1000)
+        cat_id = cats.get(cat_name, 1000)
         cat_map[cat_name] = cat_id
-        token = ""
-        try:
-            p = urllib.parse.urlparse(it.url)
-            token = p.path.strip("/").split("/")[-1] or ""
-        except Exception:
-            token = ""
-        if not token or len(token) < 6:
-            token = hex(crc32_num(it.url))[2:]
-        stream_id = f"lv_{token[:16]}"
+        stream_id = it.url_class.live_id
 
         out.append({
             "num": num,
@@ -565,9 +1144,11 @@ def build_live_streams(request: Request, items: Iterable[M3UItem]) -> Tuple[List
             "added": "",
             "custom_sid": "",
             "container_extension": "m3u8",
-            "direct_source": make_direct_live(request, it.url)
+            "direct_source": bctx.direct_live(it.url)
         })
         num += 1
+    if ctx is None:
+        bctx.flush()
     return out, cat_map
 
 # ====== AUTH XTREAM ======
@@ -580,28 +1161,288 @@ def require_xtream(xt_id: str, username: str, password: str) -> Dict[str, Any]:
             return row
     raise HTTPException(401, "Unauthorized")
 
-# ====== HELPERS CARICAMENTO ======
-def items_for_xtream_selection(sel_ids: List[str]) -> List[M3UItem]:
-    items: List[M3UItem] = []
-    for pid in sel_ids or []:
-        items.extend(_read_playlist(pid))
-    return items
+# ====== FRAMMENTI PER PLAYLIST ======
+# Each selected playlist is turned into a "fragment" (streams, categories,
+# series, counts) for one content type.  Fragments are persisted together with
+# the SHA-1 of the playlist file and the resolver base they were built with, so
+# a rebuild only re-parses and re-classifies the playlists that changed.
+FRAGMENT_VERSION = 5
 
+_PLAYLIST_DIGESTS: Dict[str, Tuple[Tuple[int, int], str]] = {}
 
-def build_xtream_cache(request: Request, xt_config: Dict[str, Any]) -> Dict[str, Any]:
-    """Build and persist cache structures for a given Xtream config."""
+def _playlist_digest(pl_id: str) -> Optional[str]:
+    """SHA-1 of the converted playlist file, ``None`` when it does not exist.
 
-    live_items = items_for_xtream_selection(xt_config.get("live_list_ids", []))
-    movie_items = items_for_xtream_selection(
-        xt_config.get("movie_list_ids", []) + xt_config.get("mixed_list_ids", [])
-    )
-    series_items = items_for_xtream_selection(
-        xt_config.get("series_list_ids", []) + xt_config.get("mixed_list_ids", [])
-    )
+    Memoized per file stamp, so unchanged playlists are not re-hashed.
+    """
+    stamp = _playlist_stamp(pl_id)
+    if stamp is None:
+        return None
+    hit = _PLAYLIST_DIGESTS.get(pl_id)
+    if hit and hit[0] == stamp:
+        return hit[1]
+    h = hashlib.sha1()
+    try:
+        with open(_playlist_file(pl_id), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except FileNotFoundError:
+        return None
+    digest = h.hexdigest()
+    if _playlist_stamp(pl_id) == stamp:
+        _PLAYLIST_DIGESTS[pl_id] = (stamp, digest)
+    return digest
+
+_FRAGMENT_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+
+def _fragment_file(pl_id: str, kind: str) -> str:
+    return os.path.join(XTREAM_FRAGMENTS_DIR, f"{pl_id}.{kind}.json")
+
+def _fragment_ids(xt: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Playlist ids of *xt* per fragment kind (mixed lists feed vod and series)."""
+    mixed = list(xt.get("mixed_list_ids", []) or [])
+    return {
+        "live": list(xt.get("live_list_ids", []) or []),
+        "vod": list(xt.get("movie_list_ids", []) or []) + mixed,
+        "series": list(xt.get("series_list_ids", []) or []) + mixed,
+    }
+
+def _prune_fragments(current: Dict[str, Any]) -> None:
+    """Remove the fragments no Xtream config (nor *current*) uses any more."""
+    used = {f"{pid}.{kind}.json"
+            for xt in [*_xtreams(), current]
+            for kind, pids in _fragment_ids(xt).items() for pid in pids}
+    try:
+        names = os.listdir(XTREAM_FRAGMENTS_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.endswith(".json") and name not in used:
+            try:
+                os.remove(os.path.join(XTREAM_FRAGMENTS_DIR, name))
+            except FileNotFoundError:
+                pass
+
+def _build_live_fragment(request: Request, items: List[M3UItem], ctx: BuildContext) -> Dict[str, Any]:
+    streams, cats = build_live_streams(request, items, ctx)
+    return {"streams": streams, "categories": cats, "count": len(items),
+            "keys": [canonical_url(it.url) for it in items]}
+
+def _build_vod_fragment(request: Request, items: List[M3UItem], ctx: BuildContext) -> Dict[str, Any]:
+    # keys must pair one-to-one with the streams: only movies produce one
+    movies = [it for it in items if it.url_class.movie_id or guess_is_movie(it)]
+    streams, cats = build_vod_streams(request, movies, ctx)
+    return {
+        "streams": streams,
+        "categories": cats,
+        "movie_items": [m.to_dict() for m in items],
+        "count": len(items),
+        "keys": [canonical_url(it.url) for it in movies],
+    }
+
+def _build_series_fragment(request: Request, items: List[M3UItem], ctx: BuildContext) -> Dict[str, Any]:
+    series_map, cats = build_series_collections(request, items, ctx)
+    return {"series": series_map, "categories": cats, "count": len(items)}
+
+_FRAGMENT_BUILDERS = {
+    "live": _build_live_fragment,
+    "vod": _build_vod_fragment,
+    "series": _build_series_fragment,
+}
+
+def forget_playlist(pl_id: str) -> None:
+    """Drop the fragments and the in-memory state of a deleted playlist."""
+    global _PARSED_BYTES
+    with _PARSED_LOCK:
+        old = _PARSED_PLAYLISTS.pop(pl_id, None)
+        if old is not None:
+            _PARSED_BYTES -= old[0][1]
+        _PARSE_LOCKS.pop(pl_id, None)
+        for kind in _FRAGMENT_BUILDERS:
+            _FRAGMENT_LOCKS.pop((pl_id, kind), None)
+    _PLAYLIST_DIGESTS.pop(pl_id, None)
+    for kind in _FRAGMENT_BUILDERS:
+        try:
+            os.remove(_fragment_file(pl_id, kind))
+        except FileNotFoundError:
+            pass
+
+def playlist_fragment(request: Optional[Request],
+                      pl_id: str,
+                      kind: str,
+                      ctx: Optional[BuildContext] = None) -> Dict[str, Any]:
+    """Return the derived *kind* fragment for one playlist.
+
+    The stored fragment is reused when the playlist content hash and the
+    resolver base still match; otherwise the playlist is parsed, classified
+    and the fragment rewritten.
+    """
+    digest = _playlist_digest(pl_id)
+    bctx = ctx or BuildContext.for_cache(request)
+    base = bctx.fragment_key
+    path = _fragment_file(pl_id, kind)
+    with _PARSED_LOCK:
+        lock = _FRAGMENT_LOCKS.setdefault((pl_id, kind), threading.Lock())
+    # parallel builds sharing a playlist derive its fragment once
+    with lock:
+        if digest:
+            try:
+                frag = load_json(path, None)
+            except ValueError:
+                frag = None
+            if (frag and frag.get("version") == FRAGMENT_VERSION
+                    and frag.get("digest") == digest and frag.get("base") == base):
+                CACHE_TOTAL.inc("fragment", "hit")
+                return frag["data"]
+        CACHE_TOTAL.inc("fragment", "miss")
+        data = _FRAGMENT_BUILDERS[kind](request, _read_playlist(pl_id), bctx)
+        if ctx is None:
+            bctx.flush()
+        if digest:
+            save_json(path, {"version": FRAGMENT_VERSION, "digest": digest, "base": base, "data": data})
+    return data
+
+# ====== DEDUP TRA PLAYLIST ======
+# Overlapping provider lists carry the same channel several times.  The merge
+# keeps one stream per canonical URL and, when enabled, (live only) per tvg-id;
+# which copy survives is decided by the precedence policy: "first"/"last"
+# playlist in selection order, or an explicit list of playlist ids (highest
+# first).  A tvg-id only makes streams of *other* playlists duplicates: inside
+# one list it is often shared by HD/SD/+1 variants of a channel.
+# Per config: ``dedup`` (keys, [] disables) and ``dedup_prefer``.
+DEDUP_KEYS = ("url", "tvg_id")
+DEFAULT_DEDUP = [k.strip() for k in os.environ.get("XTREAM_DEDUP", "url").split(",")
+                 if k.strip() in DEDUP_KEYS]
+DEFAULT_DEDUP_PREFER = os.environ.get("XTREAM_DEDUP_PREFER", "first")
+
+_DEFAULT_PORTS = {"http": ":80", "https": ":443"}
+
+def canonical_url(url: str) -> str:
+    """Comparable form of a stream URL.
+
+    Our own ``/video?u=``/``/tv?u=`` wrappers are removed (converted
+    playlists of different resolvers point to the same source), scheme and
+    host are lowercased, default ports and fragments dropped.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    if parts.query and parts.path.endswith(("/video", "/tv")):
+        inner = urllib.parse.parse_qs(parts.query).get("u")
+        if inner:
+            return canonical_url(inner[0])
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    port = _DEFAULT_PORTS.get(scheme)
+    if port and netloc.endswith(port):
+        netloc = netloc[: -len(port)]
+    return urllib.parse.urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+def _precedence(pl_ids: List[str], prefer: Any) -> List[int]:
+    """Fragment indexes from the highest to the lowest precedence."""
+    order = list(range(len(pl_ids)))
+    if isinstance(prefer, list):
+        rank = {str(p): i for i, p in enumerate(prefer)}
+        return sorted(order, key=lambda i: rank.get(pl_ids[i], len(rank)))
+    if prefer == "last":
+        order.reverse()
+    return order
+
+def _dedup_flags(frags: List[Dict[str, Any]],
+                 pl_ids: List[str],
+                 keys: Iterable[str],
+                 prefer: Any) -> List[List[bool]]:
+    """For every fragment stream, whether it survives deduplication."""
+    by_url, by_tvg = "url" in keys, "tvg_id" in keys
+    flags: List[List[bool]] = [[] for _ in frags]
+    seen_urls: set = set()
+    tvg_owner: Dict[str, int] = {}  # tvg-id -> fragment that claimed it
+    for i in _precedence(pl_ids, prefer):
+        urls = frags[i].get("keys") or []
+        out = flags[i]
+        for j, st in enumerate(frags[i].get("streams", [])):
+            url = urls[j] if by_url and j < len(urls) else None
+            tvg = (st.get("epg_channel_id") or "").lower() if by_tvg else ""
+            dup = (url is not None and url in seen_urls) or (bool(tvg) and tvg_owner.get(tvg, i) != i)
+            if not dup:
+                if url is not None:
+                    seen_urls.add(url)
+                if tvg:
+                    tvg_owner.setdefault(tvg, i)
+            out.append(not dup)
+    return flags
+
+def _merge_stream_fragments(frags: List[Dict[str, Any]],
+                            pl_ids: Optional[List[str]] = None,
+                            dedup: Iterable[str] = (),
+                            prefer: Any = "first") -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    """Concatenate stream fragments renumbering ``num`` in selection order.
+
+    With *dedup* keys, duplicates across the fragments are dropped according
+    to *prefer* (see :func:`_precedence`); categories left without streams
+    are dropped with them.
+    """
+    dedup = list(dedup)
+    flags = _dedup_flags(frags, pl_ids or [""] * len(frags), dedup, prefer) if dedup else None
+    streams: List[Dict[str, Any]] = []
+    cats: Dict[str, str] = {}
+    for i, frag in enumerate(frags):
+        if flags is None:
+            for s in frag.get("streams", []):
+                streams.append({**s, "num": len(streams) + 1})
+            cats.update(frag.get("categories", {}))
+            continue
+        keep = flags[i]
+        for j, s in enumerate(frag.get("streams", [])):
+            if keep[j]:
+                streams.append({**s, "num": len(streams) + 1})
+                cats[s["category_name"]] = s["category_id"]
+    return streams, cats
+
+def _merge_series_fragments(frags: Iterable[Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+    """Merge series fragments: first playlist wins the metadata, episodes are joined."""
+    series_map: Dict[str, Dict[str, Any]] = {}
+    cats: Dict[str, str] = {}
+    touched: set = set()
+    for frag in frags:
+        for sid, s in frag.get("series", {}).items():
+            cur = series_map.get(sid)
+            if cur is None:
+                series_map[sid] = {
+                    **s,
+                    "episodes_by_season": {k: list(v) for k, v in s["episodes_by_season"].items()},
+                }
+                continue
+            for season, eps in s["episodes_by_season"].items():
+                cur["episodes_by_season"].setdefault(season, []).extend(eps)
+            touched.add(sid)
+        cats.update(frag.get("categories", {}))
+    for sid in touched:
+        _sort_series_episodes(series_map[sid])
+    return series_map, cats
+
+def build_xtream_cache(request: Optional[Request], xt_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Build and persist cache structures for a given Xtream config.
+
+    Only playlists whose content changed since the previous build are
+    reprocessed; the others are served from their stored fragments.
+    Persisted caches do not depend on the request (see
+    :meth:`BuildContext.for_cache`), so *request* may be ``None`` for
+    builds started outside an HTTP call.
+    """
 
-    live_streams, live_cats = build_live_streams(request, live_items)
-    vod_streams, vod_cats = build_vod_streams(request, movie_items)
-    series_map, series_cats = build_series_collections(request, series_items)
+    ctx = BuildContext.for_cache(request)
+    ids = _fragment_ids(xt_config)
+    live_ids, vod_ids = ids["live"], ids["vod"]
+    live_frags = [playlist_fragment(request, pid, "live", ctx) for pid in live_ids]
+    vod_frags = [playlist_fragment(request, pid, "vod", ctx) for pid in vod_ids]
+    series_frags = [playlist_fragment(request, pid, "series", ctx) for pid in ids["series"]]
+    ctx.flush()
+    _prune_fragments(xt_config)
+
+    dedup = xt_config.get("dedup", DEFAULT_DEDUP)
+    prefer = xt_config.get("dedup_prefer", DEFAULT_DEDUP_PREFER)
+    live_streams, live_cats = _merge_stream_fragments(live_frags, live_ids, dedup, prefer)
+    vod_streams, vod_cats = _merge_stream_fragments(vod_frags, vod_ids, dedup, prefer)
+    series_map, series_cats = _merge_series_fragments(series_frags)
 
     cache = {
         "live_streams": live_streams,
@@ -610,18 +1451,358 @@ def build_xtream_cache(request: Request, xt_config: Dict[str, Any]) -> Dict[str,
         "vod_categories": vod_cats,
         "series_map": series_map,
         "series_categories": series_cats,
-        "movie_items": [asdict(m) for m in movie_items],
+        "movie_items": [m for f in vod_frags for m in f.get("movie_items", [])],
         "counts": {
-            "available_channels": len(live_items),
-            "available_movies": len(movie_items),
-            "available_series": len(series_items),
+            "available_channels": len(live_streams),
+            "available_movies": len(vod_streams),
+            "available_series": sum(f.get("count", 0) for f in series_frags),
+            # streams dropped by the merge (non-movie items never were streams)
+            "duplicates_removed": (sum(len(f.get("streams", [])) for f in live_frags + vod_frags)
+                                   - len(live_streams) - len(vod_streams)),
         },
     }
 
-    cache_file = os.path.join(XTREAM_CACHE_DIR, f"{xt_config.get('id')}.json")
-    save_json(cache_file, cache)
+    xt_id = xt_config.get("id")
+    adir = _artifacts_dir(xt_id)
+    # per-host renderings written by earlier versions
+    shutil.rmtree(os.path.join(adir, "hosts"), ignore_errors=True)
+    series_list = [series_projection(sm) for sm in series_map.values()]
+    bodies = {
+        "get_live_streams": json_chunks(live_streams),
+        "get_vod_streams": json_chunks(vod_streams),
+        "get_series": json_chunks(series_list),
+        "get_live_categories": json_chunks(_category_list(live_cats)),
+        "get_vod_categories": json_chunks(_category_list(vod_cats)),
+        "get_series_categories": json_chunks(_category_list(series_cats)),
+        "get.php": iter_chunks(render_get_php(live_streams, vod_streams, series_map)),
+    }
+    templated = ctx.templated
+    build = f"{time.time_ns():x}"
+    artifacts = {}
+    for name, chunks in bodies.items():
+        rel = ARTIFACT_FILES[name].format(build)
+        artifacts[name] = write_artifact(os.path.join(adir, rel), chunks, templated=templated)
+        artifacts[name]["file"] = rel
+    live_index, live_cat_metas = _write_category_artifacts(adir, "live", live_streams, build, templated)
+    vod_index, vod_cat_metas = _write_category_artifacts(adir, "vod", vod_streams, build, templated)
+    series_index, series_cat_metas = _write_category_artifacts(adir, "series", series_list, build, templated)
+    cat_metas = {"live": live_cat_metas, "vod": vod_cat_metas, "series": series_cat_metas}
+    categories = CATEGORIES_FILE.format(build)
+    save_json(os.path.join(adir, categories), cat_metas)
+    series_info = _write_series_info(adir, series_map, build)
+    cache["category_index"] = {"live": live_index, "vod": vod_index, "series": series_index}
+    cache["built_at"] = now_ts()
+
+    cache_file = os.path.join(XTREAM_CACHE_DIR, f"{xt_id}.json")
+    cache_meta = write_artifact(cache_file, json_chunks(cache), compress=False)
+    previous = load_json(_manifest_file(xt_id), {})
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "built_at": cache["built_at"],
+        "etag": cache_meta["etag"],
+        "templated": ctx.templated,
+        "counts": cache["counts"],
+        "artifacts": artifacts,
+        "categories": categories,
+        "series_info": series_info,
+    }
+    save_json(_manifest_file(xt_id), manifest)
+    # requests holding the previous manifest may still read its files
+    _prune_build_files(adir, [manifest, previous])
     return cache
 
+def _category_list(cat_map: Dict[str, str]) -> List[Dict[str, str]]:
+    return [
+        {"category_id": cid, "category_name": name}
+        for name, cid in sorted(cat_map.items(), key=lambda x: x[1])
+    ]
+
+def series_projection(s: Dict[str, Any]) -> Dict[str, Any]:
+    """Entry of ``get_series`` for one series."""
+    return {
+        "series_id": s["series_id"],
+        "name": s["name"],
+        "cover": s["cover"],
+        "plot": s["plot"],
+        "rating": s["rating"],
+        "category_id": s["category_id"],
+    }
+
+def series_info_body(s: Dict[str, Any]) -> Dict[str, Any]:
+    """Body of ``get_series_info`` for one series."""
+    info = {
+        "name": s["name"],
+        "cover": s["cover"],
+        "plot": s["plot"],
+        "rating": s["rating"],
+        "releaseDate": "",
+        "stream_type": "series",
+        "series_id": s["series_id"],
+    }
+    return {"info": info, "episodes": s["episodes_by_season"], "seasons": []}
+
+# ``get_series_info`` bodies are concatenated in one file; a small index maps
+# each series id to ``[offset, length, sha1]`` so a lookup is one seek + read.
+SERIES_INFO_FILE = "series_info.{}.bin"
+SERIES_INDEX_FILE = "series_index.{}.json"
+
+def _write_series_info(adir: str, series_map: Dict[str, Dict[str, Any]], build: str) -> Dict[str, str]:
+    """Write the bodies and their index; return their file names."""
+    names = {"bin": SERIES_INFO_FILE.format(build), "index": SERIES_INDEX_FILE.format(build)}
+    index: Dict[str, List[Any]] = {}
+
+    def bodies() -> Iterable[bytes]:
+        offset = 0
+        for sid, s in series_map.items():
+            body = b"".join(json_chunks(series_info_body(s)))
+            index[sid] = [offset, len(body), hashlib.sha1(body).hexdigest()]
+            offset += len(body)
+            yield body
+
+    write_artifact(os.path.join(adir, names["bin"]), bodies(), compress=False)
+    save_json(os.path.join(adir, names["index"]), index)
+    return names
+
+def _category_artifact_file(kind: str, cid: str, build: str) -> str:
+    return f"cat/{kind}_{cid}.{build}.json"
+
+def _write_category_artifacts(adir: str,
+                              kind: str,
+                              streams: List[Dict[str, Any]],
+                              build: str,
+                              templated: bool = False) -> Tuple[Dict[str, List[int]], Dict[str, Dict[str, Any]]]:
+    """Build the category → offsets index of *streams* and pre-render one body per category."""
+    index: Dict[str, List[int]] = {}
+    for i, s in enumerate(streams):
+        index.setdefault(str(s.get("category_id")), []).append(i)
+    metas = {}
+    for cid, offsets in index.items():
+        rel = _category_artifact_file(kind, cid, build)
+        metas[cid] = write_artifact(os.path.join(adir, rel),
+                                    json_chunks([streams[i] for i in offsets]), templated=templated)
+        metas[cid]["file"] = rel
+    return index, metas
+
+def _build_files(adir: str, manifest: Dict[str, Any]) -> set:
+    """Files (relative to *adir*) read through *manifest*."""
+    files = {meta["file"] for meta in manifest.get("artifacts", {}).values() if "file" in meta}
+    files.update((manifest.get("series_info") or {}).values())
+    if manifest.get("categories"):
+        files.add(manifest["categories"])
+        for metas in load_json(os.path.join(adir, manifest["categories"]), {}).values():
+            files.update(meta["file"] for meta in metas.values() if "file" in meta)
+    return files
+
+def _prune_build_files(adir: str, manifests: Iterable[Dict[str, Any]]) -> None:
+    """Remove the bodies (and their variants) no manifest in *manifests* reads."""
+    keep = set().union(*(_build_files(adir, m) for m in manifests))
+    for sub in ("", "cat"):
+        try:
+            names = os.listdir(os.path.join(adir, sub))
+        except FileNotFoundError:
+            continue
+        for name in names:
+            rel = f"{sub}/{name}" if sub else name
+            path = os.path.join(adir, rel)
+            # .tmp: a build writing right now
+            if rel == "manifest.json" or name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            base = rel[:-len(".idx")] if rel.endswith(".idx") else rel
+            for suffix, _ in ENCODINGS.values():
+                if base.endswith(suffix):
+                    base = base[:-len(suffix)]
+            if base not in keep:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+# ====== CACHE: LETTURA ======
+# Pre-rendered bodies written with each cache build (see ``app.artifacts``).
+# Every file carries a per-build name recorded in the manifest (``file`` in
+# each meta): the manifest a request holds always matches the body it reads,
+# and the files of the previous build are kept for requests still using it.
+MANIFEST_VERSION = 9
+ARTIFACT_FILES = {
+    "get.php": "get.{}.m3u",
+    "get_live_streams": "live_streams.{}.json",
+    "get_vod_streams": "vod_streams.{}.json",
+    "get_series": "series.{}.json",
+    "get_live_categories": "live_categories.{}.json",
+    "get_vod_categories": "vod_categories.{}.json",
+    "get_series_categories": "series_categories.{}.json",
+}
+CATEGORIES_FILE = "categories.{}.json"
+# stream actions that accept ``category_id`` → kind of the per-category bodies
+CATEGORY_ACTIONS = {
+    "get_live_streams": "live",
+    "get_vod_streams": "vod",
+    "get_series": "series",
+}
+
+def _artifacts_dir(xt_id: str) -> str:
+    """Directory holding the pre-rendered bodies of one Xtream cache."""
+    return os.path.join(XTREAM_CACHE_DIR, str(xt_id))
+
+def _manifest_file(xt_id: str) -> str:
+    return os.path.join(_artifacts_dir(xt_id), "manifest.json")
+
+def _cache_expired(xt: Dict[str, Any]) -> bool:
+    if xt.get("stale_since"):
+        return True
+    every_hours = int(xt.get("every_hours", 12) or 12)
+    last_refresh = int(xt.get("last_refresh", 0) or 0)
+    return now_ts() - last_refresh > every_hours * 3600
+
+def _rebuild_cache(request: Optional[Request], xt: Dict[str, Any]) -> Dict[str, Any]:
+    with _PARSED_LOCK:
+        lock = _BUILD_LOCKS.setdefault(str(xt.get("id")), threading.Lock())
+    with lock:
+        # a build that held the lock meanwhile may already have refreshed it
+        current = next((x for x in _xtreams() if x.get("id") == xt.get("id")), None)
+        if (current and not _cache_expired(current)
+                and int(current.get("last_refresh", 0) or 0) > int(xt.get("last_refresh", 0) or 0)):
+            cache = load_json(os.path.join(XTREAM_CACHE_DIR, f"{xt.get('id')}.json"), None)
+            if cache is not None:
+                xt.update(current)
+                xt.pop("stale_since", None)
+                return cache
+        started = time.time()
+        cache = build_xtream_cache(request, xt)
+        xt["last_refresh"] = now_ts()
+        # the stale mark on disk may be newer than this build: see _clear_stale
+        xt.pop("stale_since", None)
+        _save_xtreams([xt])
+        _clear_stale(xt.get("id"), started)
+    return cache
+
+_BUILD_LOCKS: Dict[str, threading.Lock] = {}
+
+# ====== DIPENDENZE PLAYLIST -> XTREAM ======
+# Reverse index playlist id -> ids of the Xtream configs listing it, rebuilt
+# whenever xtreams.json changes.  A refreshed or deleted playlist marks only
+# its dependents stale (``stale_since``, which makes _cache_expired true)
+# and queues their rebuild in the background.
+_LIST_KEYS = ("live_list_ids", "movie_list_ids", "series_list_ids", "mixed_list_ids")
+_DEPENDENTS: Tuple[Optional[Tuple[int, int]], Dict[str, List[str]]] = (None, {})
+
+def xtream_dependents() -> Dict[str, List[str]]:
+    """Map playlist id -> ids of the Xtream configs that use it."""
+    global _DEPENDENTS
+    try:
+        st = os.stat(XTREAMS_JSON)
+        stamp: Optional[Tuple[int, int]] = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        stamp = None
+    if stamp is not None and _DEPENDENTS[0] == stamp:
+        return _DEPENDENTS[1]
+    deps: Dict[str, List[str]] = defaultdict(list)
+    for xt in _xtreams():
+        xt_id = xt.get("id")
+        for pl_id in dict.fromkeys(p for key in _LIST_KEYS for p in xt.get(key) or []):
+            deps[str(pl_id)].append(xt_id)
+    _DEPENDENTS = (stamp, dict(deps))
+    return _DEPENDENTS[1]
+
+def xtreams_using(pl_ids: Iterable[str]) -> List[Dict[str, Any]]:
+    """Xtream configs that include at least one of the playlists *pl_ids*."""
+    deps = xtream_dependents()
+    wanted = {xt_id for pl_id in pl_ids for xt_id in deps.get(pl_id, ())}
+    return [xt for xt in _xtreams() if xt.get("id") in wanted]
+
+def mark_xtreams_stale(xt_ids: Iterable[str]) -> None:
+    wanted = set(xt_ids)
+    if not wanted:
+        return
+    with _XTREAMS_LOCK:
+        items = load_json(XTREAMS_JSON, [])
+        for xt in items:
+            if xt.get("id") in wanted:
+                xt["stale_since"] = time.time()
+        save_json(XTREAMS_JSON, items)
+
+def _clear_stale(xt_id: Optional[str], built_from: float) -> None:
+    """Drop the stale mark of *xt_id* unless it was set after *built_from*."""
+    with _XTREAMS_LOCK:
+        items = load_json(XTREAMS_JSON, [])
+        for xt in items:
+            if xt.get("id") == xt_id and xt.get("stale_since"):
+                if float(xt["stale_since"]) > built_from:
+                    return
+                del xt["stale_since"]
+                save_json(XTREAMS_JSON, items)
+                return
+
+XTREAM_REBUILD_WORKERS = int(os.environ.get("XTREAM_REBUILD_WORKERS", "1"))
+_REBUILD_LOCK = threading.Lock()
+_REBUILD_POOL: Optional[ThreadPoolExecutor] = None
+_REBUILD_QUEUED: set = set()
+
+def queue_xtream_rebuilds(xt_ids: Iterable[str]) -> List[str]:
+    """Schedule background rebuilds; ids already waiting are not queued twice."""
+    global _REBUILD_POOL
+    queued: List[str] = []
+    with _REBUILD_LOCK:
+        if _REBUILD_POOL is None:
+            _REBUILD_POOL = ThreadPoolExecutor(max(1, XTREAM_REBUILD_WORKERS),
+                                               thread_name_prefix="xtream-rebuild")
+        for xt_id in xt_ids:
+            if xt_id in _REBUILD_QUEUED:
+                continue
+            _REBUILD_QUEUED.add(xt_id)
+            _REBUILD_POOL.submit(_background_rebuild, xt_id)
+            queued.append(xt_id)
+    return queued
+
+def _background_rebuild(xt_id: str) -> None:
+    with _REBUILD_LOCK:
+        _REBUILD_QUEUED.discard(xt_id)
+    xt = next((x for x in _xtreams() if x.get("id") == xt_id), None)
+    if xt is None or not xt.get("stale_since"):
+        return  # deleted, or already rebuilt by a request in the meantime
+    try:
+        _rebuild_cache(None, xt)
+    except Exception:
+        logger.exception("Background rebuild of xtream %s failed", xt_id)
+
+def invalidate_playlists(pl_ids: Iterable[str], rebuild: bool = True) -> List[str]:
+    """Mark the caches using *pl_ids* stale and, if *rebuild*, queue their
+    rebuild; return the affected Xtream ids."""
+    deps = xtream_dependents()
+    xt_ids = list(dict.fromkeys(xt_id for pl_id in pl_ids for xt_id in deps.get(pl_id, ())))
+    mark_xtreams_stale(xt_ids)
+    if rebuild:
+        queue_xtream_rebuilds(xt_ids)
+    return xt_ids
+
+def rebuild_xtream_cache(xt: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuild the cache of *xt* outside a request; returns the stream counts."""
+    return _rebuild_cache(None, xt).get("counts", {})
+
+def load_xtream_cache(request: Request, xt: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the cache for *xt*, rebuilding it when expired or missing."""
+    cache_data: Optional[Dict[str, Any]] = None
+    if not _cache_expired(xt):
+        cache_data = load_json(os.path.join(XTREAM_CACHE_DIR, f"{xt.get('id')}.json"), None)
+    note(cache="hit" if cache_data is not None else "rebuild")
+    CACHE_TOTAL.inc("xtream_cache", "hit" if cache_data is not None else "miss")
+    if cache_data is None:
+        cache_data = _rebuild_cache(request, xt)
+    return cache_data
+
+def load_xtream_manifest(request: Request, xt: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the artifacts manifest for *xt* without loading the cache body."""
+    manifest: Optional[Dict[str, Any]] = None
+    if not _cache_expired(xt):
+        manifest = load_json(_manifest_file(xt.get("id")), None)
+    rebuild = manifest is None or manifest.get("version") != MANIFEST_VERSION
+    note(cache="rebuild" if rebuild else "hit")
+    CACHE_TOTAL.inc("xtream_manifest", "miss" if rebuild else "hit")
+    if rebuild:
+        _rebuild_cache(request, xt)
+        manifest = load_json(_manifest_file(xt.get("id")), {})
+    return manifest
+
 # ====== XTREAM: PLAYER API ======
 @router.get("/xtream/{xt_id}/player_api.php")
 def xt_player_api(request: Request,
@@ -630,42 +1811,78 @@ def xt_player_api(request: Request,
                   username: Optional[str] = None,
                   password: Optional[str] = None,
                   vod_id: Optional[str] = None,
-                  series_id: Optional[str] = None):
+                  series_id: Optional[str] = None,
+                  category_id: Optional[str] = None):
+    label = "none" if action is None else (action if action in PLAYER_API_ACTIONS else "other")
+    t0 = time.perf_counter()
+    try:
+        response = _player_api(request, xt_id, action, username, password, vod_id, series_id, category_id)
+    finally:
+        PLAYER_API_SECONDS.observe(time.perf_counter() - t0, label)
+    size = _response_size(response)
+    if size is not None:
+        PLAYER_API_BYTES.observe(size, label)
+    return response
+
+def _response_size(response: Any) -> Optional[int]:
+    """Body size of a player_api response, without reading file bodies."""
+    length = getattr(response, "headers", {}).get("content-length")
+    if length is not None:
+        return int(length)
+    path = getattr(response, "path", None)
+    if path:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+    return None
+
+def _player_api(request: Request,
+                xt_id: str,
+                action: Optional[str],
+                username: Optional[str],
+                password: Optional[str],
+                vod_id: Optional[str],
+                series_id: Optional[str],
+                category_id: Optional[str]) -> Response:
     if not username or not password:
         raise HTTPException(401, "Unauthorized")
     xt = require_xtream(xt_id, username, password)
+    if action not in PLAYER_API_ACTIONS:
+        raise HTTPException(400, f"action non supportata: {action}")
+
+    # validators come from the small manifest: a 304 never loads the cache body
+    manifest = load_xtream_manifest(request, xt)
+    if action in CATEGORY_ACTIONS and category_id:
+        return _serve_category(request, xt, action, category_id, manifest)
+    if action in ARTIFACT_FILES:
+        return _serve_artifact(request, xt, action, media_type="application/json", manifest=manifest)
+    if action == "get_series_info":
+        return _serve_series_info(request, xt, series_id, manifest)
 
-    cache_file = os.path.join(XTREAM_CACHE_DIR, f"{xt_id}.json")
-    cache_data: Optional[Dict[str, Any]] = None
-
-    every_hours = int(xt.get("every_hours", 12) or 12)
-    last_refresh = int(xt.get("last_refresh", 0) or 0)
-    expired = now_ts() - last_refresh > every_hours * 3600
-
-    if not expired:
-        cache_data = load_json(cache_file, None)
-
-    if cache_data is None:
-        cache_data = build_xtream_cache(request, xt)
-        xt["last_refresh"] = now_ts()
-        _save_xtreams([xt])
-
-    live_streams = cache_data.get("live_streams", [])
-    vod_streams = cache_data.get("vod_streams", [])
-    series_map = cache_data.get("series_map", {})
-    live_cat_map = cache_data.get("live_categories", {})
-    vod_cat_map = cache_data.get("vod_categories", {})
-    series_cat_map = cache_data.get("series_categories", {})
-    movie_items = [M3UItem(**m) for m in cache_data.get("movie_items", [])]
-    counts = cache_data.get("counts", {})
-
-    available_channels = counts.get("available_channels", len(live_streams))
-    available_movies = counts.get("available_movies", len(vod_streams))
-    available_series = counts.get("available_series", sum(
-        len(eps) for sm in series_map.values() for eps in sm.get("episodes_by_season", {}).values()
-    ))
+    etag = content_etag(manifest.get("etag", ""), action or "", vod_id or "",
+                        username, password, request.base_url)
+    return conditional_json(
+        request, etag, manifest.get("built_at"),
+        lambda: _player_api_body(request, xt, action, username, password, vod_id, manifest),
+    )
 
+PLAYER_API_ACTIONS = {
+    None,
+    "get_live_categories", "get_live_streams",
+    "get_vod_categories", "get_vod_streams", "get_vod_info",
+    "get_series_categories", "get_series", "get_series_info",
+}
+
+def _player_api_body(request: Request,
+                     xt: Dict[str, Any],
+                     action: Optional[str],
+                     username: str,
+                     password: str,
+                     vod_id: Optional[str],
+                     manifest: Dict[str, Any]) -> Any:
     if action is None:
+        counts = manifest.get("counts", {})
         return {
             "user_info": {
                 "auth": 1, "status": "Active",
@@ -678,75 +1895,57 @@ def xt_player_api(request: Request,
                 "server_protocol": "http",
                 "timezone": "UTC"
             },
-            "available_channels": available_channels,
-            "available_movies": available_movies,
-            "available_series": available_series,
+            "available_channels": counts.get("available_channels", 0),
+            "available_movies": counts.get("available_movies", 0),
+            "available_series": counts.get("available_series", 0),
         }
 
-    if action == "get_live_categories":
-        cats = [
-            {"category_id": cid, "category_name": name}
-            for name, cid in sorted(live_cat_map.items(), key=lambda x: x[1])
-        ]
-        return cats
-
-    if action == "get_live_streams":
-        return live_streams
-
-    if action == "get_vod_categories":
-        cats = [
-            {"category_id": cid, "category_name": name}
-            for name, cid in sorted(vod_cat_map.items(), key=lambda x: x[1])
-        ]
-        return cats
-
-    if action == "get_vod_streams":
-        return vod_streams
-
     if action == "get_vod_info":
         if not vod_id:
             raise HTTPException(400, "vod_id mancante")
+        cache_data = load_xtream_cache(request, xt)
+        movie_items = [M3UItem.from_dict(m) for m in cache_data.get("movie_items", [])]
         return build_vod_info(request, vod_id, movie_items)
 
-    if action == "get_series_categories":
-        cats = [
-            {"category_id": cid, "category_name": name}
-            for name, cid in sorted(series_cat_map.items(), key=lambda x: x[1])
-        ]
-        return cats
-
-    if action == "get_series":
-        out = []
-        for sid, s in series_map.items():
-            out.append({
-                "series_id": s["series_id"],
-                "name": s["name"],
-                "cover": s["cover"],
-                "plot": s["plot"],
-                "rating": s["rating"],
-                "category_id": s["category_id"],
-            })
-        return out
-
-    if action == "get_series_info":
-        if not series_id:
-            raise HTTPException(400, "series_id mancante")
-        s = series_map.get(str(series_id))
-        if not s:
-            raise HTTPException(404, "Serie non trovata")
-        info = {
-            "name": s["name"],
-            "cover": s["cover"],
-            "plot": s["plot"],
-            "rating": s["rating"],
-            "releaseDate": "",
-            "stream_type": "series",
-            "series_id": s["series_id"],
-        }
-        return {"info": info, "episodes": s["episodes_by_season"], "seasons": []}
-
     raise HTTPException(400, f"action non supportata: {action}")
 
+_SERIES_INDEX_CACHE: Dict[str, Tuple[str, Dict[str, List[Any]]]] = {}
+
+def _series_index(xt_id: str, manifest: Dict[str, Any]) -> Dict[str, List[Any]]:
+    """``series_id → [offset, length, sha1]``, memoized per cache build."""
+    name = (manifest.get("series_info") or {}).get("index", "")
+    cached = _SERIES_INDEX_CACHE.get(xt_id)
+    if cached and cached[0] == name:
+        return cached[1]
+    index = load_json(os.path.join(_artifacts_dir(xt_id), name), {}) if name else {}
+    _SERIES_INDEX_CACHE[xt_id] = (name, index)
+    return index
+
+def _serve_series_info(request: Request,
+                       xt: Dict[str, Any],
+                       series_id: Optional[str],
+                       manifest: Dict[str, Any]):
+    """Serve the precomputed ``get_series_info`` body of one series."""
+    if not series_id:
+        raise HTTPException(400, "series_id mancante")
+    xt_id = str(xt.get("id"))
+    entry = _series_index(xt_id, manifest).get(str(series_id))
+    if not entry:
+        raise HTTPException(404, "Serie non trovata")
+    offset, length, digest = entry
+    templated = bool(manifest.get("templated"))
+    host = request_base(request) if templated else ""
+    etag = content_etag(digest, host)
+    headers = validator_headers(etag, manifest.get("built_at"))
+    if is_not_modified(request, etag, manifest.get("built_at")):
+        return not_modified_response(headers)
+    with open(os.path.join(_artifacts_dir(xt_id), manifest["series_info"]["bin"]), "rb") as f:
+        f.seek(offset)
+        body = f.read(length)
+    if templated:
+        body = render_host(body, host)
+    return Response(body, media_type="application/json", headers=headers)
+
 # ====== XTREAM: PANEL API (alias) ======
 #
 # In Xtream Codes the ``panel_api.php`` endpoint is just an alias of
@@ -760,7 +1959,8 @@ def xt_panel_api(request: Request,
                  username: Optional[str] = None,
                  password: Optional[str] = None,
                  vod_id: Optional[str] = None,
-                 series_id: Optional[str] = None):
+                 series_id: Optional[str] = None,
+                 category_id: Optional[str] = None):
     return xt_player_api(
         request,
         xt_id,
@@ -769,6 +1969,7 @@ def xt_panel_api(request: Request,
         password=password,
         vod_id=vod_id,
         series_id=series_id,
+        category_id=category_id,
     )
 
 # ====== ROOT ALIASES ======
@@ -784,7 +1985,8 @@ def player_api(request: Request,
                password: Optional[str] = None,
                xt_id: Optional[str] = None,
                vod_id: Optional[str] = None,
-               series_id: Optional[str] = None):
+               series_id: Optional[str] = None,
+               category_id: Optional[str] = None):
     xts = _xtreams()
     if len(xts) == 1 and not xt_id:
         xt_id = xts[0].get("id")
@@ -798,6 +2000,7 @@ def player_api(request: Request,
         password=password,
         vod_id=vod_id,
         series_id=series_id,
+        category_id=category_id,
     )
 
 @router.get("/panel_api.php")
@@ -807,7 +2010,8 @@ def panel_api(request: Request,
               password: Optional[str] = None,
               xt_id: Optional[str] = None,
               vod_id: Optional[str] = None,
-              series_id: Optional[str] = None):
+              series_id: Optional[str] = None,
+              category_id: Optional[str] = None):
     xts = _xtreams()
     if len(xts) == 1 and not xt_id:
         xt_id = xts[0].get("id")
@@ -821,6 +2025,7 @@ def panel_api(request: Request,
         password=password,
         vod_id=vod_id,
         series_id=series_id,
+        category_id=category_id,
     )
 
 # ====== XTREAM: GET.PHP (playlist M3U) ======
@@ -835,15 +2040,49 @@ def xt_get_php(request: Request,
         raise HTTPException(401, "Unauthorized")
     xt = require_xtream(xt_id, username, password)
 
-    live_items  = items_for_xtream_selection(xt.get("live_list_ids", []))
-    movie_items = items_for_xtream_selection(xt.get("movie_list_ids", []) + xt.get("mixed_list_ids", []))
-    series_items= items_for_xtream_selection(xt.get("series_list_ids", []) + xt.get("mixed_list_ids", []))
+    return _serve_artifact(request, xt, "get.php", media_type="audio/mpegurl")
+
+def _serve_artifact(request: Request,
+                    xt: Dict[str, Any],
+                    name: str,
+                    media_type: str,
+                    manifest: Optional[Dict[str, Any]] = None):
+    if manifest is None:
+        manifest = load_xtream_manifest(request, xt)
+    meta = manifest.get("artifacts", {}).get(name, {})
+    return artifact_response(
+        request,
+        os.path.join(_artifacts_dir(xt.get("id")), meta.get("file", "")),
+        meta,
+        media_type=media_type,
+        last_modified=manifest.get("built_at"),
+    )
 
-    live_streams, _  = build_live_streams(request, live_items)
-    vod_streams, _   = build_vod_streams(request, movie_items)
-    series_map, _    = build_series_collections(request, series_items)
+def _serve_category(request: Request,
+                    xt: Dict[str, Any],
+                    action: str,
+                    category_id: str,
+                    manifest: Dict[str, Any]):
+    """Serve the pre-rendered streams of one category (``[]`` when unknown)."""
+    kind = CATEGORY_ACTIONS[action]
+    adir = _artifacts_dir(xt.get("id"))
+    meta = load_json(os.path.join(adir, manifest.get("categories", "")), {}).get(kind, {}).get(str(category_id))
+    if not meta:
+        etag = content_etag(manifest.get("etag", ""), action, category_id)
+        return conditional_json(request, etag, manifest.get("built_at"), lambda: [])
+    return artifact_response(
+        request,
+        os.path.join(adir, meta["file"]),
+        meta,
+        media_type="application/json",
+        last_modified=manifest.get("built_at"),
+    )
 
-    lines = ["#EXTM3U"]
+def render_get_php(live_streams: Iterable[Dict[str, Any]],
+                   vod_streams: Iterable[Dict[str, Any]],
+                   series_map: Dict[str, Dict[str, Any]]) -> Iterable[str]:
+    """Yield the lines of the ``get.php`` M3U for already built structures."""
+    yield "#EXTM3U"
 
     for s in live_streams:
         name = s["name"]
@@ -851,8 +2090,8 @@ def xt_get_php(request: Request,
         grp  = s.get("category_name") or s.get("category_id", "")
         tvgid = s.get("epg_channel_id", "")
         url = s["direct_source"]
-        lines.append(f'#EXTINF:-1 tvg-id="{tvgid}" tvg-logo="{logo}" group-title="{grp}",{name}')
-        lines.append(url)
+        yield f'#EXTINF:-1 tvg-id="{tvgid}" tvg-logo="{logo}" group-title="{grp}",{name}'
+        yield url
 
     for s in vod_streams:
         name = s["name"]
@@ -865,8 +2104,8 @@ def xt_get_php(request: Request,
             dur = 0
         if dur <= 0:
             dur = 1
-        lines.append(f'#EXTINF:{dur} tvg-logo="{logo}" group-title="{grp}",{name}')
-        lines.append(url)
+        yield f'#EXTINF:{dur} tvg-logo="{logo}" group-title="{grp}",{name}'
+        yield url
 
     for sid, sm in series_map.items():
         cover = sm["cover"]
@@ -881,11 +2120,8 @@ def xt_get_php(request: Request,
                     dur = 0
                 if dur <= 0:
                     dur = 1
-                lines.append(f'#EXTINF:{dur} tvg-logo="{cover}" group-title="{grp}",{title}')
-                lines.append(url)
-
-    txt = "\n".join(lines) + "\n"
-    return PlainTextResponse(txt, media_type="audio/mpegurl")
+                yield f'#EXTINF:{dur} tvg-logo="{cover}" group-title="{grp}",{title}'
+                yield url
 
 # ====== XTREAM WRAPPERS (disabilitati: 404 guidato) ======
 @router.get("/xtream/{xt_id}/live/{u}/{p}/{stream_id}.{ext}")
@@ -0,0 +1,54 @@
+"""Benchmark ``direct_source`` generation on a synthetic 100k-item playlist.
+
+Compares the previous per-item path (settings read, two ``urlparse``, a
+``parse_qs`` and a quote for every stream) with a :class:`BuildContext`
+created once per build.
+
+    python benchmarks/bench_direct_source.py [N]
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("CONFIG_DIR", tempfile.mkdtemp(prefix="bench_cfg_"))
+
+from app import xtream_manager as xtm  # noqa: E402
+
+
+class Req:
+    base_url = "http://bench.local:8791/"
+
+
+def legacy_direct_video(request, url: str) -> str:
+    base = xtm.stream_resolver_base(request)
+    if xtm._already_direct(url, base, "video"):
+        return url
+    return f"{base}/video?u={xtm.enc(url)}"
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    urls = [f"http://provider.example/movie/user/pass/{i}.mp4?token=abc{i}" for i in range(n)]
+    req = Req()
+
+    t0 = time.perf_counter()
+    old = [legacy_direct_video(req, u) for u in urls]
+    t_old = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ctx = xtm.BuildContext.for_request(req)
+    new = [ctx.direct_video(u) for u in urls]
+    t_new = time.perf_counter() - t0
+
+    assert old == new
+    print(f"items={n}")
+    print(f"per-item legacy path:      {t_old:.3f}s ({t_old / n * 1e6:.2f} us/item)")
+    print(f"BuildContext.direct_video:  {t_new:.3f}s ({t_new / n * 1e6:.2f} us/item)")
+    print(f"speedup: {t_old / t_new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Adversarial ``#EXTINF`` lines: ``M3U_LINE`` regex vs :func:`parse_extinf`.
+
+Each case is timed at growing line lengths; the regex grows quadratically on
+long blank runs while the tokenizer stays linear.  A well-formed playlist
+line is timed too, to check the common case did not get slower.
+
+    python benchmarks/bench_extinf_parser.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("CONFIG_DIR", tempfile.mkdtemp(prefix="bench_cfg_"))
+
+from app import xtream_manager as xtm  # noqa: E402
+
+CASES = {
+    "blank run, no comma": lambda n: "#EXTINF:-1" + " " * n,
+    "blank runs between attrs": lambda n: "#EXTINF:-1" + (" " * 8 + 'a="b"') * (n // 13) + " x",
+    "unbalanced quotes": lambda n: "#EXTINF:-1" + ' a="b' * (n // 5),
+    "many attributes": lambda n: "#EXTINF:-1" + ' tvg-x="y"' * (n // 10) + ",Title",
+}
+WELL_FORMED = ('#EXTINF:-1 tvg-id="rai1.it" tvg-name="Rai 1" tvg-logo="http://img.example/rai1.png" '
+               'group-title="Intrattenimento",Rai 1 HD')
+
+
+def timed(fn, line, repeat=1):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(line)
+    return (time.perf_counter() - t0) / repeat
+
+
+def main() -> None:
+    for name, make in CASES.items():
+        print(name)
+        for n in (1_000, 4_000, 16_000):
+            line = make(n)
+            t_re = timed(xtm.M3U_LINE.match, line)
+            t_tok = timed(xtm.parse_extinf, line)
+            print(f"  len={len(line):6d}  regex {t_re * 1e3:9.2f} ms   tokenizer {t_tok * 1e3:7.3f} ms")
+
+    n = 100_000
+    t_re = timed(lambda l: xtm.ATTR_RE.findall(xtm.M3U_LINE.match(l).group("attrs")), WELL_FORMED, n)
+    t_tok = timed(xtm.parse_extinf, WELL_FORMED, n)
+    print(f"well-formed line: regex+findall {t_re * 1e6:.2f} us, tokenizer {t_tok * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Memory of a parsed synthetic 200k-entry playlist.
+
+Compares the previous representation (a plain dataclass with a full
+``attrs`` dict per item) with the slotted :class:`M3UItem` returned by
+``parse_m3u``.  Both are measured with ``tracemalloc`` while parsing.
+
+    python benchmarks/bench_m3uitem_memory.py [N]
+"""
+import os
+import sys
+import tempfile
+import tracemalloc
+from dataclasses import dataclass
+from typing import Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("CONFIG_DIR", tempfile.mkdtemp(prefix="bench_cfg_"))
+
+from app import xtream_manager as xtm  # noqa: E402
+
+
+@dataclass
+class LegacyM3UItem:
+    title: str
+    url: str
+    attrs: Dict[str, str]
+    group: str
+    tvg_id: str
+    tvg_logo: str
+    raw: str
+
+
+def legacy_parse(text: str):
+    items = []
+    last_inf = None
+    for line in text.splitlines():
+        if line.startswith("#EXTINF:"):
+            m = xtm.M3U_LINE.match(line)
+            if not m:
+                continue
+            attrs = {k.lower(): v for k, v in xtm.ATTR_RE.findall(m.group("attrs") or "")}
+            last_inf = (attrs, m.group("title").strip())
+        elif line and not line.startswith("#"):
+            if last_inf:
+                attrs, title = last_inf
+                items.append(LegacyM3UItem(
+                    title=title, url=line.strip(), attrs=attrs,
+                    group=attrs.get("group-title", "").strip(),
+                    tvg_id=attrs.get("tvg-id", "").strip(),
+                    tvg_logo=attrs.get("tvg-logo", "").strip(), raw="",
+                ))
+                last_inf = None
+    return items
+
+
+def synthetic_playlist(n: int) -> str:
+    lines = ["#EXTM3U"]
+    for i in range(n):
+        show = i // 40
+        lines.append(
+            f'#EXTINF:-1 tvg-id="show{show}.it" tvg-name="Show {show}" '
+            f'tvg-logo="http://img.example/{show}.png" group-title="Serie TV {show % 50}",'
+            f"Show {show} S{i % 40 // 10 + 1:02d}E{i % 10 + 1:02d}"
+        )
+        lines.append(f"http://provider.example/series/user/pass/{show}/{i % 40 // 10 + 1}/{i % 10 + 1}.mkv")
+    return "\n".join(lines) + "\n"
+
+
+def measure(parse, text: str):
+    tracemalloc.start()
+    items = parse(text)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return items, current, peak
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    text = synthetic_playlist(n)
+
+    old, old_cur, old_peak = measure(legacy_parse, text)
+    del old
+    new, new_cur, new_peak = measure(xtm.parse_m3u, text)
+    assert len(new) == n
+
+    mb = 1024 * 1024
+    print(f"items={n} source={len(text) / mb:.1f} MiB")
+    print(f"dataclass + attrs dict: retained {old_cur / mb:7.1f} MiB, peak {old_peak / mb:7.1f} MiB")
+    print(f"slotted M3UItem:        retained {new_cur / mb:7.1f} MiB, peak {new_peak / mb:7.1f} MiB")
+    print(f"retained ratio: {old_cur / new_cur:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Scaling of ``parse_m3u_file`` over 1, 2, 4 and 8 worker processes.
+
+Parses (and classifies) a synthetic provider dump of N entries, 2N lines.
+Each pool is warmed up first so process start-up is not counted.
+
+    python benchmarks/bench_parallel_parse.py [N]
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("CONFIG_DIR", tempfile.mkdtemp(prefix="bench_cfg_"))
+
+from app import xtream_manager as xtm  # noqa: E402
+from bench_m3uitem_memory import synthetic_playlist  # noqa: E402
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 250_000
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_pl_"), "dump.m3u")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(synthetic_playlist(n))
+    xtm.PARALLEL_PARSE_BYTES = 0
+    print(f"entries={n} size={os.path.getsize(path) / 2**20:.1f} MiB cpus={os.cpu_count()}")
+
+    baseline = None
+    for workers in (1, 2, 4, 8):
+        if workers > 1:
+            xtm.parse_m3u_file(path, workers=workers)  # warm the pool up
+        xtm._URL_CLASSES.clear()
+        t0 = time.perf_counter()
+        items = xtm.parse_m3u_file(path, workers=workers)
+        if workers == 1:
+            for it in items:
+                xtm.classify_url(it.url)
+        elapsed = time.perf_counter() - t0
+        baseline = baseline or elapsed
+        print(f"workers={workers}: {elapsed:.2f}s  speedup {baseline / elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
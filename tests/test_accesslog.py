@@ -0,0 +1,72 @@
+import io
+import json
+import logging
+import pathlib
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from app import accesslog, main
+
+
+@pytest.fixture
+def access_lines(monkeypatch):
+    monkeypatch.setattr(accesslog, "ACCESS_LOG", True)
+    buf = io.StringIO()
+    accesslog.start_access_log(buf)
+    lines = []
+
+    def read():
+        accesslog.stop_access_log()
+        lines.extend(json.loads(line) for line in buf.getvalue().splitlines())
+        return lines
+
+    yield read
+    accesslog.stop_access_log()
+
+
+def test_access_log_is_structured_without_headers(access_lines):
+    client = TestClient(main.APP)
+    client.get("/health?password=secret", headers={"Authorization": "Bearer x"})
+    [line] = access_lines()
+    assert line["method"] == "GET"
+    assert line["path"] == "/health"
+    assert line["status"] == 200
+    assert line["duration_ms"] >= 0
+    assert "headers" not in line and "query" not in line
+
+
+def test_access_log_samples_successes_only(access_lines, monkeypatch):
+    monkeypatch.setattr(accesslog, "ACCESS_LOG_SAMPLE", 0.0)
+    client = TestClient(main.APP)
+    client.get("/health")
+    client.get("/lists/missing.m3u")
+    assert [(l["path"], l["status"]) for l in access_lines()] == [("/lists/missing.m3u", 404)]
+
+
+@pytest.fixture
+def debug_level():
+    level = accesslog.logger.level
+    accesslog.logger.setLevel(logging.DEBUG)
+    yield
+    accesslog.logger.setLevel(level)
+
+
+def test_debug_access_log_redacts_credentials(access_lines, debug_level):
+    client = TestClient(main.APP)
+    client.get("/health?username=u&password=secret", headers={"Authorization": "Bearer x"})
+    [line] = access_lines()
+    assert line["query"] == "username=u&password=%2A%2A%2A"
+    assert line["headers"]["authorization"] == "***"
+
+
+def test_note_attaches_fields_to_current_request():
+    accesslog.note(resolver="ignored")  # outside a request: no-op
+    fields = accesslog.begin_request()
+    accesslog.note(resolver="vavoo_resolver.py", cache="hit")
+    assert fields == {"resolver": "vavoo_resolver.py", "cache": "hit"}
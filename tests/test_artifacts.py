@@ -0,0 +1,134 @@
+import asyncio
+import gzip
+import io
+import pathlib
+import sys
+
+import pytest
+from starlette.requests import Request
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from app import artifacts
+
+
+def make_request(headers=None):
+    return Request(
+        {
+            "type": "http",
+            "scheme": "http",
+            "server": ("test", 80),
+            "path": "/",
+            "headers": headers or [],
+        }
+    )
+
+
+def test_write_artifact_writes_gzip_variant(tmp_path):
+    body = b"#EXTM3U\n" + b"#EXTINF:-1,Channel\nhttp://example.com/stream\n" * 200
+    path = str(tmp_path / "list.m3u")
+    meta = artifacts.write_artifact(path, [body])
+    assert meta["size"] == len(body)
+    assert "gzip" in meta["encodings"]
+    with gzip.open(path + ".gz", "rb") as f:
+        assert f.read() == body
+
+
+def test_small_artifacts_are_not_compressed(tmp_path):
+    path = str(tmp_path / "small.json")
+    meta = artifacts.write_artifact(path, [b"[]"])
+    assert meta["encodings"] == {}
+    assert not (tmp_path / "small.json.gz").exists()
+
+
+def test_artifact_response_picks_accepted_encoding(tmp_path):
+    body = b"x" * 4096
+    path = str(tmp_path / "body.json")
+    meta = artifacts.write_artifact(path, [body])
+
+    plain = artifacts.artifact_response(make_request(), path, meta, "application/json")
+    assert plain.path == path
+    assert "content-encoding" not in plain.headers
+
+    req = make_request([(b"accept-encoding", b"gzip;q=1.0, zstd;q=0")])
+    gz = artifacts.artifact_response(req, path, meta, "application/json")
+    assert gz.path == path + ".gz"
+    assert gz.headers["content-encoding"] == "gzip"
+    assert gz.headers["vary"] == "Accept-Encoding"
+    assert gz.headers["etag"] != plain.headers["etag"]
+
+    req = make_request([(b"accept-encoding", b"gzip"), (b"if-none-match", gz.headers["etag"].encode())])
+    assert artifacts.artifact_response(req, path, meta, "application/json").status_code == 304
+
+
+def test_artifact_response_prefers_zstd(tmp_path):
+    pytest.importorskip("zstandard")
+    path = str(tmp_path / "body.json")
+    meta = artifacts.write_artifact(path, [b"y" * 4096])
+    req = make_request([(b"accept-encoding", b"gzip, deflate, zstd")])
+    resp = artifacts.artifact_response(req, path, meta, "application/json")
+    assert resp.path == path + ".zst"
+    assert resp.headers["content-encoding"] == "zstd"
+
+
+def _collect(resp):
+    async def collect():
+        return b"".join([chunk async for chunk in resp.body_iterator])
+    return asyncio.run(collect())
+
+
+def test_templated_artifact_splices_tokens_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "CHUNK_SIZE", 7)
+    tok = artifacts.HOST_TOKEN.encode()
+    chunks = [b"a" + tok[:5], tok[5:] + b"/tv?u=1\n" + tok, b"/video?u=2\n", tok + tok]
+    path = str(tmp_path / "get.php")
+    meta = artifacts.write_artifact(path, chunks, compress=False, templated=True)
+    assert meta["tokens"] == 4 and meta["templated"]
+
+    resp = artifacts.artifact_response(make_request([(b"accept-encoding", b"gzip")]), path, meta, "text/plain")
+    body = _collect(resp)
+    assert body == b"".join(chunks).replace(tok, b"http://test")
+    assert int(resp.headers["content-length"]) == len(body)
+    assert "content-encoding" not in resp.headers
+    assert not (tmp_path / "hosts").exists()
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_templated_artifact_compressed_per_segment(tmp_path, encoding):
+    if encoding == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+    tok = artifacts.HOST_TOKEN.encode()
+    rows = [b'{"direct_source":"' + tok + b"/tv?u=" + str(i).encode() + b'"},' for i in range(300)]
+    chunks = [tok + b"[" + b"".join(rows[:150]), b"".join(rows[150:]) + b"{}]" + tok]
+    path = str(tmp_path / "live.json")
+    meta = artifacts.write_artifact(path, chunks, templated=True)
+    assert encoding in meta["encodings"]
+    assert meta["encodings"][encoding] < meta["size"]
+
+    req = make_request([(b"accept-encoding", encoding.encode())])
+    resp = artifacts.artifact_response(req, path, meta, "application/json")
+    data = _collect(resp)
+    assert resp.headers["content-encoding"] == encoding
+    assert int(resp.headers["content-length"]) == len(data)
+    if encoding == "gzip":
+        plain = gzip.decompress(data)
+    else:
+        plain = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True).read()
+    assert plain == b"".join(chunks).replace(tok, b"http://test")
+
+    other = make_request([(b"accept-encoding", encoding.encode()), (b"host", b"other:81")])
+    assert artifacts.artifact_response(other, path, meta, "application/json").headers["etag"] != resp.headers["etag"]
+
+
+def test_file_validators_follow_atomic_rewrites(tmp_path):
+    path = tmp_path / "settings.json"
+    assert artifacts.file_validators(str(path)) == (artifacts.content_etag(b""), None)
+    path.write_text('{"a": 1}', encoding="utf-8")
+    first = artifacts.file_validators(str(path))
+    assert first == artifacts.file_validators(str(path))
+    tmp = tmp_path / "settings.json.tmp"
+    tmp.write_text('{"a": 2}', encoding="utf-8")
+    tmp.replace(path)
+    assert artifacts.file_validators(str(path))[0] != first[0]
@@ -107,3 +107,55 @@ def test_make_direct_functions_avoid_double_encoding(xm):
     already_live = f"{base}/tv?u=http%3A%2F%2Fexample.com%2Fstream.m3u8"
     assert xm.make_direct_video(req, already_video) == already_video
     assert xm.make_direct_live(req, already_live) == already_live
+
+
+def test_build_context_direct_source(xm):
+    ctx = xm.BuildContext("http://testserver")
+    src = "http://example.com/movie/1.mp4?a=1&b=2"
+    assert ctx.direct_video(src) == f"http://testserver/video?u={xm.enc(src)}"
+    assert ctx.direct_live(src) == f"http://testserver/tv?u={xm.enc(src)}"
+    wrapped = f"https://testserver/video?u={xm.enc(src)}"
+    assert ctx.direct_video(wrapped) == wrapped
+    # same host but not a resolver endpoint: still wrapped
+    other = "http://testserver/videos/1.mp4"
+    assert ctx.direct_video(other) == f"http://testserver/video?u={xm.enc(other)}"
+
+
+def test_templated_build_context_keeps_resolver_urls(xm, monkeypatch):
+    monkeypatch.setattr(xm, "configured_resolver_base", lambda: "")
+    monkeypatch.setattr(xm, "_playlists_index", lambda: [{"id": "p", "resolver_url": "http://lan:8791"}])
+    ctx = xm.BuildContext.for_cache()
+    assert ctx.templated
+    src = "http://example.com/movie/1.mp4"
+    # per-playlist resolver_url wrappers: our host is unknown at build time
+    video = f"http://lan:8791/video?u={xm.enc(src)}"
+    live = f"http://lan:8791/tv?u={xm.enc(src)}"
+    assert ctx.direct_video(video) == video
+    assert ctx.direct_live(live) == live
+    assert ctx.direct_video(src) == f"{xm.HOST_TOKEN}/video?u={xm.enc(src)}"
+    other = "http://lan:8791/videos/1.mp4"
+    assert ctx.direct_video(other) == f"{xm.HOST_TOKEN}/video?u={xm.enc(other)}"
+    # someone else's resolver is wrapped like any other source
+    foreign = f"http://elsewhere:8080/video?u={xm.enc(src)}"
+    assert ctx.direct_video(foreign) == f"{xm.HOST_TOKEN}/video?u={xm.enc(foreign)}"
+    # the host of the request that started the build is ours as well
+    req_ctx = xm.BuildContext(xm.HOST_TOKEN, request_netloc="elsewhere:8080")
+    assert req_ctx.direct_video(foreign) == foreign
+    assert req_ctx.fragment_key == xm.HOST_TOKEN
+
+
+def test_parse_m3u_compact_items(xm):
+    text = (
+        "#EXTM3U\n"
+        '#EXTINF:-1 tvg-id="a.it" tvg-logo="http://img/a.png" group-title="News" tvg-year="2001",A\n'
+        "http://example.com/live/a\n"
+        '#EXTINF:-1 tvg-logo="http://img/a.png" group-title="News",B\n'
+        "http://example.com/live/b\n"
+    )
+    a, b = xm.parse_m3u(text)
+    assert a.attrs == {"tvg-id": "a.it", "tvg-logo": "http://img/a.png",
+                       "group-title": "News", "tvg-year": "2001"}
+    assert a.group is b.group
+    assert a.tvg_logo is b.tvg_logo
+    assert not hasattr(a, "__dict__")
+    assert xm.M3UItem.from_dict(a.to_dict()) == a
@@ -29,3 +29,29 @@ def test_get_category_id_concurrent(tmp_path):
     for name in names:
         assert name in data
         assert data[name] == xtm.stable_category_id(name, 1000)
+
+
+def test_build_persists_new_categories_once(tmp_path, monkeypatch):
+    xtm = import_xtm(tmp_path)
+    items = [
+        xtm.M3UItem(title=f"Ch {i}", url=f"http://example.com/live/chan{i:06d}",
+                    attrs={}, group=f"Group {i}", tvg_id="", tvg_logo="", raw="")
+        for i in range(50)
+    ]
+    writes = []
+    real_save = xtm.save_json
+
+    def counting_save(path, data):
+        if path == xtm.CATEGORY_IDS_JSON:
+            writes.append(dict(data))
+        return real_save(path, data)
+
+    monkeypatch.setattr(xtm, "save_json", counting_save)
+
+    class Req:
+        base_url = "http://testserver/"
+
+    streams, cat_map = xtm.build_live_streams(Req(), items)
+    assert len(cat_map) == 50
+    assert len(writes) == 1
+    assert all(writes[0][name] == cid for name, cid in cat_map.items())
@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import io
+import random
+import pathlib
+import sys
+
+import httpx
+import pytest
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from app import main
+from app import xtream_manager as xtm
+
+PLAYLIST = (
+    "#EXTM3U\r\n"
+    '#EXTINF:-1 tvg-id="a.it" group-title="News",Canale è\r\n'
+    "#EXTVLCOPT:http-user-agent=Mozilla/5.0\r\n"
+    "#KODIPROP:inputstream.adaptive.license_type=widevine\r\n"
+    "http://example.com/live/aaaaaa1\r\n"
+    "#EXTINF:-1,Other\r\n"
+    "http://example.com/live/bbbbbb2\r\n"
+)
+
+
+def test_iter_m3u_keeps_options_with_entry():
+    first, second = xtm.iter_m3u(io.StringIO(PLAYLIST, newline=""))
+    assert first.title == "Canale è"
+    assert first.url == "http://example.com/live/aaaaaa1"
+    assert first.group == "News"
+    assert first.options == [
+        "#EXTVLCOPT:http-user-agent=Mozilla/5.0",
+        "#KODIPROP:inputstream.adaptive.license_type=widevine",
+    ]
+    assert second.options == []
+    assert xtm.parse_m3u(PLAYLIST) == [first, second]
+
+
+def test_aiter_m3u_over_split_byte_chunks():
+    data = PLAYLIST.encode("utf-8")
+
+    async def chunks():
+        for i in range(0, len(data), 7):
+            yield data[i:i + 7]
+
+    async def collect():
+        return [it async for it in xtm.aiter_m3u(chunks())]
+
+    assert asyncio.run(collect()) == xtm.parse_m3u(PLAYLIST)
+
+
+def test_convert_keeps_options_attached():
+    settings = {"stream_resolver_url": "http://resolver"}
+    src = PLAYLIST + "#EXTINF:-1,Dup\r\n#EXTVLCOPT:x=y\r\nhttp://example.com/live/aaaaaa1\r\n"
+    out = main.convert_playlist_text(src, "tv", settings).splitlines()
+    assert out[:5] == [
+        "#EXTM3U",
+        '#EXTINF:-1 tvg-id="a.it" group-title="News",Canale è',
+        "#EXTVLCOPT:http-user-agent=Mozilla/5.0",
+        "#KODIPROP:inputstream.adaptive.license_type=widevine",
+        f"http://resolver/tv?u={main._enc('http://example.com/live/aaaaaa1')}",
+    ]
+    assert "#EXTVLCOPT:x=y" not in out
+    assert main.convert_playlist_text("", "tv", settings) == "#EXTM3U\n"
+
+
+def test_cr_only_line_endings():
+    cr = PLAYLIST.replace("\r\n", "\r")
+    expected = xtm.parse_m3u(PLAYLIST)
+    assert len(expected) == 2
+    assert xtm.parse_m3u(cr) == expected
+
+    data = cr.encode("utf-8")
+
+    async def chunks():
+        # CR-only lines, then a CRLF split between two chunks
+        yield data
+        yield b"#EXTINF:-1,Third\r"
+        yield b"\nhttp://example.com/live/cccccc3"
+
+    async def collect():
+        return [it async for it in xtm.aiter_m3u(chunks())]
+
+    items = asyncio.run(collect())
+    assert items[:2] == expected
+    assert [it.url for it in items[2:]] == ["http://example.com/live/cccccc3"]
+
+    settings = {"stream_resolver_url": "http://resolver"}
+    assert (main.convert_playlist_text(cr, "tv", settings)
+            == main.convert_playlist_text(PLAYLIST, "tv", settings))
+
+
+def _regex_extinf(line):
+    m = xtm.M3U_LINE.match(line)
+    if not m:
+        return None
+    attrs = {k.lower(): v for k, v in xtm.ATTR_RE.findall(m.group("attrs") or "")}
+    return m.group("duration"), attrs, m.group("title").strip()
+
+
+def test_parse_extinf_matches_regex_on_well_formed_lines():
+    rnd = random.Random(1234)
+    blanks = ["", " ", "  ", "\t"]
+    attrs = ['tvg-id="a.it"', 'tvg-logo="http://x/y.png"', 'group-title="A, B"', 'tvg-name=""',
+             'TVG-Name="É"', 'x="="', "tvg-id", '"', "=", "x"]
+    titles = ["Title", " é ", "S01E02", '"q"', ",", "a=b", ""]
+    compared = 0
+    for _ in range(20000):
+        line = "#EXTINF:" + rnd.choice(["-1", "0", "12", "", "1.5"])
+        for _ in range(rnd.randint(0, 4)):
+            line += rnd.choice(blanks) + rnd.choice(attrs)
+        line += rnd.choice(blanks) + rnd.choice([",", ",", ""]) + "".join(
+            rnd.choice(titles + blanks) for _ in range(rnd.randint(0, 3)))
+        expected = _regex_extinf(line)
+        if expected is None:
+            assert xtm.parse_extinf(line) is not None
+            continue
+        assert xtm.parse_extinf(line) == expected, line
+        compared += 1
+    assert compared > 1000
+
+
+def test_parse_extinf_recovers_malformed_lines():
+    assert xtm.parse_extinf('#EXTINF:-1 tvg-id=abc group-title="News,Sport') == (
+        "-1", {"tvg-id": "abc", "group-title": "News"}, "Sport")
+    assert xtm.parse_extinf("#EXTINF:-1 stray words,Title") == ("-1", {}, "Title")
+    assert xtm.parse_extinf('#EXTINF:-1 junk tvg-id="x",T') == ("-1", {"tvg-id": "x"}, "T")
+    assert xtm.parse_extinf('#EXTINF:-1 tvg-id="x" " = a/b group-title="A, B" tail,T') == (
+        "-1", {"tvg-id": "x", "group-title": "A, B"}, "T")
+    assert xtm.parse_extinf('#EXTINF:10.5 tvg-name="Name"') == ("10.5", {"tvg-name": "Name"}, "")
+    assert xtm.parse_m3u('#EXTINF:-1 tvg-name="Name"\nhttp://example.com/a\n')[0].title == "Name"
+
+
+def test_parallel_parse_matches_sequential(tmp_path, monkeypatch):
+    lines = ["#EXTM3U"]
+    for i in range(300):
+        lines.append(f'#EXTINF:-1 tvg-id="c{i}" group-title="G{i % 7}",Item {i}')
+        if i % 5 == 0:
+            lines.append("#EXTVLCOPT:http-user-agent=UA")
+        lines.append(f"http://example.com/movie/u/p/{i}.mp4")
+    path = tmp_path / "big.m3u"
+    path.write_text("\r\n".join(lines) + "\r\n", encoding="utf-8")
+
+    points = xtm._split_points(str(path), 8)
+    assert points[0] == 0 and points[-1] == path.stat().st_size
+    sliced = []
+    for a, b in zip(points, points[1:]):
+        sliced.extend(xtm.M3UItem.from_fields(*f) for f, _ in xtm._parse_slice(str(path), a, b))
+    expected = xtm.parse_m3u_file(str(path), workers=1)
+    assert sliced == expected
+    assert len(expected) == 300
+
+    monkeypatch.setattr(xtm, "PARALLEL_PARSE_BYTES", 0)
+    try:
+        parsed = xtm.parse_m3u_file(str(path), workers=2)
+    finally:
+        xtm.shutdown_parse_pool()
+    assert xtm._PARSE_POOL is None
+    assert parsed == expected
+    # the worker classes travel with the entries, not through the bounded memo
+    assert parsed[7]._cls is not None and parsed[7].url_class.movie_id == "7"
+
+
+def test_url_class_memo_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(xtm, "URL_CLASS_CACHE_SIZE", 2)
+    monkeypatch.setattr(xtm, "_URL_CLASSES", xtm.OrderedDict())
+    xtm.classify_url("http://example.com/movie/u/p/1.mp4")
+    xtm.classify_url("http://example.com/movie/u/p/2.mp4")
+    xtm.classify_url("http://example.com/movie/u/p/1.mp4")
+    xtm.classify_url("http://example.com/movie/u/p/3.mp4")
+    assert list(xtm._URL_CLASSES) == ["http://example.com/movie/u/p/1.mp4",
+                                      "http://example.com/movie/u/p/3.mp4"]
+
+
+def _mock_upstream(monkeypatch, body: bytes):
+    real_client = httpx.AsyncClient
+
+    def handler(request):
+        return httpx.Response(200, content=body, headers={"content-type": "audio/x-mpegurl"})
+
+    monkeypatch.setattr(
+        httpx, "AsyncClient",
+        lambda **kw: real_client(transport=httpx.MockTransport(handler), **kw),
+    )
+
+
+def test_convert_url_to_file_streams_to_disk(monkeypatch, tmp_path):
+    src = PLAYLIST * 200
+    _mock_upstream(monkeypatch, src.encode("utf-8"))
+    settings = {"stream_resolver_url": "http://resolver"}
+    out = tmp_path / "out.m3u"
+    meta = asyncio.run(main.convert_url_to_file("http://upstream/list.m3u", "tv", settings, str(out)))
+    assert out.read_text(encoding="utf-8") == main.convert_playlist_text(src, "tv", settings)
+    assert meta["size"] == out.stat().st_size
+    assert "gzip" in meta["encodings"]
+
+
+def test_download_playlist_spools_in_a_thread(monkeypatch, tmp_path):
+    src = (PLAYLIST * 200).encode("utf-8")
+    _mock_upstream(monkeypatch, src)
+    monkeypatch.setattr(main, "SPOOL_BATCH_SIZE", 4096)
+    threads = []
+    real_run = main.run_in_threadpool
+
+    async def spy(fn, *args):
+        threads.append(fn)
+        return await real_run(fn, *args)
+
+    monkeypatch.setattr(main, "run_in_threadpool", spy)
+    dest = tmp_path / "src.m3u"
+    meta = asyncio.run(main.download_playlist("http://upstream/list.m3u", str(dest)))
+    assert dest.read_bytes() == src
+    assert meta["sha1"] == hashlib.sha1(src).hexdigest()
+    assert threads  # hashing and writes ran in the threadpool
+
+
+def test_convert_url_to_file_enforces_max_size(monkeypatch, tmp_path):
+    _mock_upstream(monkeypatch, PLAYLIST.encode("utf-8") * 100)
+    monkeypatch.setattr(main, "MAX_PLAYLIST_BYTES", 1000)
+    out = tmp_path / "out.m3u"
+    out.write_text("#EXTM3U\nold\n", encoding="utf-8")
+
+    async def convert():
+        lines = main.stream_lines("http://upstream/list.m3u")
+        return [line async for line in lines]
+
+    with pytest.raises(main.PlaylistTooLarge):
+        asyncio.run(convert())
+    with pytest.raises(main.PlaylistTooLarge):
+        asyncio.run(main.convert_url_to_file("http://upstream/list.m3u", "tv", {}, str(out)))
+    assert out.read_text(encoding="utf-8") == "#EXTM3U\nold\n"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["out.m3u"]
+
+
+def test_shared_upstream_client_limits_per_host(monkeypatch):
+    real_client = httpx.AsyncClient
+    created = []
+    active = {"now": 0, "peak": 0}
+
+    async def handler(request):
+        active["now"] += 1
+        active["peak"] = max(active["peak"], active["now"])
+        await asyncio.sleep(0.01)
+        active["now"] -= 1
+        return httpx.Response(200, content=PLAYLIST.encode("utf-8"))
+
+    def factory(**kw):
+        created.append(kw)
+        return real_client(transport=httpx.MockTransport(handler), **kw)
+
+    monkeypatch.setattr(httpx, "AsyncClient", factory)
+    monkeypatch.setattr(main, "UPSTREAM_MAX_PER_HOST", 2)
+
+    async def fetch():
+        return [line async for line in main.stream_lines("http://upstream/list.m3u")]
+
+    async def run():
+        await main.start_upstream_client()
+        try:
+            return await asyncio.gather(*(fetch() for _ in range(6)))
+        finally:
+            await main.close_upstream_client()
+
+    results = asyncio.run(run())
+    assert all(r == results[0] for r in results)
+    assert len(created) == 1
+    assert isinstance(created[0]["timeout"], httpx.Timeout)
+    assert active["peak"] == 2
+    assert main._UPSTREAM is None
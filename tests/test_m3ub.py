@@ -0,0 +1,73 @@
+import importlib
+import os
+import pathlib
+import sys
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+
+def setup_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("CONFIG_DIR", str(tmp_path))
+    monkeypatch.setenv("APP_DIR", str(tmp_path))
+    import app.xtream_manager as xtm
+    importlib.reload(xtm)
+    return xtm
+
+
+PLAYLIST = (
+    "#EXTM3U\n"
+    '#EXTINF:-1 tvg-id="a.it" tvg-logo="http://img/a.png" group-title="Serie" tvg-year="2001",Show S01E01\n'
+    "http://example.com/series/7/1/1\n"
+    '#EXTINF:-1 tvg-logo="http://img/a.png" group-title="Serie",Show S01E02 àè\n'
+    "http://example.com/series/7/1/2\n"
+)
+
+
+def write_playlist(xtm, pid, text=PLAYLIST):
+    with open(xtm._playlist_file(pid), "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_sidecar_round_trip(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    write_playlist(xtm, "p")
+    assert xtm.write_playlist_sidecar("p") == 2
+    expected = xtm.parse_m3u(PLAYLIST)
+
+    mapped = xtm.open_sidecar(xtm._sidecar_file("p"), xtm._playlist_stamp("p"), xtm.M3UItem.from_fields)
+    assert len(mapped) == 2
+    assert list(mapped) == expected
+    assert mapped[-1].title == "Show S01E02 àè"
+    assert mapped[0].attrs["tvg-year"] == "2001"
+    mapped.close()
+
+
+def test_read_playlist_uses_sidecar(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    write_playlist(xtm, "p")
+    xtm.write_playlist_sidecar("p")
+    xtm._PARSED_PLAYLISTS.clear()
+
+    def fail_parse(path):  # pragma: no cover - should not be called
+        raise AssertionError("sidecar should be used")
+
+    monkeypatch.setattr(xtm, "parse_m3u_file", fail_parse)
+    items = xtm._read_playlist("p")
+    assert [it.url for it in items] == [
+        "http://example.com/series/7/1/1", "http://example.com/series/7/1/2"]
+
+    # decoded once: later readers (the other fragments) get the same list
+    monkeypatch.setattr(xtm, "open_sidecar", lambda *a: fail_parse(None))
+    assert xtm._read_playlist("p") is items
+
+
+def test_stale_sidecar_is_ignored(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    write_playlist(xtm, "p")
+    xtm.write_playlist_sidecar("p")
+    write_playlist(xtm, "p", "#EXTM3U\n#EXTINF:-1,Only\nhttp://example.com/live/only01\n")
+    os.utime(xtm._playlist_file("p"), ns=(1, 1))
+    assert xtm.open_sidecar(xtm._sidecar_file("p"), xtm._playlist_stamp("p"), xtm.M3UItem.from_fields) is None
+    assert [it.title for it in xtm._read_playlist("p")] == ["Only"]
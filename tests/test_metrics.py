@@ -0,0 +1,70 @@
+import pathlib
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from app import adapter, main, metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    h = metrics.Histogram("test_latency_seconds", "Test latency", ("op",), buckets=(0.1, 1.0))
+    try:
+        h.observe(0.05, "a")
+        h.observe(0.5, "a")
+        h.observe(5, "a")
+        text = h.render()
+    finally:
+        metrics._REGISTRY.remove(h)
+    assert '# TYPE test_latency_seconds histogram' in text
+    assert 'test_latency_seconds_bucket{op="a",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{op="a",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{op="a",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{op="a"} 3' in text
+    assert 'test_latency_seconds_sum{op="a"} 5.55' in text
+
+
+def test_counter_escapes_label_values():
+    c = metrics.Counter("test_total", "Test counter", ("name",))
+    try:
+        c.inc('a"b')
+        c.inc('a"b', amount=2)
+        assert c.render().endswith('test_total{name="a\\"b"} 3\n')
+    finally:
+        metrics._REGISTRY.remove(c)
+
+
+def test_run_resolver_records_modes_and_exit_codes(tmp_path):
+    script = tmp_path / "demo_resolver.py"
+    script.write_text("import sys\nif '--json' in sys.argv: print('http://resolved/x')\nelse: sys.exit(3)\n")
+    before_exit = metrics.RESOLVER_SUBPROCESS_TOTAL.value("argv", "3")
+    before_json = metrics.RESOLVE_SECONDS.count("demo_resolver.py", "json")
+
+    out = adapter.run_resolver(str(script), "http://site/x", "video", python_command=sys.executable)
+    assert out["resolvedUrl"] == "http://resolved/x"
+    assert metrics.RESOLVER_SUBPROCESS_TOTAL.value("argv", "3") == before_exit + 1
+    assert metrics.RESOLVE_SECONDS.count("demo_resolver.py", "json") == before_json + 1
+    assert metrics.RESOLVER_ATTEMPT_SECONDS.count("demo_resolver.py", "argv") >= 1
+
+
+def test_run_resolver_counts_timeouts(tmp_path):
+    script = tmp_path / "slow_resolver.py"
+    script.write_text("import time\ntime.sleep(5)\n")
+    before = metrics.RESOLVER_SUBPROCESS_TOTAL.value("argv", "timeout")
+    with pytest.raises(adapter.ResolverError):
+        adapter.run_resolver(str(script), "http://site/x", "video",
+                             python_command=sys.executable, timeout=0.2)
+    assert metrics.RESOLVER_SUBPROCESS_TOTAL.value("argv", "timeout") == before + 1
+    assert metrics.RESOLVE_SECONDS.count("slow_resolver.py", "failed") >= 1
+
+
+def test_metrics_endpoint_serves_prometheus_text():
+    metrics.CACHE_TOTAL.inc("test", "hit")
+    resp = TestClient(main.APP).get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'cache_requests_total{cache="test",result="hit"}' in resp.text
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import pathlib
+import sys
+
+import httpx
+import pytest
+from starlette.requests import Request
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+import app.main as main
+from app.artifacts import http_date
+import app.xtream_manager as xtm
+
+
+@pytest.fixture
+def invalidated(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, "invalidate_playlists",
+                        lambda pids, rebuild=True: calls.append((list(pids), rebuild)))
+    return calls
+
+
+@pytest.fixture
+def env(monkeypatch, tmp_path, invalidated):
+    index = tmp_path / "playlists.json"
+    monkeypatch.setattr(main, "PLAYLISTS_INDEX", str(index))
+    monkeypatch.setattr(main, "PLAYLISTS_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "SETTINGS_FILE", str(tmp_path / "settings.json"))
+    monkeypatch.setattr(main, "REFRESH_JITTER", 0)
+    monkeypatch.setattr(main, "_REFRESH_LOCKS", {})
+    monkeypatch.setattr(main, "write_playlist_sidecar", lambda pid: 0)
+    now = main._now_ts()
+    index.write_text(json.dumps([
+        {"id": "due", "url": "http://up/due.m3u", "mode": "tv", "every_hours": 1, "last_refresh": now - 7200},
+        {"id": "fresh", "url": "http://up/fresh.m3u", "mode": "tv", "every_hours": 12, "last_refresh": now},
+    ]))
+    return tmp_path
+
+
+def entries():
+    return {it["id"]: it for it in main._read_playlists_index()}
+
+
+def test_scheduler_refreshes_only_due_playlists(env, monkeypatch, invalidated):
+    calls = []
+
+    async def fake_download(url, dest, validators=None):
+        calls.append(url)
+        pathlib.Path(dest).write_text("#EXTM3U\n")
+        return {"etag": "", "last_modified": "", "sha1": "x", "encoding": "utf-8"}
+
+    monkeypatch.setattr(main, "download_playlist", fake_download)
+    assert asyncio.run(main.refresh_due_playlists()) == ["due"]
+    assert calls == ["http://up/due.m3u"]
+    assert entries()["due"]["refresh_result"] == "updated"
+    assert (env / "due.m3u").read_text() == "#EXTM3U\n"
+    assert invalidated == [(["due"], True)]
+    assert asyncio.run(main.refresh_due_playlists()) == []
+
+
+def test_failed_refresh_backs_off(env, monkeypatch):
+    async def failing_download(url, dest, validators=None):
+        raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(main, "download_playlist", failing_download)
+    asyncio.run(main.refresh_due_playlists())
+    due = entries()["due"]
+    assert due["refresh_failures"] == 1
+    assert due["refresh_error"] == "upstream down"
+    assert due["next_retry"] >= main._now_ts() + main.REFRESH_BACKOFF_BASE - 1
+    assert asyncio.run(main.refresh_due_playlists()) == []
+    assert main._refresh_backoff(3) == 4 * main.REFRESH_BACKOFF_BASE
+
+
+def test_refreshes_of_one_playlist_never_overlap(env, monkeypatch):
+    active = set()
+    overlapped = []
+    calls = []
+
+    async def slow_download(url, dest, validators=None):
+        if url in active:
+            overlapped.append(url)
+        active.add(url)
+        calls.append(url)
+        await asyncio.sleep(0.01)
+        active.discard(url)
+        return None
+
+    monkeypatch.setattr(main, "download_playlist", slow_download)
+
+    async def run():
+        await asyncio.gather(main.refresh_playlist("due"), main.refresh_playlist("due"),
+                             main.refresh_playlist("fresh"))
+
+    asyncio.run(run())
+    assert sorted(calls) == ["http://up/due.m3u", "http://up/due.m3u", "http://up/fresh.m3u"]
+    assert overlapped == []
+
+
+def test_conditional_refresh_skips_unchanged_sources(env, monkeypatch):
+    body = {"text": "#EXTM3U\n#EXTINF:-1,A\nhttp://example.com/a\n", "etag": '"v1"'}
+    seen = []
+    real_client = httpx.AsyncClient
+
+    def handler(request):
+        seen.append(request.headers.get("if-none-match"))
+        if body["etag"] and request.headers.get("if-none-match") == body["etag"]:
+            return httpx.Response(304)
+        headers = {"etag": body["etag"]} if body["etag"] else {}
+        return httpx.Response(200, content=body["text"].encode(), headers=headers)
+
+    monkeypatch.setattr(httpx, "AsyncClient",
+                        lambda **kw: real_client(transport=httpx.MockTransport(handler), **kw))
+    conversions = []
+    real_convert = main.convert_file_to_artifact
+    monkeypatch.setattr(main, "convert_file_to_artifact",
+                        lambda *a: conversions.append(a[0]) or real_convert(*a))
+
+    def refresh():
+        return asyncio.run(main.refresh_playlist("due"))["refresh_result"]
+
+    assert refresh() == "updated"
+    assert refresh() == "not_modified"
+    assert seen == [None, '"v1"']
+
+    body["etag"] = ""  # upstream without validators, same content
+    main._update_playlist_entry("due", {"last_change": 1000})
+    assert refresh() == "unchanged"
+    assert len(conversions) == 1
+    # no new content: the served list keeps its Last-Modified
+    resp = main.serve_playlist(Request({"type": "http", "path": "/", "headers": []}), "due")
+    assert resp.headers["last-modified"] == http_date(1000)
+
+    body["text"] += "#EXTINF:-1,B\nhttp://example.com/b\n"
+    assert refresh() == "updated"
+    assert "http://example.com/b" in (env / "due.m3u").read_text()
+
+    # changed conversion parameters: full download and conversion
+    main._update_playlist_entry("due", {"mode": "video"})
+    body["etag"] = '"v2"'
+    assert refresh() == "updated"
+    assert seen[-1] is None
+    assert len(conversions) == 3
+    assert not list(env.glob("*.src"))
+
+
+def test_bulk_refresh_rebuilds_only_affected_xtreams(env, monkeypatch):
+    async def fake_download(url, dest, validators=None):
+        if "fresh" in url:
+            raise RuntimeError("upstream down")
+        pathlib.Path(dest).write_text("#EXTM3U\n")
+        return {"etag": "", "last_modified": "", "sha1": "x", "encoding": "utf-8"}
+
+    xts = [
+        {"id": "xt_due", "live_list_ids": ["due"]},
+        {"id": "xt_fresh", "movie_list_ids": ["fresh"]},
+        {"id": "xt_none", "mixed_list_ids": []},
+    ]
+    rebuilt = []
+
+    def fake_rebuild(xt):
+        rebuilt.append(xt["id"])
+        return {"available_channels": 1}
+
+    monkeypatch.setattr(main, "download_playlist", fake_download)
+    monkeypatch.setattr(xtm, "_xtreams", lambda: xts)
+    monkeypatch.setattr(main, "rebuild_xtream_cache", fake_rebuild)
+
+    report = asyncio.run(main.refresh_playlists())
+    assert report["ok"] is False
+    by_id = {r["id"]: r for r in report["playlists"]}
+    assert by_id["due"]["ok"] and by_id["due"]["result"] == "updated"
+    assert not by_id["fresh"]["ok"] and by_id["fresh"]["error"] == "upstream down"
+    assert all(r["seconds"] >= 0 for r in report["playlists"])
+    assert rebuilt == ["xt_due"]
+    assert report["xtreams"][0]["counts"] == {"available_channels": 1}
+
+    # a second run finds nothing changed: no rebuild
+    rebuilt.clear()
+    report = asyncio.run(main.refresh_playlists(["due"]))
+    assert [r["result"] for r in report["playlists"]] == ["unchanged"]
+    assert report["xtreams"] == [] and rebuilt == []
@@ -1,3 +1,4 @@
+import asyncio
 import importlib
 import os
 import pathlib
@@ -10,18 +11,25 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
 
-def make_request():
+def make_request(headers=None):
     return Request(
         {
             "type": "http",
             "scheme": "http",
             "server": ("test", 80),
             "path": "/",
-            "headers": [],
+            "headers": headers or [],
         }
     )
 
 
+def response_text(resp):
+    """get.php bodies are host-templated, so they are streamed rather than sent as files."""
+    async def collect():
+        return b"".join([chunk async for chunk in resp.body_iterator])
+    return asyncio.run(collect()).decode("utf-8")
+
+
 def test_xt_get_php_uses_durations(monkeypatch, tmp_path):
     os_env = {
         "CONFIG_DIR": str(tmp_path),
@@ -88,7 +96,7 @@ def test_xt_get_php_uses_durations(monkeypatch, tmp_path):
 
     req = make_request()
     resp = xtm.xt_get_php(req, "1", username="u", password="p")
-    body = resp.body.decode()
+    body = response_text(resp)
     lines = body.strip().splitlines()
 
     assert "#EXTINF:-1" in lines[1]
@@ -162,10 +170,59 @@ def test_xt_get_php_defaults_duration_when_invalid(monkeypatch, tmp_path):
 
     req = make_request()
     resp = xtm.xt_get_php(req, "1", username="u", password="p")
-    body = resp.body.decode()
+    body = response_text(resp)
     lines = body.strip().splitlines()
 
     assert "#EXTINF:-1" in lines[1]
     assert "#EXTINF:1" in lines[3]
     assert "#EXTINF:1" in lines[5]
 
+
+
+def test_xt_get_php_served_from_cache_with_etag(monkeypatch, tmp_path):
+    monkeypatch.setenv("CONFIG_DIR", str(tmp_path))
+    monkeypatch.setenv("APP_DIR", str(tmp_path))
+
+    import app.xtream_manager as xtm
+    importlib.reload(xtm)
+
+    live_item = xtm.M3UItem(
+        title="Live One",
+        url="http://example.com/live/abcdefabcdef",
+        attrs={},
+        group="Live",
+        tvg_id="",
+        tvg_logo="",
+        raw="",
+    )
+    xt_conf = {
+        "id": "1",
+        "username": "u",
+        "password": "p",
+        "live_list_ids": ["l"],
+        "movie_list_ids": [],
+        "series_list_ids": [],
+        "mixed_list_ids": [],
+        "every_hours": 12,
+        "last_refresh": xtm.now_ts(),
+    }
+
+    monkeypatch.setattr(xtm, "_xtreams", lambda: [xt_conf])
+    monkeypatch.setattr(xtm, "_read_playlist", lambda pid: {"l": [live_item]}.get(pid, []))
+
+    xtm.build_xtream_cache(make_request(), xt_conf)
+
+    def fail_build(request, xt):  # pragma: no cover - should not be called
+        raise AssertionError("cache should not be rebuilt for get.php")
+
+    monkeypatch.setattr(xtm, "build_xtream_cache", fail_build)
+
+    resp = xtm.xt_get_php(make_request(), "1", username="u", password="p")
+    etag = resp.headers["etag"]
+    assert etag.startswith('"')
+    assert "Live One" in response_text(resp)
+
+    req = make_request([(b"if-none-match", etag.encode())])
+    resp_304 = xtm.xt_get_php(req, "1", username="u", password="p")
+    assert resp_304.status_code == 304
+    assert resp_304.headers["etag"] == etag
@@ -1,4 +1,6 @@
+import asyncio
 import importlib
+import json
 import os
 import pathlib
 import sys
@@ -24,6 +26,19 @@ def make_request():
     )
 
 
+def response_json(resp):
+    """Decode player_api responses, served from memory, from disk or streamed."""
+    path = getattr(resp, "path", None)
+    if path is not None:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    if hasattr(resp, "body_iterator"):
+        async def collect():
+            return b"".join([chunk async for chunk in resp.body_iterator])
+        return json.loads(asyncio.run(collect()))
+    return json.loads(resp.body)
+
+
 def setup_env(monkeypatch, tmp_path):
     os_env = {
         "CONFIG_DIR": str(tmp_path),
@@ -77,7 +92,7 @@ def test_panel_api_same_as_player_api(monkeypatch, tmp_path):
     resp_panel = xtm.xt_panel_api(
         req, "1", username="u", password="p", action="get_live_streams"
     )
-    assert resp_panel == resp_player
+    assert response_json(resp_panel) == response_json(resp_player)
 
 
 def test_default_response_contains_counts(monkeypatch, tmp_path):
@@ -131,14 +146,14 @@ def test_default_response_contains_counts(monkeypatch, tmp_path):
     monkeypatch.setattr(xtm, "_read_playlist", fake_read_playlist)
 
     req = make_request()
-    resp = xtm.xt_player_api(req, "1", username="u", password="p")
+    resp = response_json(xtm.xt_player_api(req, "1", username="u", password="p"))
     assert resp["available_channels"] == 1
     assert resp["available_movies"] == 1
     assert resp["available_series"] == 1
 
     resp_player = xtm.xt_player_api(req, "1", username="u", password="p")
     resp_panel = xtm.xt_panel_api(req, "1", username="u", password="p")
-    assert resp_panel == resp_player
+    assert response_json(resp_panel) == response_json(resp_player)
 
 
 def test_root_player_api_uses_single_xtream(monkeypatch, tmp_path):
@@ -178,7 +193,7 @@ def test_root_player_api_uses_single_xtream(monkeypatch, tmp_path):
     resp_player = xtm.xt_player_api(
         req, "1", username="u", password="p", action="get_live_streams"
     )
-    assert resp_root == resp_player
+    assert response_json(resp_root) == response_json(resp_player)
 
 
 def test_root_player_api_requires_xt_id(monkeypatch, tmp_path):
@@ -266,7 +281,7 @@ def test_root_player_api_accepts_xt_id(monkeypatch, tmp_path):
     resp_player = xtm.xt_player_api(
         req, "1", username="u1", password="p1", action="get_live_streams"
     )
-    assert resp_root == resp_player
+    assert response_json(resp_root) == response_json(resp_player)
 
 
 def test_root_panel_api_alias(monkeypatch, tmp_path):
@@ -308,5 +323,5 @@ def test_root_panel_api_alias(monkeypatch, tmp_path):
     resp_panel = xtm.xt_panel_api(
         req, "1", username="u", password="p", action="get_live_streams"
     )
-    assert resp_root == resp_panel
+    assert response_json(resp_root) == response_json(resp_panel)
 
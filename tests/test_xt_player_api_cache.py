@@ -1,4 +1,6 @@
+import asyncio
 import importlib
+import json
 import os
 import pathlib
 import sys
@@ -11,6 +13,7 @@ ROOT_DIR = pathlib.Path(__file__).resolve().parents[1]
 if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
+from app import metrics
 
 def make_request():
     return Request(
@@ -24,6 +27,21 @@ def make_request():
     )
 
 
+def response_body(resp):
+    if hasattr(resp, "path"):
+        with open(resp.path, "rb") as f:
+            return f.read()
+    if hasattr(resp, "body_iterator"):
+        async def collect():
+            return b"".join([chunk async for chunk in resp.body_iterator])
+        return asyncio.run(collect())
+    return resp.body
+
+
+def response_json(resp):
+    return json.loads(response_body(resp))
+
+
 def setup_env(monkeypatch, tmp_path):
     os_env = {
         "CONFIG_DIR": str(tmp_path),
@@ -77,10 +95,10 @@ def test_xt_player_api_uses_cache(monkeypatch, tmp_path):
     xtm.build_xtream_cache(req, xt_conf)
 
     # ensure subsequent calls use cache and do not attempt to re-read playlists
-    def fail_items(sel_ids):  # pragma: no cover - should not be called
+    def fail_read(pid):  # pragma: no cover - should not be called
         raise AssertionError("playlist should not be parsed when cache valid")
 
-    monkeypatch.setattr(xtm, "items_for_xtream_selection", fail_items)
+    monkeypatch.setattr(xtm, "_read_playlist", fail_read)
 
     resp = xtm.xt_player_api(
         req, "1", username="u", password="p", action="get_live_streams"
@@ -89,5 +107,279 @@ def test_xt_player_api_uses_cache(monkeypatch, tmp_path):
     cache_data = xtm.load_json(
         os.path.join(tmp_path, "xtream_cache", "1.json"), {}
     )
-    assert resp == cache_data["live_streams"]
+    # the cache is host-templated; the response is rendered for the request host
+    expected = json.loads(json.dumps(cache_data["live_streams"]).replace(xtm.HOST_TOKEN, "http://test"))
+    assert response_json(resp) == expected
+
+
+
+def test_xt_player_api_conditional_get_skips_cache_load(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+
+    live_item = xtm.M3UItem(
+        title="Live One",
+        url="http://example.com/live/abcdefabcdef",
+        attrs={},
+        group="Live",
+        tvg_id="",
+        tvg_logo="",
+        raw="",
+    )
+    xt_conf = {
+        "id": "1",
+        "username": "u",
+        "password": "p",
+        "live_list_ids": ["l"],
+        "movie_list_ids": [],
+        "series_list_ids": [],
+        "mixed_list_ids": [],
+        "every_hours": 12,
+        "last_refresh": xtm.now_ts(),
+    }
+    monkeypatch.setattr(xtm, "_xtreams", lambda: [xt_conf])
+    monkeypatch.setattr(xtm, "_read_playlist", lambda pid: {"l": [live_item]}.get(pid, []))
+    xtm.build_xtream_cache(make_request(), xt_conf)
+
+    resp = xtm.xt_player_api(
+        make_request(), "1", username="u", password="p", action="get_live_categories"
+    )
+    assert response_json(resp) == [{"category_id": xtm.stable_category_id("Live", 1000), "category_name": "Live"}]
+    etag = resp.headers["etag"]
+    last_modified = resp.headers["last-modified"]
+
+    def fail_load(request, xt):  # pragma: no cover - should not be called
+        raise AssertionError("cache body should not be loaded for a 304")
+
+    monkeypatch.setattr(xtm, "load_xtream_cache", fail_load)
+
+    for header in ((b"if-none-match", etag.encode()), (b"if-modified-since", last_modified.encode())):
+        req = Request({
+            "type": "http",
+            "scheme": "http",
+            "server": ("test", 80),
+            "path": "/",
+            "headers": [header],
+        })
+        resp_304 = xtm.xt_player_api(
+            req, "1", username="u", password="p", action="get_live_categories"
+        )
+        assert resp_304.status_code == 304
+        assert resp_304.headers["etag"] == etag
+
+
+def test_xt_player_api_filters_streams_by_category(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+
+    items = [
+        xtm.M3UItem(title=f"{grp} {i}", url=f"http://example.com/live/{grp.lower()}{i:08d}",
+                    attrs={}, group=grp, tvg_id="", tvg_logo="", raw="")
+        for grp in ("News", "Sport") for i in range(3)
+    ]
+    xt_conf = {
+        "id": "1",
+        "username": "u",
+        "password": "p",
+        "live_list_ids": ["l"],
+        "movie_list_ids": [],
+        "series_list_ids": [],
+        "mixed_list_ids": [],
+        "every_hours": 12,
+        "last_refresh": xtm.now_ts(),
+    }
+    monkeypatch.setattr(xtm, "_xtreams", lambda: [xt_conf])
+    monkeypatch.setattr(xtm, "_read_playlist", lambda pid: {"l": items}.get(pid, []))
+    cache = xtm.build_xtream_cache(make_request(), xt_conf)
+
+    sport_id = cache["live_categories"]["Sport"]
+    assert cache["category_index"]["live"][sport_id] == [3, 4, 5]
+
+    calls = metrics.PLAYER_API_SECONDS.count("get_live_streams")
+    sizes = metrics.PLAYER_API_BYTES.count("get_live_streams")
+    resp = xtm.xt_player_api(
+        make_request(), "1", username="u", password="p",
+        action="get_live_streams", category_id=sport_id,
+    )
+    streams = response_json(resp)
+    assert [s["name"] for s in streams] == ["Sport 0", "Sport 1", "Sport 2"]
+    assert [s["num"] for s in streams] == [4, 5, 6]
+    assert metrics.PLAYER_API_SECONDS.count("get_live_streams") == calls + 1
+    assert metrics.PLAYER_API_BYTES.count("get_live_streams") == sizes + 1
+
+    resp = xtm.xt_player_api(
+        make_request(), "1", username="u", password="p",
+        action="get_live_streams", category_id="999999",
+    )
+    assert json.loads(resp.body) == []
+
+
+def test_templated_cache_serves_every_host(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+
+    live_item = xtm.M3UItem(
+        title="Live One",
+        url="http://example.com/live/abcdefabcdef",
+        attrs={},
+        group="Live",
+        tvg_id="",
+        tvg_logo="",
+        raw="",
+    )
+    xt_conf = {
+        "id": "1",
+        "username": "u",
+        "password": "p",
+        "live_list_ids": ["l"],
+        "movie_list_ids": [],
+        "series_list_ids": [],
+        "mixed_list_ids": [],
+        "every_hours": 12,
+        "last_refresh": xtm.now_ts(),
+    }
+    monkeypatch.setattr(xtm, "_xtreams", lambda: [xt_conf])
+    monkeypatch.setattr(xtm, "_read_playlist", lambda pid: {"l": [live_item]}.get(pid, []))
+    xtm.build_xtream_cache(make_request(), xt_conf)
+
+    def fail_build(request, xt):  # pragma: no cover - should not be called
+        raise AssertionError("one build should serve every host")
+
+    monkeypatch.setattr(xtm, "build_xtream_cache", fail_build)
+
+    def request_for(host):
+        return Request({
+            "type": "http",
+            "scheme": "http",
+            "server": (host, 8791),
+            "path": "/",
+            "headers": [],
+        })
+
+    bodies = {}
+    for host in ("lan.local", "public.example"):
+        resp = xtm.xt_get_php(request_for(host), "1", username="u", password="p")
+        body = response_body(resp)
+        assert int(resp.headers["content-length"]) == len(body)
+        bodies[host] = (resp.headers["etag"], body.decode("utf-8"))
+
+    assert f"http://lan.local:8791/tv?u={xtm.enc(live_item.url)}" in bodies["lan.local"][1]
+    assert f"http://public.example:8791/tv?u={xtm.enc(live_item.url)}" in bodies["public.example"][1]
+    assert xtm.HOST_TOKEN not in bodies["lan.local"][1]
+    assert bodies["lan.local"][0] != bodies["public.example"][0]
+    assert not (tmp_path / "xtream_cache" / "1" / "hosts").exists()
+
+
+def test_xt_player_api_series_info_from_index(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+
+    items = [
+        xtm.M3UItem(title=f"Show S{s:02d}E{e:02d}", url=f"http://example.com/series/7/{s}/{e}",
+                    attrs={}, group="Serie", tvg_id="", tvg_logo="", raw="")
+        for s, e in ((10, 1), (2, 10), (2, 9), (1, 1))
+    ]
+    xt_conf = {
+        "id": "1",
+        "username": "u",
+        "password": "p",
+        "live_list_ids": [],
+        "movie_list_ids": [],
+        "series_list_ids": ["s"],
+        "mixed_list_ids": [],
+        "every_hours": 12,
+        "last_refresh": xtm.now_ts(),
+    }
+    monkeypatch.setattr(xtm, "_xtreams", lambda: [xt_conf])
+    monkeypatch.setattr(xtm, "_read_playlist", lambda pid: {"s": items}.get(pid, []))
+    xtm.build_xtream_cache(make_request(), xt_conf)
+
+    def fail_load(request, xt):  # pragma: no cover - should not be called
+        raise AssertionError("series bodies should not load the cache")
+
+    monkeypatch.setattr(xtm, "load_xtream_cache", fail_load)
+
+    series = response_json(xtm.xt_player_api(make_request(), "1", username="u", password="p",
+                                             action="get_series"))
+    assert [s["series_id"] for s in series] == ["7"]
+
+    resp = xtm.xt_player_api(make_request(), "1", username="u", password="p",
+                             action="get_series_info", series_id="7")
+    info = response_json(resp)
+    assert list(info["episodes"]) == ["1", "2", "10"]
+    assert [e["title"] for e in info["episodes"]["2"]] == ["S02E09", "S02E10"]
+    assert xtm.HOST_TOKEN not in resp.body.decode()
+
+    req = Request({
+        "type": "http",
+        "scheme": "http",
+        "server": ("test", 80),
+        "path": "/",
+        "headers": [(b"if-none-match", resp.headers["etag"].encode())],
+    })
+    assert xtm.xt_player_api(req, "1", username="u", password="p",
+                             action="get_series_info", series_id="7").status_code == 304
+
+    with pytest.raises(xtm.HTTPException) as exc:
+        xtm.xt_player_api(make_request(), "1", username="u", password="p",
+                          action="get_series_info", series_id="8")
+    assert exc.value.status_code == 404
+
+
+def test_series_info_survives_rebuild_with_old_manifest(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    items = [xtm.M3UItem(title="Show S01E01", url="http://example.com/series/7/1/1",
+                         attrs={}, group="Serie", tvg_id="", tvg_logo="", raw="")]
+    xt_conf = {"id": "1", "series_list_ids": ["s"]}
+    monkeypatch.setattr(xtm, "_read_playlist", lambda pid: list(items))
+    xtm.build_xtream_cache(None, xt_conf)
+    old_manifest = xtm.load_json(xtm._manifest_file("1"), {})
+    old = xtm._serve_series_info(make_request(), xt_conf, "7", old_manifest)
+
+    # a request that loaded the manifest before a rebuild keeps a coherent body
+    items.insert(0, xtm.M3UItem(title="Other S01E01", url="http://example.com/series/3/1/1",
+                                attrs={}, group="Serie", tvg_id="", tvg_logo="", raw=""))
+    xtm.build_xtream_cache(None, xt_conf)
+    again = xtm._serve_series_info(make_request(), xt_conf, "7", old_manifest)
+    assert again.body == old.body
+    assert again.headers["etag"] == old.headers["etag"]
+
+    new_manifest = xtm.load_json(xtm._manifest_file("1"), {})
+    assert new_manifest["series_info"] != old_manifest["series_info"]
+    assert response_json(xtm._serve_series_info(make_request(), xt_conf, "3", new_manifest))["info"]["series_id"] == "3"
+
+    # only the current and the previous build are kept on disk
+    xtm.build_xtream_cache(None, xt_conf)
+    names = [n for n in os.listdir(xtm._artifacts_dir("1")) if n.startswith("series_info.")]
+    assert len(names) == 2
+
+
+def test_artifacts_survive_rebuild_with_old_manifest(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    items = [xtm.M3UItem(title=f"Live {i}", url=f"http://example.com/live/{i:012d}",
+                         attrs={}, group="News", tvg_id="", tvg_logo="", raw="") for i in range(3)]
+    xt_conf = {"id": "1", "live_list_ids": ["l"]}
+    monkeypatch.setattr(xtm, "_read_playlist", lambda pid: list(items))
+    xtm.build_xtream_cache(None, xt_conf)
+    old_manifest = xtm.load_json(xtm._manifest_file("1"), {})
+    cid = next(iter(xtm.load_json(os.path.join(xtm._artifacts_dir("1"), old_manifest["categories"]), {})["live"]))
+
+    def serve(manifest):
+        resp = xtm._serve_artifact(make_request(), xt_conf, "get_live_streams", "application/json", manifest)
+        cat = xtm._serve_category(make_request(), xt_conf, "get_live_streams", cid, manifest)
+        return [(r.headers["etag"], r.headers["content-length"], response_body(r)) for r in (resp, cat)]
+
+    old = serve(old_manifest)
+    for etag, length, body in old:
+        assert int(length) == len(body)
+
+    # a rebuild does not touch the files the old manifest points to
+    items.append(xtm.M3UItem(title="Live 9", url="http://example.com/live/000000000009",
+                             attrs={}, group="News", tvg_id="", tvg_logo="", raw=""))
+    xtm.build_xtream_cache(None, xt_conf)
+    assert serve(old_manifest) == old
+    new = serve(xtm.load_json(xtm._manifest_file("1"), {}))
+    assert b"Live 9" in new[0][2] and new[0][0] != old[0][0]
 
+    # only the current and the previous build are kept on disk
+    xtm.build_xtream_cache(None, xt_conf)
+    adir = xtm._artifacts_dir("1")
+    for d in (adir, os.path.join(adir, "cat")):
+        builds = {n.split(".")[1] for n in os.listdir(d) if n != "manifest.json" and "." in n}
+        assert len(builds) == 2
@@ -0,0 +1,292 @@
+import importlib
+import os
+import pathlib
+import sys
+
+from starlette.requests import Request
+
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+
+def make_request():
+    return Request(
+        {
+            "type": "http",
+            "scheme": "http",
+            "server": ("test", 80),
+            "path": "/",
+            "headers": [],
+        }
+    )
+
+
+def setup_env(monkeypatch, tmp_path):
+    os_env = {
+        "CONFIG_DIR": str(tmp_path),
+        "APP_DIR": str(tmp_path),
+    }
+    for k, v in os_env.items():
+        monkeypatch.setenv(k, v)
+
+    import app.xtream_manager as xtm
+    importlib.reload(xtm)
+    return xtm
+
+
+def write_playlist(xtm, pid, entries):
+    lines = ["#EXTM3U"]
+    for title, group, url in entries:
+        lines.append(f'#EXTINF:-1 group-title="{group}",{title}')
+        lines.append(url)
+    with open(xtm._playlist_file(pid), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def test_rebuild_only_reparses_changed_playlists(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    write_playlist(xtm, "a", [("A1", "News", "http://example.com/live/aaaaaa1"),
+                              ("A2", "News", "http://example.com/live/aaaaaa2")])
+    write_playlist(xtm, "b", [("B1", "Sport", "http://example.com/live/bbbbbb1")])
+    xt_conf = {
+        "id": "1",
+        "live_list_ids": ["a", "b"],
+        "movie_list_ids": [],
+        "series_list_ids": [],
+        "mixed_list_ids": [],
+    }
+
+    parsed = []
+    real_read = xtm._read_playlist
+
+    def counting_read(pid):
+        parsed.append(pid)
+        return real_read(pid)
+
+    monkeypatch.setattr(xtm, "_read_playlist", counting_read)
+    req = make_request()
+
+    first = xtm.build_xtream_cache(req, xt_conf)
+    assert parsed == ["a", "b"]
+    assert [s["name"] for s in first["live_streams"]] == ["A1", "A2", "B1"]
+
+    parsed.clear()
+    write_playlist(xtm, "b", [("B1", "Sport", "http://example.com/live/bbbbbb1"),
+                              ("B2", "Sport", "http://example.com/live/bbbbbb2")])
+    second = xtm.build_xtream_cache(req, xt_conf)
+    assert parsed == ["b"]
+    assert [s["name"] for s in second["live_streams"]] == ["A1", "A2", "B1", "B2"]
+    assert [s["num"] for s in second["live_streams"]] == [1, 2, 3, 4]
+    assert second["counts"]["available_channels"] == 4
+    assert set(second["live_categories"]) == {"News", "Sport"}
+
+    parsed.clear()
+    xtm.build_xtream_cache(req, xt_conf)
+    assert parsed == []
+
+
+def test_series_fragments_merge_episodes(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    write_playlist(xtm, "s1", [("Show S01E02", "Serie", "http://example.com/series/7/1/2")])
+    write_playlist(xtm, "s2", [("Show S01E01", "Serie", "http://example.com/series/7/1/1")])
+    xt_conf = {
+        "id": "1",
+        "live_list_ids": [],
+        "movie_list_ids": [],
+        "series_list_ids": ["s1", "s2"],
+        "mixed_list_ids": [],
+    }
+    cache = xtm.build_xtream_cache(make_request(), xt_conf)
+    eps = cache["series_map"]["7"]["episodes_by_season"]["1"]
+    assert [e["title"] for e in eps] == ["S01E01", "S01E02"]
+    assert os.path.exists(xtm._fragment_file("s1", "series"))
+
+
+def test_read_playlist_parses_once_per_change(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    write_playlist(xtm, "m", [("M1", "Film", "http://example.com/movie/1")])
+
+    parses = []
+    real_parse = xtm.parse_m3u_file
+
+    def counting_parse(path):
+        parses.append(path)
+        return real_parse(path)
+
+    monkeypatch.setattr(xtm, "parse_m3u_file", counting_parse)
+    first = xtm._read_playlist("m")
+    assert xtm._read_playlist("m") is first
+    assert len(parses) == 1
+
+    write_playlist(xtm, "m", [("M1", "Film", "http://example.com/movie/1"),
+                              ("M2", "Film", "http://example.com/movie/2")])
+    os.utime(xtm._playlist_file("m"), ns=(1, 1))
+    assert [it.title for it in xtm._read_playlist("m")] == ["M1", "M2"]
+    assert len(parses) == 2
+    assert xtm._read_playlist("missing") == []
+
+
+def test_playlist_cache_evicts_over_budget(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    write_playlist(xtm, "a", [("A1", "News", "http://example.com/live/aaaaaa1")])
+    write_playlist(xtm, "b", [("B1", "News", "http://example.com/live/bbbbbb1")])
+    size = os.path.getsize(xtm._playlist_file("a"))
+    monkeypatch.setattr(xtm, "PLAYLIST_CACHE_BYTES", size + 1)
+    xtm._read_playlist("a")
+    xtm._read_playlist("b")
+    assert list(xtm._PARSED_PLAYLISTS) == ["b"]
+
+
+def test_playlist_invalidation_marks_only_dependents(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    write_playlist(xtm, "a", [("A1", "News", "http://example.com/live/aaaaaa1")])
+    write_playlist(xtm, "b", [("B1", "News", "http://example.com/live/bbbbbb1")])
+    xtm._save_xtreams([
+        {"id": "x1", "live_list_ids": ["a"], "every_hours": 12},
+        {"id": "x2", "live_list_ids": ["b"], "mixed_list_ids": ["a"], "every_hours": 12},
+        {"id": "x3", "live_list_ids": ["b"], "every_hours": 12},
+    ], overwrite=True)
+    for xt in xtm._xtreams():
+        xtm.rebuild_xtream_cache(xt)
+    assert xtm.xtream_dependents() == {"a": ["x1", "x2"], "b": ["x2", "x3"]}
+
+    assert xtm.invalidate_playlists(["a"], rebuild=False) == ["x1", "x2"]
+    stale = {x["id"]: xtm._cache_expired(x) for x in xtm._xtreams()}
+    assert stale == {"x1": True, "x2": True, "x3": False}
+
+    write_playlist(xtm, "a", [("A1", "News", "http://example.com/live/aaaaaa1"),
+                              ("A2", "News", "http://example.com/live/aaaaaa2")])
+    os.utime(xtm._playlist_file("a"), ns=(1, 1))
+    assert xtm.queue_xtream_rebuilds(["x1", "x2"]) == ["x1", "x2"]
+    xtm._REBUILD_POOL.shutdown(wait=True)
+    monkeypatch.setattr(xtm, "_REBUILD_POOL", None)
+    assert not any(xtm._cache_expired(x) for x in xtm._xtreams())
+    cache = xtm.load_xtream_cache(make_request(), xtm._xtreams()[0])
+    assert [s["name"] for s in cache["live_streams"]] == ["A1", "A2"]
+
+    # the index follows config edits
+    xtm._save_xtreams([{"id": "x3", "live_list_ids": ["a"]}])
+    assert xtm.xtream_dependents()["a"] == ["x1", "x2", "x3"]
+
+
+def test_rebuild_skipped_when_refreshed_while_waiting(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    write_playlist(xtm, "a", [("A1", "News", "http://example.com/live/aaaaaa1")])
+    xtm._save_xtreams([{"id": "x1", "live_list_ids": ["a"], "every_hours": 12}], overwrite=True)
+    xtm.rebuild_xtream_cache(xtm._xtreams()[0])
+    # the caller read the config while it was stale, before that build ended
+    waiting = dict(xtm._xtreams()[0], last_refresh=1, stale_since=1)
+
+    def fail_build(request, xt):  # pragma: no cover - should not be called
+        raise AssertionError("the cache was already rebuilt")
+
+    monkeypatch.setattr(xtm, "build_xtream_cache", fail_build)
+    cache = xtm.load_xtream_cache(make_request(), waiting)
+    assert [s["name"] for s in cache["live_streams"]] == ["A1"]
+    assert not xtm._cache_expired(waiting)
+
+
+def test_fragments_of_removed_playlists_are_dropped(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    write_playlist(xtm, "a", [("A1", "News", "http://example.com/live/aaaaaa1")])
+    write_playlist(xtm, "b", [("B1", "News", "http://example.com/live/bbbbbb1")])
+    xt = {"id": "x1", "live_list_ids": ["a"], "mixed_list_ids": ["b"]}
+    xtm._save_xtreams([xt], overwrite=True)
+    xtm.build_xtream_cache(None, xt)
+    assert sorted(os.listdir(xtm.XTREAM_FRAGMENTS_DIR)) == ["a.live.json", "b.series.json", "b.vod.json"]
+
+    # deleted playlist: fragments and parsed copy go at once
+    assert "b" in xtm._PARSED_PLAYLISTS
+    xtm.forget_playlist("b")
+    assert "b" not in xtm._PARSED_PLAYLISTS
+    assert sorted(os.listdir(xtm.XTREAM_FRAGMENTS_DIR)) == ["a.live.json"]
+
+    # playlist no longer listed by any config: pruned by the next build
+    xt = {"id": "x1", "live_list_ids": ["b"]}
+    xtm._save_xtreams([xt], overwrite=True)
+    xtm.build_xtream_cache(None, xt)
+    assert sorted(os.listdir(xtm.XTREAM_FRAGMENTS_DIR)) == ["b.live.json"]
+
+
+def test_merge_dedups_across_playlists(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    write_playlist(xtm, "a", [("A1", "News", "http://example.com/live/aaaaaa1"),
+                              ("Shared", "News", "http://EXAMPLE.com:80/live/shared1")])
+    write_playlist(xtm, "b", [("Shared B", "Sport", "http://resolver/tv?u=http%3A%2F%2Fexample.com%2Flive%2Fshared1"),
+                              ("B2", "Sport", "http://example.com/live/bbbbbb2")])
+    xt_conf = {"id": "1", "live_list_ids": ["a", "b"]}
+
+    cache = xtm.build_xtream_cache(None, xt_conf)
+    assert [s["name"] for s in cache["live_streams"]] == ["A1", "Shared", "B2"]
+    assert [s["num"] for s in cache["live_streams"]] == [1, 2, 3]
+    assert cache["counts"]["available_channels"] == 3
+    assert cache["counts"]["duplicates_removed"] == 1
+
+    cache = xtm.build_xtream_cache(None, {**xt_conf, "dedup_prefer": ["b"]})
+    assert [s["name"] for s in cache["live_streams"]] == ["A1", "Shared B", "B2"]
+
+    cache = xtm.build_xtream_cache(None, {**xt_conf, "dedup": []})
+    assert len(cache["live_streams"]) == 4
+
+
+def test_merge_dedups_live_by_tvg_id():
+    from app import xtream_manager as xtm
+
+    def stream(name, tvg, cat):
+        return {"name": name, "epg_channel_id": tvg, "category_name": cat, "category_id": "1"}
+
+    frags = [
+        {"streams": [stream("HD", "rai1.it", "News")], "keys": ["http://a/1"]},
+        {"streams": [stream("SD", "RAI1.it", "Other"), stream("X", "", "Other")],
+         "keys": ["http://b/1", "http://b/2"]},
+    ]
+    streams, cats = xtm._merge_stream_fragments(frags, ["a", "b"], ["url", "tvg_id"], "last")
+    assert [s["name"] for s in streams] == ["SD", "X"]
+    assert cats == {"Other": "1"}
+    streams, cats = xtm._merge_stream_fragments(frags, ["a", "b"], ["url"], "first")
+    assert [s["name"] for s in streams] == ["HD", "SD", "X"]
+
+
+def test_tvg_id_dedup_keeps_variants_within_one_playlist(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+
+    def write_tvg(pid, entries):
+        lines = ["#EXTM3U"]
+        for title, tvg, url in entries:
+            lines += [f'#EXTINF:-1 tvg-id="{tvg}" group-title="News",{title}', url]
+        with open(xtm._playlist_file(pid), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    write_tvg("a", [("Rai 1 HD", "rai1.it", "http://example.com/live/rai1hd"),
+                    ("Rai 1 SD", "rai1.it", "http://example.com/live/rai1sd"),
+                    ("Rai 1 +1", "rai1.it", "http://example.com/live/rai1p1")])
+    write_tvg("b", [("Rai 1", "RAI1.it", "http://other.com/live/rai1"),
+                    ("Rai 2", "rai2.it", "http://other.com/live/rai2")])
+
+    only_a = xtm.build_xtream_cache(None, {"id": "1", "live_list_ids": ["a"], "dedup": ["url", "tvg_id"]})
+    assert only_a["counts"]["available_channels"] == 3
+    assert only_a["counts"]["duplicates_removed"] == 0
+
+    both = xtm.build_xtream_cache(None, {"id": "1", "live_list_ids": ["a", "b"], "dedup": ["url", "tvg_id"]})
+    assert [s["name"] for s in both["live_streams"]] == ["Rai 1 HD", "Rai 1 SD", "Rai 1 +1", "Rai 2"]
+    assert both["counts"]["duplicates_removed"] == 1
+
+    # tvg-id is opt-in: the default only compares URLs
+    assert xtm.DEFAULT_DEDUP == ["url"]
+    default = xtm.build_xtream_cache(None, {"id": "1", "live_list_ids": ["a", "b"]})
+    assert default["counts"]["available_channels"] == 5
+
+
+def test_vod_dedup_ignores_non_movie_items(monkeypatch, tmp_path):
+    xtm = setup_env(monkeypatch, tmp_path)
+    shared = "http://example.com/series/7/1/1"
+    write_playlist(xtm, "a", [("Show S01E01", "Serie", shared),
+                              ("Movie X", "Film", "http://example.com/movie/1")])
+    write_playlist(xtm, "b", [("Movie Y", "Film", shared),
+                              ("Movie X again", "Film", "http://example.com/movie/1")])
+    cache = xtm.build_xtream_cache(None, {"id": "1", "movie_list_ids": ["a", "b"]})
+    assert [s["name"] for s in cache["vod_streams"]] == ["Movie X", "Movie Y"]
+    assert cache["counts"]["available_movies"] == 2
+    assert cache["counts"]["duplicates_removed"] == 1
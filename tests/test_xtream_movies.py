@@ -22,3 +22,20 @@ def test_try_extract_movie_id_wrapped(xm):
     encoded = urllib.parse.quote(urllib.parse.quote(inner, safe=""), safe="")
     url = f"http://wrapper/video?u={encoded}"
     assert xm.try_extract_movie_id(url) == "789"
+
+
+def test_classify_url_single_record(xm):
+    url = "http://host/series/user/pass/55/2/3.m3u8"
+    info = xm.classify_url(url)
+    assert info.tv_triplet == ("55", 2, 3)
+    assert info.movie_id is None
+    assert info.live_id == "lv_3.m3u8"
+    assert xm.classify_url(url) is info
+    assert xm.classify_url("http://host/movie/1").live_id.startswith("lv_")
+
+
+def test_classify_url_bounds_decoding(xm):
+    inner = "http://host/movie/42"
+    for _ in range(20):
+        inner = urllib.parse.quote(inner, safe="")
+    assert xm.classify_url(f"http://wrapper/video?u={inner}").movie_id is None